@@ -1,18 +1,45 @@
+from benchmarks import register_benchmark_commands
+from bulk_import import IMPORT_FORMATS, import_properties, read_rows
 from data_models import *
 import datetime
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, flash
+from facets import compute_facets, rebuild_facet_counts
+from feature_dictionary import FeatureDictionary, normalize_feature_names
+import click
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from flask import Flask, Response, jsonify, request, flash, send_file, stream_with_context
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_sock import Sock
 from flask_swagger_ui import get_swaggerui_blueprint
+from fulltext import FTS_TABLE, build_match_query, relevance
 from functools import wraps
-from get_info import get_lat_long
+from garbage_collector import collect_garbage
+from geo_index import GEO_INDEX_TABLE, haversine_km, parse_geo_filters, squared_distance_km
+from geocoding import GeocodingPool, property_address
+from get_info import geocode_cache
+from image_store import (IMAGE_URL_PREFIX, public_image_url, register_blobs, sniff_image_type, store_legacy_images,
+                         store_uploads, stored_file_path)
+from image_variants import PILImage, THUMBNAIL_VARIANT, ImageVariantPool
+from listings import explain_query_plan, filter_listings, rebuild_listings
+from pagination import FEED_ORDER, decode_cursor, encode_cursor, seek_condition
+from price_stats import PriceStatsSnapshot
+from query_cache import PropertyQueryCache, cache_key, cache_tags, create_backend, register_invalidation
+import io
 import json
 import jwt
+import math
+import mimetypes
 import os
+from saved_searches import SavedSearchIndex
+from similar_listings import SHORTLIST_SIZE, VECTOR_INDEX_TABLE, find_similar, rebuild_vector_index
+from snapshot_engine import create_snapshot, fetch_ranked_rows, register_snapshot_updates
 from sqlalchemy import desc, func  # Import func to use ilike
-from werkzeug.utils import secure_filename
+from sqlite_profile import apply_sqlite_pragmas, sqlite_pragmas
+import time
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MultiDict
 
 
 # Loads and sets the environment variables
@@ -30,22 +57,153 @@ sock = Sock(app)
 connected_users = {}
 
 base_dir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(base_dir, "../data", "list_my_space_db.sqlite")}'
+# SQLAlchemy URL of the database: the SQLite file of the data folder by default (the tests use a copy)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'DATABASE_URL', f'sqlite:///{os.path.join(base_dir, "../data", "list_my_space_db.sqlite")}')
 
 
 # Set the folder where images will be stored (local or a cloud service)
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}  # Allowed image formats
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload size
+PROPERTIES_PER_PAGE = 10
+IMPORT_BATCH_SIZE = 500  # Properties geocoded and saved at a time by the bulk import
+EXPORT_BATCH_SIZE = 1000  # Listings read from the database and written out at a time by the export
+
+# Fields of the property search results that are read from the listings table
+LISTING_FIELDS = {
+    'id': Listing.property_id,
+    'property_type': Listing.property_type,
+    'ad_action': Listing.ad_action,
+    'title': Listing.ad_title,
+    'city': Listing.city,
+    'state': Listing.state,
+    'price': Listing.price,
+    'surface_area': Listing.surface_area,
+    'land_area': Listing.land_area,
+    'latitude': Listing.latitude,
+    'longitude': Listing.longitude,
+}
+# Fields loaded from the property and image tables, only when they are requested
+RELATED_FIELDS = ('description', 'images', 'thumbnail', 'image_variants')
+# Named field sets: 'card' is the default of the result list, 'full' the complete payload
+FIELD_SETS = {
+    'card': ('id', 'property_type', 'title', 'price', 'city', 'thumbnail'),
+    'full': ('id', 'property_type', 'title', 'description', 'city', 'state', 'price', 'surface_area',
+             'land_area', 'latitude', 'longitude', 'images'),
+}
+
+# Cache of the GET /api/properties responses: 'memory' keeps an LRU cache in each worker
+# process, 'sqlite:////path/to/cache.sqlite' shares one between the workers of a host.
+# Responses are served for PROPERTY_CACHE_TTL seconds at most (0 until invalidated): a
+# memory cache only sees the writes of its own process.
+PROPERTY_CACHE = os.getenv('PROPERTY_CACHE', 'memory')
+PROPERTY_CACHE_SIZE = int(os.getenv('PROPERTY_CACHE_SIZE', 1024))
+PROPERTY_CACHE_TTL = int(os.getenv('PROPERTY_CACHE_TTL', 60))
+
+# Engine answering the filters of GET /api/properties: 'sql', or 'snapshot' to filter and
+# sort an in-memory NumPy copy of the listings (requires NumPy), reloaded every
+# SEARCH_SNAPSHOT_MAX_AGE seconds on top of the incremental updates
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'sql')
+SEARCH_SNAPSHOT_MAX_AGE = int(os.getenv('SEARCH_SNAPSHOT_MAX_AGE', 300))
+
+# Seconds between two reloads of the prices behind GET /api/properties/stats
+PRICE_STATS_MAX_AGE = int(os.getenv('PRICE_STATS_MAX_AGE', 600))
+
+# New properties are geocoded by a pool of GEOCODE_WORKERS background threads (0 geocodes
+# them during the request), each request to the geocoder timing out after GEOCODE_TIMEOUT
+# seconds and being retried GEOCODE_RETRIES times, waiting GEOCODE_BACKOFF seconds and doubling
+GEOCODE_WORKERS = int(os.getenv('GEOCODE_WORKERS', 4))
+GEOCODE_TIMEOUT = float(os.getenv('GEOCODE_TIMEOUT', 5))
+GEOCODE_RETRIES = int(os.getenv('GEOCODE_RETRIES', 3))
+GEOCODE_BACKOFF = float(os.getenv('GEOCODE_BACKOFF', 0.5))
+
+# The images of a request are written to the upload folder by up to UPLOAD_WORKERS threads at
+# once (0 writes them one after the other in the request thread)
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+
+# The thumbnail, card and full-width variants of uploaded images are rendered by a pool of
+# IMAGE_WORKERS background processes (0 renders them during the request), requires Pillow
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Stored images are served by GET /images/<name> and cached for a year. Behind a proxy,
+# IMAGE_SENDFILE hands the file over to it: 'x-sendfile' (Apache, lighttpd) or
+# 'x-accel-redirect' (nginx, with an internal location at IMAGE_ACCEL_PREFIX aliasing the
+# upload folder). By default the WSGI server sends the file (with sendfile() when it can).
+IMAGE_SENDFILE = os.getenv('IMAGE_SENDFILE', '')
+IMAGE_ACCEL_PREFIX = os.getenv('IMAGE_ACCEL_PREFIX', '/protected-uploads/')
+IMAGE_MAX_AGE = 365 * 24 * 3600
+if IMAGE_SENDFILE not in ('', 'x-sendfile', 'x-accel-redirect'):
+    raise ValueError(f"Unknown IMAGE_SENDFILE '{IMAGE_SENDFILE}'. Choose 'x-sendfile' or 'x-accel-redirect'.")
+
+# Connection profile of the SQLite database: 'wal' (write-ahead log, synchronous=NORMAL) lets
+# the requests read while another one writes and syncs to disk at checkpoints rather than at
+# each commit; 'default' keeps SQLite's rollback journal. Both set the memory-mapped I/O size
+# (bytes), page cache size (KiB per connection) and how long a write waits for a lock (ms).
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'wal')
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', 64 * 1024))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 10000))
+
+# Filter combinations of GET /api/properties that must be served from an index
+HOT_FILTERS = [
+    'city=Berlin',
+    'city=Berlin&ad_action=sale',
+    'city=Berlin&ad_action=sale&min_price=100000&max_price=500000',
+    'state=Germany&ad_action=rent',
+    'property_type=residence&ad_action=sale',
+    'ad_action=sale&min_price=100000&max_price=500000',
+]
 
 
 # Add configuration for the app
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['USE_X_SENDFILE'] = IMAGE_SENDFILE == 'x-sendfile'
 
 db.init_app(app)
 
-migrate = Migrate(app, db)
+SQLITE_PRAGMAS = sqlite_pragmas(SQLITE_PROFILE, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT)
+with app.app_context():
+    apply_sqlite_pragmas(db.engine, SQLITE_PRAGMAS)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keeps Alembic autogenerate from dropping the SQLite virtual tables (and their
+    shadow tables) that are created by hand in the migrations."""
+    virtual_tables = (GEO_INDEX_TABLE, FTS_TABLE, VECTOR_INDEX_TABLE)
+    if type_ == 'table' and reflected and compare_to is None and name.startswith(virtual_tables):
+        return False
+    return True
+
+
+migrate = Migrate(app, db, include_object=include_object)
+
+# Cached searches are dropped when a committed write touches their property type and city
+property_cache = PropertyQueryCache(create_backend(PROPERTY_CACHE, PROPERTY_CACHE_SIZE), PROPERTY_CACHE_TTL or None)
+register_invalidation(property_cache)
+
+listing_snapshot = create_snapshot(SEARCH_ENGINE, SEARCH_SNAPSHOT_MAX_AGE)
+if listing_snapshot is not None:
+    register_snapshot_updates(listing_snapshot)
+
+price_stats = PriceStatsSnapshot(PRICE_STATS_MAX_AGE)
+
+# Finds the saved searches matching each new property, to notify their customers
+saved_search_index = SavedSearchIndex()
+
+geocoding_pool = GeocodingPool(app, GEOCODE_WORKERS, GEOCODE_TIMEOUT, GEOCODE_RETRIES, GEOCODE_BACKOFF)
+
+# Writes the images uploaded with a property, shared by the requests of this worker process
+upload_executor = ThreadPoolExecutor(UPLOAD_WORKERS, thread_name_prefix='upload') if UPLOAD_WORKERS else None
+
+# Renders the variants of the images stored by each committed upload
+image_variant_pool = ImageVariantPool(app, IMAGE_WORKERS)
+
+# Ids of the features by name, shared by the requests of this worker process
+feature_dictionary = FeatureDictionary()
+with app.app_context():
+    feature_dictionary.warm(db.session)
 
 
 def token_required(f):
@@ -369,6 +527,34 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def stage_uploaded_images(images):
+    """
+    Validates uploaded images by their extension and first bytes, then stores them under
+    their content hash (the same file uploaded again, by any owner, is stored once)
+    concurrently on the upload threads. Returns their (sha256, path, size), or raises
+    ValueError naming the first file that is not a PNG, JPEG or GIF image. Empty file
+    fields are skipped.
+    """
+    uploads = []
+    for image in images:
+        if not image:
+            continue
+        image_type = sniff_image_type(image.stream)
+        if not allowed_file(image.filename) or image_type is None:
+            raise ValueError(f"'{image.filename}' is not a PNG, JPEG or GIF image.")
+        uploads.append((image.stream, image_type))
+    return store_uploads(uploads, app.config['UPLOAD_FOLDER'], upload_executor)
+
+
+def add_image_records(staged_images, property_type, property_id):
+    """Registers the blobs of staged images and adds the Image records linking them to a
+    property, all inserted by the next commit."""
+    register_blobs(db.session, staged_images)
+    id_column = PROPERTY_MODELS[property_type][1]
+    db.session.add_all([Image(**{id_column: property_id}, url=path, blob_sha256=sha256)
+                        for sha256, path, _ in staged_images])
+
+
 @app.route('/api/properties', methods=['POST'])
 @token_required
 @owner_or_admin_required
@@ -411,19 +597,26 @@ def add_property(payload):
 
     # Optional: Get the list of features (as a comma-separated string)
     features = user_data.get('features')  # Example: 'balcony,garden,parking space'
-    feature_list = [f.strip().lower() for f in features.split(',')] if features else []
-
-    # Build full address for geocoding
-    full_address = f"{street_address}, {city}, {state}, {zip_code}"
+    feature_list = normalize_feature_names(features.split(',')) if features else []
 
-    # Get latitude and longitude using the Geoapify API
-    lat_long = get_lat_long(full_address)
-    if lat_long is None:
-        return jsonify({"error": "Unable to fetch latitude and longitude for the provided address."}), 400
+    # The coordinates are fetched from the Geoapify API in the background, once the property is saved
+    latitude = longitude = None
+    geocode_status = GeocodeStatusEnum.PENDING
 
-    latitude, longitude = lat_long
+    # The images are validated and written to disk before the property: the database isn't
+    # locked during the disk writes, and an invalid image doesn't leave a half-saved property
+    try:
+        staged_images = stage_uploaded_images(images)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OSError as e:
+        # The files already stored have no blob: the garbage collector removes them
+        return jsonify({"error": str(e)}), 500
 
     try:
+        # Ids of the features, the missing ones being created in the same transaction
+        feature_ids = feature_dictionary.resolve(db.session, feature_list)
+
         # Add property based on the type
         if property_type == 'residence':
             new_property = Residence(
@@ -437,6 +630,7 @@ def add_property(payload):
                 zip_code=zip_code,
                 latitude=latitude,
                 longitude=longitude,
+                geocode_status=geocode_status,
                 price=price,
                 rooms_count=user_data.get('rooms_count'),
                 floor_number=user_data.get('floor_number'),
@@ -444,32 +638,11 @@ def add_property(payload):
                 land_area=user_data.get('land_area'),
             )
             db.session.add(new_property)
-            db.session.commit()  # Commit to get the property ID
-
-            # Associate features with residence
-            for feature_name in feature_list:
-                feature = Feature.query.filter_by(name=feature_name).first()
-                if not feature:
-                    # If the feature doesn't exist, create it
-                    feature = Feature(name=feature_name)
-                    db.session.add(feature)
-                    db.session.commit()  # Commit to get the feature_id
-
-                # Add feature association to residence
-                residence_feature = ResidenceFeature(residence_id=new_property.residence_id,
-                                                     feature_id=feature.feature_id)
-                db.session.add(residence_feature)
-
-            # Save uploaded images
-            for image in images:
-                if image and allowed_file(image.filename):
-                    filename = secure_filename(image.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    image.save(filepath)  # Save the file to the upload folder
-
-                    # Add the image record to the Image table
-                    new_image = Image(residence_id=new_property.residence_id, url=filepath)
-                    db.session.add(new_image)
+            db.session.flush()  # Flush to get the property ID
+
+            # Associate features with residence (inserted together by the final commit)
+            db.session.add_all([ResidenceFeature(residence_id=new_property.residence_id, feature_id=feature_id)
+                                for feature_id in feature_ids])
 
         elif property_type == 'commercial':
             new_property = Commercial(
@@ -483,6 +656,7 @@ def add_property(payload):
                 zip_code=zip_code,
                 latitude=latitude,
                 longitude=longitude,
+                geocode_status=geocode_status,
                 price=price,
                 commercial_category=user_data.get('commercial_category'),  # Specific to commercial properties
                 surface_area=user_data.get('surface_area'),
@@ -490,29 +664,11 @@ def add_property(payload):
                 floor_number=user_data.get('floor_number'),
             )
             db.session.add(new_property)
-            db.session.commit()  # Commit to get the property ID
+            db.session.flush()  # Flush to get the property ID
 
             # Associate features with commercial
-            for feature_name in feature_list:
-                feature = Feature.query.filter_by(name=feature_name).first()
-                if not feature:
-                    feature = Feature(name=feature_name)
-                    db.session.add(feature)
-                    db.session.commit()
-
-                commercial_feature = CommercialFeature(commercial_id=new_property.commercial_id,
-                                                       feature_id=feature.feature_id)
-                db.session.add(commercial_feature)
-
-            # Save uploaded images
-            for image in images:
-                if image and allowed_file(image.filename):
-                    filename = secure_filename(image.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    image.save(filepath)
-
-                    new_image = Image(commercial_id=new_property.commercial_id, url=filepath)
-                    db.session.add(new_image)
+            db.session.add_all([CommercialFeature(commercial_id=new_property.commercial_id, feature_id=feature_id)
+                                for feature_id in feature_ids])
 
         elif property_type == 'land':
             new_property = Land(
@@ -526,195 +682,535 @@ def add_property(payload):
                 zip_code=zip_code,
                 latitude=latitude,
                 longitude=longitude,
+                geocode_status=geocode_status,
                 price=price,
                 land_type=user_data.get('land_type'),  # Specific to land
                 land_category=user_data.get('land_category'),
                 land_area=user_data.get('land_area'),
             )
             db.session.add(new_property)
-            db.session.commit()  # Commit to get the property ID
+            db.session.flush()  # Flush to get the property ID
 
             # Associate features with land
-            for feature_name in feature_list:
-                feature = Feature.query.filter_by(name=feature_name).first()
-                if not feature:
-                    feature = Feature(name=feature_name)
-                    db.session.add(feature)
-                    db.session.commit()
-
-                land_feature = LandFeature(land_id=new_property.land_id, feature_id=feature.feature_id)
-                db.session.add(land_feature)
+            db.session.add_all([LandFeature(land_id=new_property.land_id, feature_id=feature_id)
+                                for feature_id in feature_ids])
 
-            # Save uploaded images
-            for image in images:
-                if image and allowed_file(image.filename):
-                    filename = secure_filename(image.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    image.save(filepath)
+        # Add the image records to the Image table, inserted in one batch
+        add_image_records(staged_images, property_type, property_key(new_property)[1])
 
-                    new_image = Image(land_id=new_property.land_id, url=filepath)
-                    db.session.add(new_image)
+        db.session.commit()  # Commit the property with all its features and images at once
 
-        db.session.commit()  # Commit all the features and images
+        # Customers are notified once the location of the property is known
+        geocoding_pool.submit(property_type, property_key(new_property)[1], property_address(new_property),
+                              on_resolved=saved_search_index.notify)
 
         return jsonify(
-            {"message": f"{property_type.capitalize()} '{ad_title}' added successfully with images and features!"}), 201
+            {"message": f"{property_type.capitalize()} '{ad_title}' added successfully with images and features!",
+             "geocode_status": new_property.geocode_status.name}), 201
 
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
+def read_property_filters(args):
+    """
+    Reads the search filters shared by the property listing endpoints from the
+    query string. Raises ValueError if they are invalid.
+    """
+
+    filters = {
+        'property_type': args.get('property_type'),  # Optional: 'residence', 'commercial', or 'land'
+        'ad_action': args.get('ad_action'),  # sale, rent
+        'city': args.get('city'),
+        'state': args.get('state'),
+        'min_price': args.get('min_price', type=int),
+        'max_price': args.get('max_price', type=int),
+        'min_surface_area': args.get('min_surface_area', type=float),
+        'max_surface_area': args.get('max_surface_area', type=float),
+        'min_land_area': args.get('min_land_area', type=float),
+        'max_land_area': args.get('max_land_area', type=float),
+        'features': args.getlist('features'),  # List of features e.g., ['balcony', 'parking']
+        'q': args.get('q'),  # Keywords searched in the title and description, e.g. 'sea view penthouse'
+        # Location search: a circle around lat/lon and/or a map viewport
+        'lat': args.get('lat', type=float),
+        'lon': args.get('lon', type=float),
+        'radius_km': args.get('radius_km', type=float),
+        'sort': args.get('sort'),  # Optional: 'distance' (requires lat and lon)
+    }
+
+    if filters['property_type'] and filters['property_type'] not in PROPERTY_MODELS:
+        raise ValueError("Invalid property type. Choose either 'residence', 'commercial', or 'land'.")
+
+    # A keyword search without any word (e.g. only punctuation) doesn't filter anything
+    if filters['q'] and build_match_query(filters['q']) is None:
+        filters['q'] = None
+
+    bbox = args.get('bbox')  # min_lon,min_lat,max_lon,max_lat
+    filters['search_box'], filters['bbox'] = parse_geo_filters(
+        filters['lat'], filters['lon'], filters['radius_km'], bbox, filters['sort'])
+    filters['origin'] = (filters['lat'], filters['lon']) if filters['lat'] is not None else None
+    return filters
+
+
+def fetch_related_rows(keys, build_query):
+    """
+    Loads rows related to several properties with one IN query per property type. Takes
+    (property_type, property_id) pairs and a function building the query of a property
+    type from (property_type, ids), whose rows start with the property id. Returns a
+    dictionary mapping each pair to the list of its rows without the id, in query order
+    (properties without rows are left out).
+    """
+
+    ids_by_type = {}
+    for property_type, property_id in keys:
+        ids_by_type.setdefault(property_type, []).append(property_id)
+
+    rows_by_key = {}
+    for property_type, ids in ids_by_type.items():
+        for property_id, *values in build_query(property_type, ids):
+            rows_by_key.setdefault((property_type, property_id), []).append(values)
+    return rows_by_key
+
+
+def image_foreign_key(property_type):
+    """Column of the Image table pointing at the properties of a type."""
+    return getattr(Image, PROPERTY_MODELS[property_type][1])
+
+
+def fetch_image_urls(keys):
+    """Loads the image URLs of several properties, keyed by (property_type, property_id)."""
+
+    def build_query(property_type, ids):
+        foreign_key = image_foreign_key(property_type)
+        return db.session.query(foreign_key, Image.url).filter(foreign_key.in_(ids)).order_by(Image.image_id)
+
+    return {key: [public_image_url(url, app.config['UPLOAD_FOLDER']) for url, in rows]
+            for key, rows in fetch_related_rows(keys, build_query).items()}
+
+
+def fetch_descriptions(keys):
+    """Loads the ad descriptions of several properties, keyed by (property_type, property_id)."""
+
+    def build_query(property_type, ids):
+        model, id_column = PROPERTY_MODELS[property_type]
+        return db.session.query(getattr(model, id_column), model.ad_description).filter(
+            getattr(model, id_column).in_(ids))
+
+    return {key: rows[0][0] for key, rows in fetch_related_rows(keys, build_query).items()}
+
+
+def fetch_image_variants(keys):
+    """
+    Loads the images of several properties with their rendered variants, keyed by
+    (property_type, property_id). Each image is a {'url', 'variants': {variant: {format: URL}}}.
+    """
+
+    def build_query(property_type, ids):
+        foreign_key = image_foreign_key(property_type)
+        return (db.session.query(foreign_key, Image.image_id, Image.url, ImageVariant.variant,
+                                 ImageVariant.format, ImageVariant.path)
+                .outerjoin(ImageVariant, ImageVariant.blob_sha256 == Image.blob_sha256)
+                .filter(foreign_key.in_(ids))
+                .order_by(Image.image_id))
+
+    images = {}
+    for key, rows in fetch_related_rows(keys, build_query).items():
+        entries = {}  # The rows of the variants of an image, by image
+        for image_id, url, variant, variant_format, path in rows:
+            if image_id not in entries:
+                entries[image_id] = {'url': public_image_url(url, app.config['UPLOAD_FOLDER']), 'variants': {}}
+            if variant is not None:
+                entries[image_id]['variants'].setdefault(variant, {})[variant_format] = \
+                    public_image_url(path, app.config['UPLOAD_FOLDER'])
+        images[key] = list(entries.values())
+    return images
+
+
+def fetch_thumbnails(keys):
+    """Loads the thumbnail of the first image of several properties (the image itself until its
+    variants are rendered), keyed by (property_type, property_id)."""
+
+    def build_query(property_type, ids):
+        foreign_key = image_foreign_key(property_type)
+        first_images = (db.session.query(func.min(Image.image_id))
+                        .filter(foreign_key.in_(ids))
+                        .group_by(foreign_key))
+        variant, variant_format = THUMBNAIL_VARIANT
+        return (db.session.query(foreign_key, func.coalesce(ImageVariant.path, Image.url))
+                .outerjoin(ImageVariant, (ImageVariant.blob_sha256 == Image.blob_sha256)
+                           & (ImageVariant.variant == variant) & (ImageVariant.format == variant_format))
+                .filter(Image.image_id.in_(first_images)))
+
+    return {key: public_image_url(rows[0][0], app.config['UPLOAD_FOLDER'])
+            for key, rows in fetch_related_rows(keys, build_query).items()}
+
+
+def read_fields(args, default='card'):
+    """
+    Reads the comma-separated 'fields' parameter of the property search: field names
+    and/or field set names ('card', 'full'). Returns the requested field names in a
+    stable order. Raises ValueError on unknown names.
+    """
+
+    requested = set()
+    for name in (args.get('fields') or default).split(','):
+        name = name.strip()
+        if name in FIELD_SETS:
+            requested.update(FIELD_SETS[name])
+        elif name in LISTING_FIELDS or name in RELATED_FIELDS:
+            requested.add(name)
+        elif name:
+            choices = ', '.join([*FIELD_SETS, *LISTING_FIELDS, *RELATED_FIELDS])
+            raise ValueError(f"Invalid field: '{name}'. Choose among {choices}.")
+    return [name for name in (*LISTING_FIELDS, *RELATED_FIELDS) if name in requested]
+
+
+def listing_columns(fields, origin):
+    """
+    Lists the listings table columns to select for the requested fields. Only these
+    columns are read and no Listing objects are built. The feed order columns are
+    always included for the cursor, and the coordinates for the distance.
+    """
+    columns = {'property_type': Listing.property_type, 'property_id': Listing.property_id,
+               'ad_creation_date': Listing.ad_creation_date}
+    if origin:
+        columns.update(latitude=Listing.latitude, longitude=Listing.longitude)
+    for name in fields:
+        if name in LISTING_FIELDS:
+            columns[LISTING_FIELDS[name].key] = LISTING_FIELDS[name]
+    return list(columns.values())
+
+
+def serialize_listings(rows, fields, origin=None):
+    """
+    Builds the response entries of listing rows with the requested fields. The
+    descriptions and images of all the rows are loaded at once, only if requested.
+    """
+
+    keys = [(row.property_type, row.property_id) for row in rows]
+    descriptions = fetch_descriptions(keys) if 'description' in fields else {}
+    images = fetch_image_urls(keys) if 'images' in fields else {}
+    thumbnails = fetch_thumbnails(keys) if 'thumbnail' in fields else {}
+    image_variants = fetch_image_variants(keys) if 'image_variants' in fields else {}
+
+    properties = []
+    for row, key in zip(rows, keys):
+        property_data = {}
+        for name in fields:
+            if name == 'description':
+                property_data[name] = descriptions.get(key)
+            elif name == 'images':
+                property_data[name] = images.get(key, [])
+            elif name == 'thumbnail':
+                property_data[name] = thumbnails.get(key)
+            elif name == 'image_variants':
+                property_data[name] = image_variants.get(key, [])
+            else:
+                property_data[name] = getattr(row, LISTING_FIELDS[name].key)
+        if origin:
+            property_data['distance_km'] = round(haversine_km(*origin, row.latitude, row.longitude), 3)
+        properties.append(property_data)
+    return properties
+
+
+def import_format(filename, content_type):
+    """Guesses the format of an import from its file name or content type ('csv' or 'jsonl')."""
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    content_type = (content_type or '').lower()
+    if extension == 'csv' or 'csv' in content_type:
+        return 'csv'
+    if extension in ('jsonl', 'ndjson') or 'jsonl' in content_type or 'ndjson' in content_type:
+        return 'jsonl'
+    return None
+
+
+@app.route('/api/properties/import', methods=['POST'])
+@token_required
+@owner_or_admin_required
+def import_properties_route(payload):
+    """Imports properties in bulk from a CSV or JSON Lines file, sent as the 'file' part of
+    a multipart form or as the request body. Rows are validated and saved in batches, and
+    each rejected row is reported with its line number."""
+
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, fmt = upload.stream, import_format(upload.filename, upload.content_type)
+    else:
+        stream, fmt = request.stream, import_format(None, request.content_type)
+    fmt = request.args.get('format', fmt)
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({"error": "Unknown import format. Use a .csv or .jsonl file, or set 'format' "
+                                 "to 'csv' or 'jsonl'."}), 400
+
+    # Customers are notified of the imported properties matching their saved searches, unless disabled
+    notify = request.args.get('notify', 'true').lower() != 'false'
+    report = import_properties(read_rows(stream, fmt), geocoding_pool, feature_dictionary, IMPORT_BATCH_SIZE,
+                               on_imported=saved_search_index.notify if notify else None)
+    return jsonify(report), 200
+
+
+@app.route(f'{IMAGE_URL_PREFIX}<name>', methods=['GET'])
+def serve_image(name):
+    """
+    Serves a stored image or image variant by name. Names hold the content hash, so a URL
+    always returns the same bytes: responses are cached for a year without revalidation
+    (immutable), with the name as strong ETag. Conditional (304) and range (206) requests
+    are answered by Werkzeug, or by the proxy the file is handed over to.
+    """
+    path = stored_file_path(app.config['UPLOAD_FOLDER'], name)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "Image not found."}), 404
+
+    if IMAGE_SENDFILE == 'x-accel-redirect':
+        response = Response(mimetype=mimetypes.guess_type(name)[0])
+        response.headers['X-Accel-Redirect'] = \
+            IMAGE_ACCEL_PREFIX + os.path.relpath(path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        response.set_etag(name)
+        response.make_conditional(request)
+    else:
+        # Relative paths would be read from the application folder, uploads are relative to the working directory
+        response = send_file(os.path.abspath(path), conditional=True, etag=name, max_age=IMAGE_MAX_AGE)
+        response.accept_ranges = 'bytes'  # Werkzeug only sets it on the range responses
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/api/properties', methods=['GET'])
 def get_properties():
     # Retrieve query parameters
-    ad_action = request.args.get('ad_action')  # sale, rent
-    city = request.args.get('city')
-    state = request.args.get('state')
-    min_price = request.args.get('min_price', type=int)
-    max_price = request.args.get('max_price', type=int)
-    min_surface_area = request.args.get('min_surface_area', type=float)
-    max_surface_area = request.args.get('max_surface_area', type=float)
-    min_land_area = request.args.get('min_land_area', type=float)
-    max_land_area = request.args.get('max_land_area', type=float)
-    features = request.args.getlist('features')  # List of features e.g., ['balcony', 'parking']
-    property_type = request.args.get('property_type')  # Optional: 'residence', 'commercial', or 'land'
     page = request.args.get('page', 1, type=int)
+    # Cursor mode: pass an empty cursor for the first page, then the returned 'next_cursor'
+    cursor = request.args.get('cursor')
+    with_total = request.args.get('with_total', 'false').lower() == 'true'
 
-    # Prepare an empty query list to combine results if property_type is not provided
-    queries = []
-
-    # Determine which property model(s) to query
-    if property_type == 'residence' or property_type is None:
-        residence_query = Residence.query
-        if ad_action:
-            residence_query = residence_query.filter(
-                func.lower(Residence.ad_action) == ad_action.lower())
-        if city:
-            residence_query = residence_query.filter(func.lower(Residence.city) == city.lower())
-        if state:
-            residence_query = residence_query.filter(func.lower(Residence.state) == state.lower())
-        if min_price is not None:
-            residence_query = residence_query.filter(Residence.price >= min_price)
-        if max_price is not None:
-            residence_query = residence_query.filter(Residence.price <= max_price)
-        if min_surface_area is not None:
-            residence_query = residence_query.filter(Residence.surface_area >= min_surface_area)
-        if max_surface_area is not None:
-            residence_query = residence_query.filter(Residence.surface_area <= max_surface_area)
-        # Land area filters apply here if available
-        if min_land_area is not None:
-            residence_query = residence_query.filter(Residence.land_area >= min_land_area)
-        if max_land_area is not None:
-            residence_query = residence_query.filter(Residence.land_area <= max_land_area)
-
-        if features:
-            residence_query = residence_query.join(ResidenceFeature).join(Feature).filter(Feature.name.in_(features))
-
-        residence_query = residence_query.order_by(desc(Residence.ad_creation_date))
-        queries.append(residence_query)
-
-    if property_type == 'commercial' or property_type is None:
-        commercial_query = Commercial.query
-        if ad_action:
-            commercial_query = commercial_query.filter(
-                func.lower(Commercial.ad_action) == ad_action.lower())
-        if city:
-            commercial_query = commercial_query.filter(func.lower(Commercial.city) == city.lower())
-        if state:
-            commercial_query = commercial_query.filter(func.lower(Commercial.state) == state.lower())
-        if min_price is not None:
-            commercial_query = commercial_query.filter(Commercial.price >= min_price)
-        if max_price is not None:
-            commercial_query = commercial_query.filter(Commercial.price <= max_price)
-        if min_surface_area is not None:
-            commercial_query = commercial_query.filter(Commercial.surface_area >= min_surface_area)
-        if max_surface_area is not None:
-            commercial_query = commercial_query.filter(Commercial.surface_area <= max_surface_area)
-        # Land area filters apply here if available
-        if min_land_area is not None:
-            commercial_query = commercial_query.filter(Commercial.land_area >= min_land_area)
-        if max_land_area is not None:
-            commercial_query = commercial_query.filter(Commercial.land_area <= max_land_area)
-
-        if features:
-            commercial_query = commercial_query.join(CommercialFeature).join(Feature).filter(Feature.name.in_(features))
-
-        commercial_query = commercial_query.order_by(desc(Commercial.ad_creation_date))
-        queries.append(commercial_query)
-
-    if property_type == 'land' or property_type is None:
-        land_query = Land.query
-        if ad_action:
-            land_query = land_query.filter(func.lower(Land.ad_action) == ad_action.lower())
-        if city:
-            land_query = land_query.filter(func.lower(Land.city) == city.lower())
-        if state:
-            land_query = land_query.filter(func.lower(Land.state) == state.lower())
-        if min_price is not None:
-            land_query = land_query.filter(Land.price >= min_price)
-        if max_price is not None:
-            land_query = land_query.filter(Land.price <= max_price)
-
-        # Land area filter applies to land properties
-        if min_land_area is not None:
-            land_query = land_query.filter(Land.land_area >= min_land_area)
-        if max_land_area is not None:
-            land_query = land_query.filter(Land.land_area <= max_land_area)
-
-        if features:
-            land_query = land_query.join(LandFeature).join(Feature).filter(Feature.name.in_(features))
-
-        land_query = land_query.order_by(desc(Land.ad_creation_date))
-        queries.append(land_query)
-
-    # Combine queries for all property types if no specific property type is selected
-    if not property_type:
-        from sqlalchemy import select, union_all
-        # Remove ORDER BY from individual subqueries
-        stripped_queries = [query.order_by(None).statement for query in queries]
-        combined_query = union_all(*stripped_queries)
-
-        # Create a subquery and wrap it for further query modifications
-        subquery = combined_query.subquery()
-        query = db.session.query(subquery).order_by(desc(subquery.c.ad_creation_date))
+    try:
+        filters = read_property_filters(request.args)
+        fields = read_fields(request.args)
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if cursor is not None and filters['sort'] == 'distance':
+        return jsonify({"error": "Cursor pagination is only available for the newest-first order."}), 400
+    origin = filters['origin']
+
+    search_key = cache_key(filters, page=page, cursor=cursor, with_total=with_total, fields=fields)
+    cached_response = property_cache.get(search_key)
+    if cached_response is not None:
+        return jsonify(cached_response)
+    generation = property_cache.generation
+
+    # Every property type is searched at once through the listings table,
+    # reading only the columns of the requested fields
+    query = filter_listings(db.session.query(*listing_columns(fields, origin)), filters)
+
+    if cursor is not None:
+        items, next_cursor = fetch_cursor_page(query, position)
+        response_meta = {'next_cursor': next_cursor}
+        if with_total:
+            # Counting the whole result set is what makes deep pages slow, so it is opt-in
+            response_meta['total_properties'] = query.count()
+    elif (snapshot_page := search_snapshot(filters, page)) is not None:
+        keys, total = snapshot_page
+        items = fetch_ranked_rows(listing_columns(fields, origin), keys)
+        response_meta = {
+            'page': max(page, 1),
+            'pages': math.ceil(total / PROPERTIES_PER_PAGE),
+            'total_properties': total
+        }
     else:
-        query = queries[0]  # If a specific property type is chosen, use its query directly
-
-    # Pagination
-    paginated_result = query.paginate(page=page, per_page=10, error_out=False)
-
-    # Create the response with property data
-    properties = []
-    for property in paginated_result.items:
-        property_data = {
-            'id': getattr(property, 'residence_id',
-                          getattr(property, 'commercial_id', getattr(property, 'land_id', None))),
-            'title': property.ad_title,
-            'description': property.ad_description,
-            'city': property.city,
-            'state': property.state,
-            'price': property.price,
-            # Include surface_area and land_area for all property types
-            'surface_area': property.surface_area if hasattr(property, 'surface_area') else None,
-            'land_area': property.land_area if hasattr(property, 'land_area') else None,
-            'latitude': property.latitude,
-            'longitude': property.longitude,
-            'images': [image.url for image in property.images]
+        if filters['sort'] == 'distance':
+            query = query.order_by(squared_distance_km(Listing.latitude, Listing.longitude, *origin))
+        elif filters['q'] and query.session.get_bind().dialect.name == 'sqlite':
+            # Keyword searches list the best matches first
+            query = query.order_by(relevance, *FEED_ORDER)
+        else:
+            query = query.order_by(*FEED_ORDER)
+
+        # Pagination
+        paginated_result = query.paginate(page=page, per_page=PROPERTIES_PER_PAGE, error_out=False)
+        items = paginated_result.items
+        response_meta = {
+            'page': paginated_result.page,
+            'pages': paginated_result.pages,
+            'total_properties': paginated_result.total
         }
-        properties.append(property_data)
+
+    properties = serialize_listings(items, fields, origin)
 
     # Response structure
-    response = {
-        'properties': properties,
-        'page': paginated_result.page,
-        'pages': paginated_result.pages,
-        'total_properties': paginated_result.total
-    }
+    response = {'properties': properties, **response_meta}
+    property_cache.set(search_key, response, cache_tags(filters), generation)
 
     return jsonify(response)
 
 
+@app.route('/api/properties/facets', methods=['GET'])
+def get_property_facets():
+    """Returns the city, price bucket, ad action and feature counts of the properties
+    matching the same filters as GET /api/properties, for the search UI."""
+    try:
+        filters = read_property_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    search_key = cache_key(filters, facets=True)
+    cached_response = property_cache.get(search_key)
+    if cached_response is not None:
+        return jsonify(cached_response)
+    generation = property_cache.generation
+
+    response = compute_facets(filters)
+    property_cache.set(search_key, response, cache_tags(filters), generation)
+    return jsonify(response)
+
+
+@app.route('/api/properties/stats', methods=['GET'])
+def get_property_stats():
+    """Returns the price statistics (count, min/max, mean, median, percentiles, price per
+    square meter and histogram) of the properties of a type, city and/or ad action."""
+    property_type = request.args.get('property_type')
+    if property_type and property_type not in PROPERTY_MODELS:
+        return jsonify({"error": "Invalid property type. Choose either 'residence', 'commercial', or 'land'."}), 400
+
+    return jsonify(price_stats.get(property_type, request.args.get('city'), request.args.get('ad_action')))
+
+
+@app.route('/api/properties/cache', methods=['GET'])
+@token_required
+@admin_required
+def get_property_cache_stats(payload):
+    """Returns the hit, miss and invalidation counters of the property search cache
+    (counted by this worker process) and its number of entries."""
+    return jsonify(property_cache.stats())
+
+
+@app.route('/api/geocoding/cache', methods=['GET'])
+@token_required
+@admin_required
+def get_geocoding_cache_stats(payload):
+    """Returns the hit (in memory, in SQLite and for addresses without results) and miss
+    counters of the geocoding cache, counted by this worker process, and its number of entries."""
+    return jsonify(geocode_cache.stats())
+
+
+def search_snapshot(filters, page):
+    """Searches the in-memory snapshot when the snapshot engine is enabled. Returns the
+    keys of the page and the total, or None if the search has to run in SQL."""
+    if listing_snapshot is None:
+        return None
+    return listing_snapshot.search(filters, max(page, 1), PROPERTIES_PER_PAGE)
+
+
+def fetch_cursor_page(query, position):
+    """
+    Fetches the page of listings following the cursor position (None for the first
+    page) in the feed order. The feed index lets the query seek straight to the
+    position, so deep pages cost the same as the first one.
+    Returns the page items and the cursor of the next page (None on the last page).
+    """
+
+    limit = PROPERTIES_PER_PAGE + 1  # One extra row tells whether a next page exists
+    query = query.order_by(*FEED_ORDER)
+    if position:
+        query = query.filter(seek_condition(position))
+    rows = query.limit(limit).all()
+
+    if len(rows) < limit:
+        return rows, None
+    last = rows[PROPERTIES_PER_PAGE - 1]
+    return rows[:PROPERTIES_PER_PAGE], encode_cursor(last.ad_creation_date, last.property_type, last.property_id)
+
+
+@app.route('/api/properties/export', methods=['GET'])
+@token_required
+def export_properties(payload):
+    """
+    Streams every property matching the filters of GET /api/properties as NDJSON
+    (one JSON object per line, the default) or CSV, with the 'full' fields unless
+    'fields' is given. Rows are read with a streaming cursor and written out batch
+    by batch, so memory use doesn't grow with the number of properties.
+    """
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Invalid format. Choose either 'ndjson' or 'csv'."}), 400
+    try:
+        filters = read_property_filters(request.args)
+        fields = read_fields(request.args, default='full')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    origin = filters['origin']
+
+    query = filter_listings(db.session.query(*listing_columns(fields, origin)), filters)
+    if filters['sort'] == 'distance':
+        query = query.order_by(squared_distance_km(Listing.latitude, Listing.longitude, *origin))
+    else:
+        query = query.order_by(*FEED_ORDER)
+
+    def generate():
+        result = db.session.execute(query.statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        if export_format == 'csv':
+            columns = fields + ['distance_km'] if origin else fields
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns)
+            writer.writeheader()
+        for rows in result.partitions():
+            properties = serialize_listings(rows, fields, origin)
+            if export_format == 'csv':
+                for property_data in properties:
+                    if 'images' in property_data:
+                        property_data['images'] = ' '.join(property_data['images'])
+                    if 'image_variants' in property_data:
+                        property_data['image_variants'] = json.dumps(property_data['image_variants'])
+                    writer.writerow(property_data)
+                chunk = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                chunk = ''.join(json.dumps(property_data) + '\n' for property_data in properties)
+            yield chunk
+        if export_format == 'csv' and buffer.getvalue():
+            yield buffer.getvalue()  # Header of an empty export
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=properties.{export_format}'})
+
+
+@app.route('/api/properties/<string:property_type>/<int:property_id>', methods=['GET'])
+def get_property(property_type, property_id):
+    """Returns the full payload of a single property, for its detail view."""
+    fields = FIELD_SETS['full']
+    row = (db.session.query(*listing_columns(fields, None))
+           .filter(Listing.property_type == property_type, Listing.property_id == property_id)
+           .first())
+    if row is None:
+        return jsonify({"error": "Property not found"}), 404
+    return jsonify(serialize_listings([row], fields)[0])
+
+
+@app.route('/api/properties/<string:property_type>/<int:property_id>/similar', methods=['GET'])
+def get_similar_properties(property_type, property_id):
+    """Returns the properties most similar to a property by location, price, area, rooms
+    and features (10 by default, at most 50), as cards unless 'fields' is given."""
+    limit = max(1, min(request.args.get('limit', 10, type=int), SHORTLIST_SIZE))
+    try:
+        fields = read_fields(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    listing = Listing.query.filter_by(property_type=property_type, property_id=property_id).first()
+    if listing is None:
+        return jsonify({"error": "Property not found"}), 404
+
+    origin = (listing.latitude, listing.longitude) if listing.latitude is not None else None
+    rows = fetch_ranked_rows(listing_columns(fields, origin), find_similar(listing, limit))
+    return jsonify({'properties': serialize_listings(rows, fields, origin)})
+
+
 @app.route('/api/delete_property', methods=['DELETE'])
 @token_required
 @owner_or_admin_required
@@ -803,31 +1299,33 @@ def update_property(payload, property_type, property_id):
         if property_obj.owner_id != int(owner_id):
             return jsonify({"error": "Unauthorized action"}), 403
 
+        # New images (optional) are validated and written to disk before the property is updated
+        try:
+            staged_images = stage_uploaded_images(request.files.getlist('images'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except OSError as e:
+            # The files already stored have no blob: the garbage collector removes them
+            return jsonify({"error": str(e)}), 500
+
         # Update fields based on incoming data
+        old_address = property_address(property_obj)
         for key, value in data.items():
             if hasattr(property_obj, key):
                 setattr(property_obj, key, value)
 
-        # If updating images is required, handle file uploads (optional)
-        if request.files:
-            images = request.files.getlist('images')
-            for image in images:
-                if image and allowed_file(image.filename):
-                    filename = secure_filename(image.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    image.save(filepath)
-                    # Handle saving or updating the image in the database
-                    new_image = Image(url=filepath)
-                    # Link the image to the correct property type
-                    if property_type == 'residence':
-                        new_image.residence_id = property_obj.residence_id
-                    elif property_type == 'commercial':
-                        new_image.commercial_id = property_obj.commercial_id
-                    elif property_type == 'land':
-                        new_image.land_id = property_obj.land_id
-                    db.session.add(new_image)
+        # A new address is geocoded again in the background, the old coordinates no longer apply
+        address_changed = property_address(property_obj) != old_address
+        if address_changed:
+            property_obj.latitude = property_obj.longitude = None
+            property_obj.geocode_status = GeocodeStatusEnum.PENDING
+
+        # Link the new images to the property
+        add_image_records(staged_images, property_type, property_key(property_obj)[1])
 
         db.session.commit()
+        if address_changed:
+            geocoding_pool.submit(property_type, property_id, property_address(property_obj))
 
         return jsonify({"message": f"{property_type.capitalize()} property updated successfully"}), 200
 
@@ -836,6 +1334,95 @@ def update_property(payload, property_type, property_id):
         return jsonify({"error": str(e)}), 500
 
 
+def current_customer(payload):
+    """Returns the customer of the user authenticated by a token payload, or None."""
+    user = User.query.filter_by(username=payload.get('username')).first()
+    return user.customer if user else None
+
+
+def read_search_params(params):
+    """Turns the JSON search parameters of a saved search into a query string MultiDict,
+    a list value (e.g. features) giving one entry per element."""
+    return MultiDict([(name, value) for name, values in params.items()
+                      for value in (values if isinstance(values, list) else [values])])
+
+
+@app.route('/api/saved_searches', methods=['POST'])
+@token_required
+def save_search(payload):
+    """Saves a property search of the authenticated customer, who then gets a notification
+    for every new property matching it. Takes a name and the parameters of GET /api/properties."""
+    customer = current_customer(payload)
+    if customer is None:
+        return jsonify({"error": "Only customers can save searches."}), 403
+
+    data = request.get_json() or {}
+    name = (data.get('name') or '').strip()
+    params = data.get('params') or {}
+    if not name or len(name) > 100:
+        return jsonify({"error": "A name of at most 100 characters is required."}), 400
+    if not isinstance(params, dict):
+        return jsonify({"error": "'params' must be an object of search parameters."}), 400
+    try:
+        filters = read_property_filters(read_search_params(params))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    saved_search = SavedSearch(customer_id=customer.customer_id, name=name,
+                               params=json.dumps(params), filters=json.dumps(filters))
+    db.session.add(saved_search)
+    db.session.commit()
+    return jsonify({"id": saved_search.saved_search_id, "name": name, "params": params}), 201
+
+
+@app.route('/api/saved_searches', methods=['GET'])
+@token_required
+def list_saved_searches(payload):
+    """Lists the saved searches of the authenticated customer."""
+    customer = current_customer(payload)
+    if customer is None:
+        return jsonify({"error": "Only customers can save searches."}), 403
+
+    saved_searches = (SavedSearch.query.filter_by(customer_id=customer.customer_id)
+                      .order_by(SavedSearch.saved_search_id))
+    return jsonify({'saved_searches': [
+        {'id': saved_search.saved_search_id, 'name': saved_search.name,
+         'params': json.loads(saved_search.params), 'created_at': saved_search.created_at.isoformat()}
+        for saved_search in saved_searches]})
+
+
+@app.route('/api/saved_searches/<int:saved_search_id>', methods=['DELETE'])
+@token_required
+def delete_saved_search(payload, saved_search_id):
+    """Deletes a saved search of the authenticated customer."""
+    customer = current_customer(payload)
+    saved_search = SavedSearch.query.get(saved_search_id)
+    if saved_search is None or customer is None or saved_search.customer_id != customer.customer_id:
+        return jsonify({"error": "Saved search not found"}), 404
+
+    db.session.delete(saved_search)
+    db.session.commit()
+    saved_search_index.remove(saved_search_id)
+    return jsonify({"message": "Saved search deleted successfully"}), 200
+
+
+@app.route('/api/notifications', methods=['GET'])
+@token_required
+def list_notifications(payload):
+    """Lists the notifications of the authenticated customer, newest first.
+    'unread=true' only returns the unread ones."""
+    customer = current_customer(payload)
+    if customer is None:
+        return jsonify({"error": "Only customers have notifications."}), 403
+
+    notifications = Notification.query.filter_by(customer_id=customer.customer_id)
+    if request.args.get('unread') == 'true':
+        notifications = notifications.filter_by(is_read=False)
+    return jsonify({'notifications': [
+        {'id': notification.notification_id, 'message': notification.message, 'is_read': notification.is_read}
+        for notification in notifications.order_by(desc(Notification.notification_id))]})
+
+
 @sock.route('/api/chat/<user_id>')
 @token_required
 def chat(payload, ws, user_id):
@@ -922,6 +1509,130 @@ def chat(payload, ws, user_id):
             del connected_users[user_id]
 
 
+@app.cli.command('rebuild-listings')
+def rebuild_listings_command():
+    """Rebuilds the listings search table, the facet counts and the similarity vector
+    index from the Residence, Commercial and Land tables.
+    Usage: flask rebuild-listings"""
+    total = rebuild_listings()
+    rebuild_facet_counts()
+    rebuild_vector_index()
+    property_cache.clear()
+    print(f"Rebuilt the listings table with {total} properties.")
+
+
+@app.cli.command('geocode-pending')
+@click.option('--retry-failed', is_flag=True, help='Also geocode the properties whose geocoding failed.')
+def geocode_pending_command(retry_failed):
+    """Geocodes the properties left with a pending geocode status, e.g. by a restart of
+    the server while they were queued.
+    Usage: flask geocode-pending [--retry-failed]"""
+    total = geocoding_pool.resolve_pending(include_failed=retry_failed)
+    property_cache.clear()
+    print(f"Geocoded {total} properties.")
+
+
+@app.cli.command('import-properties')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), help='Format of the file (from its extension by default).')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, help='Properties geocoded and saved at a time.')
+@click.option('--no-notify', is_flag=True, help="Don't notify the customers whose saved searches match.")
+def import_properties_command(path, fmt, batch_size, no_notify):
+    """Imports properties in bulk from a CSV or JSON Lines file, with the columns of
+    POST /api/properties, and prints the rejected rows.
+    Usage: flask import-properties FILE [--format csv|jsonl] [--batch-size 500] [--no-notify]"""
+    fmt = fmt or import_format(path, None)
+    if fmt is None:
+        raise click.UsageError("Can't tell the format of the file: use --format.")
+
+    start = time.perf_counter()
+    with open(path, 'rb') as stream:
+        report = import_properties(read_rows(stream, fmt), geocoding_pool, feature_dictionary, batch_size,
+                                   on_imported=None if no_notify else saved_search_index.notify)
+    property_cache.clear()
+    for error in report['errors']:
+        print(f"Line {error['line']}: {error['error']}")
+    print(f"Imported {report['imported']} properties ({report['geocode_failed']} not geocoded) and "
+          f"rejected {report['rejected']} rows in {time.perf_counter() - start:.1f} s.")
+
+
+@app.cli.command('store-legacy-images')
+def store_legacy_images_command():
+    """Moves the images uploaded under their original file names to content-hash
+    storage, storing each distinct file once.
+    Usage: flask store-legacy-images"""
+    moved, deleted = store_legacy_images(db.session, app.config['UPLOAD_FOLDER'])
+    property_cache.clear()
+    print(f"Moved {moved} images to content-hash storage and deleted {deleted} old files.")
+
+
+@app.cli.command('render-image-variants')
+def render_image_variants_command():
+    """Renders the variants of the stored images that have none, e.g. uploaded while the
+    server was stopping or before Pillow was installed.
+    Usage: flask render-image-variants"""
+    if PILImage is None:
+        raise SystemExit("Rendering image variants requires Pillow (pip install Pillow).")
+    total = image_variant_pool.render_missing()
+    property_cache.clear()
+    print(f"Rendered the variants of {total} images.")
+
+
+@app.cli.command('collect-garbage')
+@click.option('--dry-run', is_flag=True, help='Report what would be removed without removing it.')
+@click.option('--batch-size', default=500, help='Rows deleted per transaction.')
+@click.option('--grace-period', default=3600, help='Seconds during which new blobs and files are kept.')
+def collect_garbage_command(dry_run, batch_size, grace_period):
+    """Removes the images and feature links left by deleted properties, the image blobs
+    no image points at, and the files of the upload folder without a blob. Meant to run
+    in the background, e.g. from cron, while the server is serving requests.
+    Usage: flask collect-garbage [--dry-run] [--batch-size 500] [--grace-period 3600]"""
+    start = time.perf_counter()
+    report = collect_garbage(db.session, app.config['UPLOAD_FOLDER'], batch_size, grace_period, dry_run)
+    if not dry_run:
+        property_cache.clear()
+    print(f"{'Would remove' if dry_run else 'Removed'} {report['images']} images, "
+          f"{report['feature_links']} feature links, {report['blobs']} blobs and {report['files']} files, "
+          f"reclaiming {report['reclaimed_bytes'] / 1e6:.1f} MB, in {time.perf_counter() - start:.1f} s.")
+
+
+@app.cli.command('explain-listings')
+def explain_listings_command():
+    """Prints the query plan of the hot property filter combinations and fails if
+    one of them has to scan the whole listings table, or to sort the matching rows.
+    Usage: flask explain-listings"""
+
+    full_scans, sorts = [], []
+    for query_string in HOT_FILTERS:
+        filters = read_property_filters(MultiDict(parse_qsl(query_string)))
+        query = filter_listings(Listing.query, filters).order_by(*FEED_ORDER).limit(PROPERTIES_PER_PAGE)
+        plan = explain_query_plan(query)
+
+        print(f"{query_string}:")
+        for line in plan:
+            print(f"    {line}")
+        if any(line.startswith('SCAN listings') for line in plan):
+            full_scans.append(query_string)
+        # The page has to be read in the feed order from the index, not sorted afterwards
+        if any(line.startswith('USE TEMP B-TREE FOR ORDER BY') for line in plan):
+            sorts.append(query_string)
+
+    errors = []
+    if full_scans:
+        errors.append(f"Full scans of the listings table for: {', '.join(full_scans)}")
+    if sorts:
+        errors.append(f"Sorts of the matching listings for: {', '.join(sorts)}")
+    if errors:
+        raise SystemExit('\n'.join(errors))
+    print("All hot filters are served from an index in the feed order.")
+
+
+# flask benchmark-search, benchmark-similar, benchmark-saved-searches, benchmark-writes and
+# benchmark-image-variants
+register_benchmark_commands(app, HOT_FILTERS, read_property_filters, PROPERTIES_PER_PAGE, saved_search_index,
+                            sqlite_pragmas('wal', SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT))
+
+
 # # Creates the tables defined in the models
 # with app.app_context():
 #     db.create_all()
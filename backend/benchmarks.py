@@ -0,0 +1,265 @@
+import click
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from data_models import ActionEnum, Feature, Image, Listing, Owner, Residence, ResidenceFeature, SavedSearch, db
+from feature_dictionary import FeatureDictionary
+from geo_index import squared_distance_km
+from image_variants import PILImage, render_variants, worker_context
+from listings import filter_listings
+import multiprocessing
+import os
+from pagination import FEED_ORDER
+from saved_searches import listing_feature_names
+from similar_listings import find_similar
+from snapshot_engine import ListingSnapshot
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from sqlite_profile import apply_sqlite_pragmas, set_pragmas, sqlite_pragmas
+import sqlite3
+import tempfile
+import time
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MultiDict
+
+
+def benchmark_property_write(session, feature_dictionary, owner_id, number, single_commit):
+    """Saves a residence with three features and three images the way add_property does, either
+    committing once, or committing the property and each new feature first as it used to."""
+    features = ['garden', 'parking space', f'benchmark feature {number % 50}']
+    residence = Residence(owner_id=owner_id, ad_action=ActionEnum.SALE, ad_title=f"Benchmark {number}",
+                          ad_description="Benchmark residence", street_address=f"{number} Benchmark Street",
+                          city='Benchmark', state='Benchmark', zip_code='0', price=100000 + number,
+                          rooms_count=3, surface_area=80)
+    session.add(residence)
+    if single_commit:
+        session.flush()
+        feature_ids = feature_dictionary.resolve(session, features)
+    else:
+        session.commit()
+        feature_ids = []
+        for name in features:
+            feature = session.query(Feature).filter_by(name=name).first()
+            if not feature:
+                feature = Feature(name=name)
+                session.add(feature)
+                session.commit()
+            feature_ids.append(feature.feature_id)
+
+    session.add_all([ResidenceFeature(residence_id=residence.residence_id, feature_id=feature_id)
+                     for feature_id in feature_ids])
+    session.add_all([Image(residence_id=residence.residence_id, url=f"benchmark/{number}/{index}.jpg")
+                     for index in range(3)])
+    session.commit()
+
+
+def run_benchmark_writer(app, path, pragmas, owner_id, numbers, single_commit, results):
+    """Writer process of benchmark-writes: saves a property for each number and puts its
+    timings (ms) and errors in the results queue."""
+    engine = create_engine(f"sqlite:///{path}")
+    apply_sqlite_pragmas(engine, pragmas)
+    dictionary = FeatureDictionary()  # Each worker process has its own
+    timings, errors = [], []
+    with app.app_context(), Session(engine) as session:
+        for number in numbers:
+            started = time.perf_counter()
+            try:
+                benchmark_property_write(session, dictionary, owner_id, number, single_commit)
+                timings.append((time.perf_counter() - started) * 1000)
+            # e.g. "database is locked", or two writers creating the same feature
+            except (IntegrityError, OperationalError) as e:
+                session.rollback()
+                errors.append(str(e.orig))
+    engine.dispose()
+    results.put((timings, errors))
+
+
+def register_benchmark_commands(app, hot_filters, read_filters, page_size, saved_search_index, wal_pragmas):
+    """
+    Adds the benchmark commands to the flask CLI of the app. The filter combinations are
+    read with read_filters into pages of page_size properties, as GET /api/properties does,
+    and benchmark-writes compares SQLite's defaults with the wal_pragmas of the app.
+    """
+
+    @app.cli.command('benchmark-search')
+    @click.option('--repeat', default=50, help='Number of runs of each filter combination.')
+    def benchmark_search_command(repeat):
+        """Compares the time to find the first page of the hot property filter combinations
+        (plus numeric range filters) with SQL and with the NumPy snapshot engine.
+        Usage: flask benchmark-search [--repeat 50]"""
+
+        started = time.perf_counter()
+        try:
+            snapshot = ListingSnapshot(max_age=float('inf'))
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        snapshot.load()
+        print(f"Loaded the snapshot of {snapshot.size} listings in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+        query_strings = hot_filters + [
+            'min_price=100000&max_price=500000&min_surface_area=50',
+            'min_price=500&max_price=2000&min_land_area=100&max_land_area=5000',
+            'lat=52.52&lon=13.405&radius_km=25&sort=distance',
+        ]
+        print(f"{'filters':<70} {'sql ms':>8} {'snapshot ms':>12}")
+        for query_string in query_strings:
+            filters = read_filters(MultiDict(parse_qsl(query_string)))
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                query = filter_listings(db.session.query(Listing.property_type, Listing.property_id), filters)
+                if filters['sort'] == 'distance':
+                    query = query.order_by(
+                        squared_distance_km(Listing.latitude, Listing.longitude, *filters['origin']))
+                else:
+                    query = query.order_by(*FEED_ORDER)
+                query.paginate(page=1, per_page=page_size, error_out=False)
+            sql_ms = (time.perf_counter() - started) * 1000 / repeat
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                snapshot.search(filters, 1, page_size)
+            snapshot_ms = (time.perf_counter() - started) * 1000 / repeat
+
+            print(f"{query_string:<70} {sql_ms:>8.2f} {snapshot_ms:>12.2f}")
+
+    @app.cli.command('benchmark-similar')
+    @click.option('--samples', default=200, help='Number of random listings to look up.')
+    def benchmark_similar_command(samples):
+        """Times the similar listings lookup of random listings.
+        Usage: flask benchmark-similar [--samples 200]"""
+
+        listings = Listing.query.order_by(func.random()).limit(samples).all()
+        timings = []
+        for listing in listings:
+            started = time.perf_counter()
+            find_similar(listing)
+            timings.append((time.perf_counter() - started) * 1000)
+        if not timings:
+            raise SystemExit("There are no listings to look up.")
+
+        timings.sort()
+        print(f"{len(timings)} lookups over {Listing.query.count()} listings: "
+              f"median {timings[len(timings) // 2]:.2f} ms, p95 {timings[int(len(timings) * 0.95)]:.2f} ms, "
+              f"max {timings[-1]:.2f} ms")
+
+    @app.cli.command('benchmark-saved-searches')
+    @click.option('--samples', default=200, help='Number of random listings to match.')
+    def benchmark_saved_searches_command(samples):
+        """Times the matching of random listings against the saved searches.
+        Usage: flask benchmark-saved-searches [--samples 200]"""
+
+        listings = Listing.query.order_by(func.random()).limit(samples).all()
+        if not listings:
+            raise SystemExit("There are no listings to match.")
+
+        started = time.perf_counter()
+        saved_search_index.match(listings[0], set())  # Loads the index
+        print(f"Loaded {SavedSearch.query.count()} saved searches in {time.perf_counter() - started:.2f} s")
+
+        timings, matches = [], 0
+        for listing in listings:
+            feature_names = listing_feature_names(listing.property_type, listing.property_id)
+            started = time.perf_counter()
+            matches += len(saved_search_index.match(listing, feature_names))
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        print(f"{len(timings)} listings, {matches / len(timings):.1f} matching searches on average: "
+              f"median {timings[len(timings) // 2]:.2f} ms, p95 {timings[int(len(timings) * 0.95)]:.2f} ms, "
+              f"max {timings[-1]:.2f} ms")
+
+    @app.cli.command('benchmark-writes')
+    @click.option('--writers', default=8, help='Number of concurrent writer processes.')
+    @click.option('--writes', default=25, help='Properties saved by each writer.')
+    def benchmark_writes_command(writers, writes):
+        """Saves properties from concurrent writer processes (like the workers of a server) on
+        copies of the database: with SQLite's defaults and a commit per step (as add_property
+        used to), with a single commit, and with a single commit and the WAL profile.
+        Usage: flask benchmark-writes [--writers 8] [--writes 25]"""
+
+        owner_id = db.session.query(Owner.owner_id).limit(1).scalar()
+        if owner_id is None:
+            raise SystemExit("There is no owner to save the properties for.")
+        # The writers are forked: they must not share the connections of this process
+        db.session.remove()
+        db.engine.dispose()
+
+        configurations = [
+            ("default, commit per step", sqlite_pragmas('default'), False),
+            ("default, one commit", sqlite_pragmas('default'), True),
+            ("wal, one commit", wal_pragmas, True),
+        ]
+        context = multiprocessing.get_context('fork')
+        print(f"{writers} writers saving {writes} properties each")
+        print(f"{'configuration':<26} {'writes/s':>9} {'median ms':>10} {'p95 ms':>8} {'errors':>7}")
+        for label, pragmas, single_commit in configurations:
+            # Next to the database, so that the copies sync to the same disk
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(db.engine.url.database)) as directory:
+                path = os.path.join(directory, 'benchmark.sqlite')
+                with closing(sqlite3.connect(db.engine.url.database)) as source, \
+                        closing(sqlite3.connect(path)) as copy:
+                    source.backup(copy)
+                    set_pragmas(copy, pragmas)  # Sets the journal mode before the writers connect
+
+                results = context.Queue()
+                processes = [context.Process(target=run_benchmark_writer, args=(
+                    app, path, pragmas, owner_id, range(writer * writes, (writer + 1) * writes), single_commit,
+                    results)) for writer in range(writers)]
+                started = time.perf_counter()
+                for process in processes:
+                    process.start()
+                timings, errors = [], []
+                for _ in processes:
+                    writer_timings, writer_errors = results.get()
+                    timings += writer_timings
+                    errors += writer_errors
+                elapsed = time.perf_counter() - started
+                for process in processes:
+                    process.join()
+
+            timings.sort()
+            median = timings[len(timings) // 2] if timings else float('nan')
+            p95 = timings[int(len(timings) * 0.95)] if timings else float('nan')
+            print(f"{label:<26} {len(timings) / elapsed:>9.1f} {median:>10.1f} {p95:>8.1f} {len(errors):>7}")
+            for error in sorted(set(errors)):
+                print(f"    {errors.count(error)} x {error}")
+
+    @app.cli.command('benchmark-image-variants')
+    @click.option('--images', default=24, help='Number of uploads to render.')
+    @click.option('--width', default=4000, help='Width of the generated photos (4:3) in pixels.')
+    def benchmark_image_variants_command(images, width):
+        """Renders the variants of generated photos in the calling process, then in pools of
+        1, 2, 4... worker processes up to the number of cores, and prints the throughput.
+        Usage: flask benchmark-image-variants [--images 24] [--width 4000]"""
+        if PILImage is None:
+            raise SystemExit("Rendering image variants requires Pillow (pip install Pillow).")
+
+        cores = os.cpu_count() or 1
+        pool_sizes = [1]
+        while pool_sizes[-1] < cores:
+            pool_sizes.append(min(pool_sizes[-1] * 2, cores))
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Noise is the worst case for the codecs, like a detailed photo
+            size = (width, width * 3 // 4)
+            photo = PILImage.merge('RGB', [PILImage.effect_noise(size, 40) for _ in range(3)])
+            paths = [os.path.join(directory, f"{number}.jpg") for number in range(images)]
+            for path in paths:
+                photo.save(path, 'JPEG', quality=90)
+            print(f"{images} uploads of {size[0]}x{size[1]} ({os.path.getsize(paths[0]) / 1e6:.1f} MB each), "
+                  f"{cores} cores")
+            print(f"{'workers':<10} {'images/s':>9} {'seconds':>8}")
+
+            started = time.perf_counter()
+            for path in paths:
+                render_variants(path)
+            elapsed = time.perf_counter() - started
+            print(f"{'inline':<10} {images / elapsed:>9.2f} {elapsed:>8.2f}")
+
+            for workers in pool_sizes:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+                    started = time.perf_counter()
+                    list(executor.map(render_variants, paths))
+                    elapsed = time.perf_counter() - started
+                print(f"{workers:<10} {images / elapsed:>9.2f} {elapsed:>8.2f}")
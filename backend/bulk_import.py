@@ -0,0 +1,223 @@
+from data_models import Image, Owner, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS, db
+from db_constraints import (ActionEnum, CommercialCategoryEnum, GeocodeStatusEnum, LandCategoryEnum,
+                            LandTypeEnum)
+import csv
+from enum import Enum
+from feature_dictionary import normalize_feature_names
+from geocoding import property_address
+import io
+import json
+from listings import sync_inserted_properties
+import math
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from types import SimpleNamespace
+
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+MAX_IMAGES = 10  # Same limit as POST /api/properties
+
+# Text columns of every property type: (name, maximum length, required)
+COMMON_COLUMNS = (('ad_title', 50, True), ('ad_description', None, True), ('street_address', 255, True),
+                  ('city', 50, True), ('state', 50, True), ('zip_code', 10, True))
+# Numeric and enum columns of each property type: (name, parser, required). Besides
+# these, rows have a property_type, owner_id, ad_action and price, and optional
+# 'features' and 'images' (URLs), comma-separated in CSV or as JSON lists.
+TYPE_COLUMNS = {
+    'residence': (('rooms_count', int, True), ('surface_area', float, True),
+                  ('land_area', float, False), ('floor_number', int, False)),
+    'commercial': (('commercial_category', CommercialCategoryEnum, True), ('surface_area', float, True),
+                   ('land_area', float, True), ('floor_number', int, False)),
+    'land': (('land_type', LandTypeEnum, True), ('land_category', LandCategoryEnum, True),
+             ('land_area', float, True), ('surface_area', float, False)),
+}
+
+
+def read_rows(stream, fmt):
+    """
+    Reads the rows of a CSV (with a header line) or JSON Lines binary stream one at a
+    time. Yields (line number, row dict), or (line number, None) for a line that is not
+    a JSON object.
+    """
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def _text(row, name, max_length, required):
+    value = row.get(name)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise ValueError(f"'{name}' is required.")
+        return None
+    if max_length is not None and len(value) > max_length:
+        raise ValueError(f"'{name}' must be at most {max_length} characters.")
+    return value
+
+
+def _parse(row, name, parser, required):
+    """Parses a numeric or enum column. Enums accept their name or their value, in any case."""
+    value = _text(row, name, None, required)
+    if value is None:
+        return None
+    if isinstance(parser, type) and issubclass(parser, Enum):
+        for member in parser:
+            if value.casefold() in (member.name.casefold(), member.value.casefold()):
+                return member
+        raise ValueError(f"Invalid {name} '{value}'. Choose one of: {', '.join(m.value for m in parser)}.")
+    try:
+        number = parser(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number.") from None
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"'{name}' must be a positive number.")
+    return number
+
+
+def _list(row, name):
+    """Reads a list column: a JSON list, or a comma-separated string."""
+    value = row.get(name) or []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        raise ValueError(f"'{name}' must be a list or a comma-separated string.")
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def parse_row(row, owner_ids):
+    """
+    Validates an import row the way POST /api/properties reads its form. Returns the
+    (property_type, column values, feature names, image URLs) of the property, or
+    raises ValueError with the reason the row is rejected.
+    """
+
+    property_type = str(row.get('property_type') or '').strip().lower()
+    if property_type not in PROPERTY_MODELS:
+        raise ValueError("Invalid property type. Choose either 'residence', 'commercial', or 'land'.")
+
+    try:
+        owner_id = int(row.get('owner_id'))
+    except (TypeError, ValueError):
+        owner_id = None
+    if owner_id not in owner_ids:
+        raise ValueError("Invalid owner ID. The specified owner does not exist.")
+
+    ad_action = _text(row, 'ad_action', None, True).upper()
+    if ad_action not in ActionEnum.__members__:
+        raise ValueError("Invalid ad_action. Choose either 'rent' or 'sale'.")
+
+    values = {'owner_id': owner_id, 'ad_action': ActionEnum[ad_action],
+              'price': _parse(row, 'price', int, True)}
+    for name, max_length, required in COMMON_COLUMNS:
+        values[name] = _text(row, name, max_length, required)
+    for name, parser, required in TYPE_COLUMNS[property_type]:
+        values[name] = _parse(row, name, parser, required)
+
+    features = normalize_feature_names(_list(row, 'features'))
+    images = _list(row, 'images')
+    if len(images) > MAX_IMAGES:
+        raise ValueError(f"A property can have a maximum of {MAX_IMAGES} images.")
+    if any(len(url) > 1024 for url in images):
+        raise ValueError("Image URLs must be at most 1024 characters.")
+    return property_type, values, features, images
+
+
+def import_properties(rows, geocoding_pool, feature_dictionary, batch_size=500, on_imported=None):
+    """
+    Imports properties from (line number, row dict) pairs, e.g. from read_rows.
+
+    Rows are validated as they are read. Every batch_size valid rows, the distinct
+    addresses of the batch are geocoded concurrently on the geocoding pool, then the
+    properties, their feature links and their image records are inserted with
+    executemany in one transaction, along with their listings rows and index entries.
+    A batch failing to save rejects all of its rows.
+
+    on_imported(property_type, property_id) is called for each property once its
+    batch is committed. Returns a report with the number of imported and rejected
+    rows, and the line and reason of each rejected row.
+    """
+
+    owner_ids = {owner_id for (owner_id,) in db.session.query(Owner.owner_id)}
+    report = {'imported': 0, 'rejected': 0, 'geocode_failed': 0, 'errors': []}
+
+    def reject(line_number, error):
+        report['rejected'] += 1
+        report['errors'].append({'line': line_number, 'error': error})
+
+    batch = []
+    for line_number, row in rows:
+        if row is None:
+            reject(line_number, "The line is not a JSON object.")
+            continue
+        try:
+            batch.append((line_number, *parse_row(row, owner_ids)))
+        except ValueError as e:
+            reject(line_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            _import_batch(batch, geocoding_pool, feature_dictionary, report, reject, on_imported)
+            batch = []
+    if batch:
+        _import_batch(batch, geocoding_pool, feature_dictionary, report, reject, on_imported)
+    return report
+
+
+def _import_batch(batch, geocoding_pool, feature_dictionary, report, reject, on_imported):
+    addresses = [property_address(SimpleNamespace(**values)) for _, _, values, _, _ in batch]
+    coordinates = geocoding_pool.geocode_many(addresses)
+
+    rows_by_type, geocode_failed = {}, 0
+    for (_, property_type, values, features, images), address in zip(batch, addresses):
+        latitude, longitude = coordinates[address] or (None, None)
+        status = GeocodeStatusEnum.RESOLVED if latitude is not None else GeocodeStatusEnum.FAILED
+        geocode_failed += latitude is None
+        rows_by_type.setdefault(property_type, []).append(
+            ({**values, 'latitude': latitude, 'longitude': longitude, 'geocode_status': status}, features, images))
+
+    keys = []
+    try:
+        for property_type, rows in rows_by_type.items():
+            model, id_column = PROPERTY_MODELS[property_type]
+            # Bulk INSERTs (executemany) skip the mapper events: sync_inserted_properties replaces them
+            property_ids = db.session.scalars(
+                insert(model).returning(getattr(model, id_column), sort_by_parameter_order=True),
+                [values for values, _, _ in rows]).all()
+
+            links = [{id_column: property_id, 'feature_id': feature_id}
+                     for property_id, (_, features, _) in zip(property_ids, rows)
+                     for feature_id in feature_dictionary.resolve(db.session, features)]
+            images = [{id_column: property_id, 'url': url}
+                      for property_id, (_, _, urls) in zip(property_ids, rows) for url in urls]
+            if links:
+                db.session.execute(insert(PROPERTY_FEATURE_MODELS[property_type]), links)
+            if images:
+                db.session.execute(insert(Image), images)
+
+            sync_inserted_properties(db.session, property_type, property_ids)
+            keys += [(property_type, property_id) for property_id in property_ids]
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for line_number, *_ in batch:
+            reject(line_number, f"The batch of this row could not be saved: {e.__class__.__name__}")
+        print(f"Error while importing a batch of {len(batch)} properties: {e}")
+        return
+
+    report['imported'] += len(keys)
+    report['geocode_failed'] += geocode_failed
+    if on_imported is not None:
+        for property_type, property_id in keys:
+            on_imported(property_type, property_id)
@@ -82,6 +82,7 @@ class Customer(db.Model):
     reviews = db.relationship('Review', backref='customer', cascade="all, delete-orphan")
     favorites = db.relationship('Favorite', backref='customer', cascade="all, delete-orphan")
     notifications = db.relationship('Notification', backref='customer', cascade="all, delete-orphan")
+    saved_searches = db.relationship('SavedSearch', backref='customer', cascade="all, delete-orphan")
 
     def __repr__(self):
         """Returns a string representation of the Customer object."""
@@ -95,16 +96,54 @@ class Image(db.Model):
     __tablename__ = 'images'
 
     image_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    residence_id = db.Column(db.Integer, db.ForeignKey('residences.residence_id'), nullable=True)
-    commercial_id = db.Column(db.Integer, db.ForeignKey('commercials.commercial_id'), nullable=True)
-    land_id = db.Column(db.Integer, db.ForeignKey('land.land_id'), nullable=True)
+    residence_id = db.Column(db.Integer, db.ForeignKey('residences.residence_id'), nullable=True, index=True)
+    commercial_id = db.Column(db.Integer, db.ForeignKey('commercials.commercial_id'), nullable=True, index=True)
+    land_id = db.Column(db.Integer, db.ForeignKey('land.land_id'), nullable=True, index=True)
     url = db.Column(db.String(1024), nullable=False)
+    # Blob of an uploaded file (see image_store.py), NULL for the URLs of imported images
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('image_blobs.sha256'), nullable=True, index=True)
 
     def __repr__(self):
         """Returns a string representation of the Image object."""
         return f"<Image(image_id={self.image_id}, residence_id={self.residence_id}, url='{self.url}')>"
 
 
+class ImageBlob(db.Model):
+    """An uploaded image file stored once under its content hash, however many Image
+    rows point at it. ref_count is maintained by image_store.py."""
+
+    __tablename__ = 'image_blobs'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(1024), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # In bytes
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+
+    def __repr__(self):
+        """Returns a string representation of the ImageBlob object."""
+        return f"ImageBlob {self.sha256[:12]} ({self.ref_count} references)"
+
+
+class ImageVariant(db.Model):
+    """A resized copy of an image blob, rendered by image_variants.py and shared by
+    every Image pointing at the blob."""
+
+    __tablename__ = 'image_variants'
+
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('image_blobs.sha256'), primary_key=True)
+    variant = db.Column(db.String(20), primary_key=True)  # 'thumbnail', 'card' or 'full'
+    format = db.Column(db.String(10), primary_key=True)  # File extension: 'webp' or 'jpg'
+    path = db.Column(db.String(1024), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # In bytes
+
+    def __repr__(self):
+        """Returns a string representation of the ImageVariant object."""
+        return f"ImageVariant {self.blob_sha256[:12]} {self.variant} {self.format} ({self.width}x{self.height})"
+
+
 class Residence(db.Model):
     """Defines the structure of the 'residences' table in the database,
     representing real estate listings with attributes for various property details."""
@@ -112,7 +151,7 @@ class Residence(db.Model):
     __tablename__ = 'residences'
 
     residence_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False, index=True)
     ad_action = db.Column(Enum(ActionEnum), nullable=False)
     ad_title = db.Column(db.String(50), nullable=False)
     ad_description = db.Column(db.Text, nullable=False)
@@ -122,8 +161,11 @@ class Residence(db.Model):
     city = db.Column(db.String(50), nullable=False)
     state = db.Column(db.String(50), nullable=False)
     zip_code = db.Column(db.String(10), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
+    # Filled in by the geocoding workers after the property is saved (see geocoding.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geocode_status = db.Column(Enum(GeocodeStatusEnum), nullable=False, index=True,
+                               default=GeocodeStatusEnum.RESOLVED, server_default=GeocodeStatusEnum.RESOLVED.name)
     surface_area = db.Column(db.Float, nullable=False)
     land_area = db.Column(db.Float, nullable=True)
     floor_number = db.Column(db.Integer, nullable=True)
@@ -142,7 +184,7 @@ class Commercial(db.Model):
     __tablename__ = 'commercials'
 
     commercial_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False, index=True)
     ad_action = db.Column(Enum(ActionEnum), nullable=False)
     commercial_category = db.Column(Enum(CommercialCategoryEnum), nullable=False)
     ad_title = db.Column(db.String(50), nullable=False)
@@ -152,8 +194,11 @@ class Commercial(db.Model):
     city = db.Column(db.String(50), nullable=False)
     state = db.Column(db.String(50), nullable=False)
     zip_code = db.Column(db.String(10), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
+    # Filled in by the geocoding workers after the property is saved (see geocoding.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geocode_status = db.Column(Enum(GeocodeStatusEnum), nullable=False, index=True,
+                               default=GeocodeStatusEnum.RESOLVED, server_default=GeocodeStatusEnum.RESOLVED.name)
     surface_area = db.Column(db.Float, nullable=False)
     land_area = db.Column(db.Float, nullable=False)
     floor_number = db.Column(db.Integer, nullable=True)
@@ -172,7 +217,7 @@ class Land(db.Model):
     __tablename__ = 'land'
 
     land_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False, index=True)
     ad_action = db.Column(Enum(ActionEnum), nullable=False)
     land_type = db.Column(Enum(LandTypeEnum), nullable=False)
     land_category = db.Column(Enum(LandCategoryEnum), nullable=False)
@@ -183,8 +228,11 @@ class Land(db.Model):
     city = db.Column(db.String(50), nullable=False)
     state = db.Column(db.String(50), nullable=False)
     zip_code = db.Column(db.String(10), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
+    # Filled in by the geocoding workers after the property is saved (see geocoding.py)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geocode_status = db.Column(Enum(GeocodeStatusEnum), nullable=False, index=True,
+                               default=GeocodeStatusEnum.RESOLVED, server_default=GeocodeStatusEnum.RESOLVED.name)
     surface_area = db.Column(db.Float, nullable=True, default=0)
     land_area = db.Column(db.Float, nullable=False)
     price = db.Column(db.Integer, nullable=False)
@@ -297,3 +345,110 @@ class Notification(db.Model):
 
     def __repr__(self):
         return f"{self.message[:30]}... sent to {self.customer_id}"
+
+
+class SavedSearch(db.Model):
+    """Represents a property search saved by a customer, who is notified of the new
+    listings matching it (see saved_searches.py)."""
+
+    __tablename__ = 'saved_searches'
+
+    saved_search_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.customer_id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    params = db.Column(db.Text, nullable=False)  # JSON of the search parameters, as sent by the customer
+    filters = db.Column(db.Text, nullable=False)  # JSON of the parsed search filters, used for matching
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+
+    def __repr__(self):
+        """Returns a string representation of the SavedSearch object."""
+        return f"SavedSearch {self.name} of {self.customer_id}"
+
+
+class Listing(db.Model):
+    """Denormalized search table holding one row per Residence, Commercial or Land
+    listing, so that the cross-type property feed is a single indexed query.
+    Rows are written by listings.py whenever a property is inserted, updated or deleted."""
+
+    __tablename__ = 'listings'
+    __table_args__ = (
+        db.UniqueConstraint('property_type', 'property_id', name='uq_listings_property'),
+        # Newest-first feed order, also used by cursor pagination
+        db.Index('ix_listings_feed_order', 'ad_creation_date', 'property_type', 'property_id'),
+        # Equality filters first, then the feed order, so that filtered pages need no sort. The price
+        # ends the indexes searched with a price range: rows are checked without reading the table.
+        db.Index('ix_listings_city_date', 'city_normalized', 'ad_creation_date', 'property_type', 'property_id'),
+        db.Index('ix_listings_city_action_date', 'city_normalized', 'ad_action', 'ad_creation_date', 'property_type', 'property_id', 'price'),
+        db.Index('ix_listings_state_action_date', 'state_normalized', 'ad_action', 'ad_creation_date', 'property_type', 'property_id'),
+        db.Index('ix_listings_type_action_date', 'property_type', 'ad_action', 'ad_creation_date', 'property_id'),
+        # Price range searches without a location, read in the feed order
+        db.Index('ix_listings_action_date_price', 'ad_action', 'ad_creation_date', 'property_type', 'property_id', 'price'),
+    )
+
+    listing_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    property_type = db.Column(db.String(20), nullable=False)  # 'residence', 'commercial' or 'land'
+    property_id = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owners.owner_id'), nullable=False, index=True)
+    ad_action = db.Column(db.String(4), nullable=False)  # ActionEnum name, e.g. 'SALE'
+    ad_title = db.Column(db.String(50), nullable=False)
+    city = db.Column(db.String(50), nullable=False)
+    state = db.Column(db.String(50), nullable=False)
+    city_normalized = db.Column(db.String(50), nullable=False)
+    state_normalized = db.Column(db.String(50), nullable=False)
+    price = db.Column(db.Integer, nullable=False)
+    surface_area = db.Column(db.Float, nullable=True)
+    land_area = db.Column(db.Float, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    ad_creation_date = db.Column(db.Date, nullable=False)
+    # One bit per linked feature (bit feature_id - 1), maintained by feature_bits.py
+    feature_mask = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    rooms_count = db.Column(db.Integer, nullable=True)  # Residences only
+    # Log-scaled price and area (land area for land, surface area otherwise), used by
+    # similar_listings.py: equal ratios between listings give equal distances
+    log_price = db.Column(db.Float, nullable=True)
+    log_area = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        """Returns a string representation of the Listing object."""
+        return f"Listing {self.property_type} {self.property_id}: {self.ad_title}"
+
+
+class ListingFacetCount(db.Model):
+    """Number of listings per facet value (city, price bucket, ad action, feature) over
+    all listings, maintained by facets.py as listings are written."""
+
+    __tablename__ = 'listing_facet_counts'
+
+    facet = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(255), primary_key=True)
+    label = db.Column(db.String(255), nullable=False)  # Displayed name, e.g. the city as first written
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """Returns a string representation of the ListingFacetCount object."""
+        return f"ListingFacetCount {self.facet} {self.value}: {self.count}"
+
+
+# Maps the property types accepted by the API to their model and primary key column
+PROPERTY_MODELS = {
+    'residence': (Residence, 'residence_id'),
+    'commercial': (Commercial, 'commercial_id'),
+    'land': (Land, 'land_id'),
+}
+
+
+# Maps the property types to the association model linking them to features
+PROPERTY_FEATURE_MODELS = {
+    'residence': ResidenceFeature,
+    'commercial': CommercialFeature,
+    'land': LandFeature,
+}
+
+
+def property_key(property_obj):
+    """Returns the (property_type, property_id) pair identifying a property object."""
+    for property_type, (model, id_column) in PROPERTY_MODELS.items():
+        if isinstance(property_obj, model):
+            return property_type, getattr(property_obj, id_column)
+    raise TypeError(f"{property_obj!r} is not a property")
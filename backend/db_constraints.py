@@ -12,6 +12,12 @@ class ActionEnum(Enum):
     SALE = 'Sale'
 
 
+class GeocodeStatusEnum(Enum):
+    PENDING = 'Pending'
+    RESOLVED = 'Resolved'
+    FAILED = 'Failed'
+
+
 class CommercialCategoryEnum(Enum):
     OFFICE = 'Office'
     COMMERCIAL = 'Commercial'
@@ -0,0 +1,210 @@
+from bisect import bisect_right
+from collections import Counter
+from data_models import Feature, Listing, ListingFacetCount, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS, db, property_key
+from feature_bits import MASK_BITS, feature_bit
+from listings import filter_listings, listen_bulk_insert
+from sqlalchemy import delete, event, func, insert, select, update
+
+
+# Upper bounds of the price buckets; the last bucket has no upper bound
+PRICE_BUCKET_BOUNDS = (50_000, 100_000, 200_000, 500_000, 1_000_000)
+
+# Columns of a listing that its facet values are derived from
+FACET_COLUMNS = (Listing.city_normalized, Listing.city, Listing.ad_action, Listing.price, Listing.feature_mask)
+
+listing_facet_counts = ListingFacetCount.__table__
+
+
+def price_bucket(price):
+    """Returns the label of the price bucket of a price, e.g. '100000-200000' or '1000000+'."""
+    index = bisect_right(PRICE_BUCKET_BOUNDS, price)
+    lower = PRICE_BUCKET_BOUNDS[index - 1] if index else 0
+    if index == len(PRICE_BUCKET_BOUNDS):
+        return f"{lower}+"
+    return f"{lower}-{PRICE_BUCKET_BOUNDS[index]}"
+
+
+PRICE_BUCKETS = [price_bucket(lower) for lower in (0, *PRICE_BUCKET_BOUNDS)]
+
+
+def facet_values(row):
+    """Lists the (facet, value, label) entries a listing is counted under."""
+    bucket = price_bucket(row.price)
+    values = [('ad_action', row.ad_action, row.ad_action), ('price', bucket, bucket)]
+    if row.city_normalized:
+        values.append(('city', row.city_normalized, ' '.join(row.city.split())))
+
+    # Walk the set bits of the feature mask, lowest first
+    mask = row.feature_mask
+    while mask:
+        lowest = mask & -mask
+        feature_id = str(lowest.bit_length())
+        values.append(('feature', feature_id, feature_id))
+        mask ^= lowest
+    return values
+
+
+def count_facets(rows):
+    """
+    Counts the facet values of listing rows in a single pass. Returns the counts keyed
+    by (facet, value), the label of each key and the number of rows.
+    """
+    counts = Counter()
+    labels = {}
+    total = 0
+    for row in rows:
+        total += 1
+        for facet, value, label in facet_values(row):
+            counts[facet, value] += 1
+            labels.setdefault((facet, value), label)
+    return counts, labels, total
+
+
+def _overflow_feature_counts(candidates):
+    """
+    Counts the features past the feature mask among the candidate listings, given as a
+    subquery of (property_type, property_id). Those can only be found in the association
+    tables, so they are looked up only when such features exist.
+    """
+    if (db.session.query(func.max(Feature.feature_id)).scalar() or 0) <= MASK_BITS:
+        return Counter()
+
+    counts = Counter()
+    for property_type, link_model in PROPERTY_FEATURE_MODELS.items():
+        link_column = getattr(link_model, PROPERTY_MODELS[property_type][1])
+        rows = (db.session.query(link_model.feature_id, func.count())
+                .join(candidates, (candidates.c.property_type == property_type)
+                      & (candidates.c.property_id == link_column))
+                .filter(link_model.feature_id > MASK_BITS)
+                .group_by(link_model.feature_id))
+        for feature_id, count in rows:
+            counts['feature', str(feature_id)] += count
+    return counts
+
+
+def is_unfiltered(filters):
+    """Tells whether a set of search filters selects every listing."""
+    return all(value in (None, '', []) for name, value in filters.items() if name != 'sort')
+
+
+def compute_facets(filters, batch_size=1000):
+    """
+    Computes the city, price bucket, ad action and feature counts of the listings
+    matching the filters. The counts over all listings are read from the
+    listing_facet_counts table; filtered counts come from a single streamed pass
+    over the matching listings.
+    """
+
+    candidates = filter_listings(db.session.query(Listing.property_type, Listing.property_id), filters)
+    if is_unfiltered(filters):
+        counts = Counter()
+        labels = {}
+        for entry in ListingFacetCount.query.filter(ListingFacetCount.count > 0):
+            counts[entry.facet, entry.value] = entry.count
+            labels[entry.facet, entry.value] = entry.label
+        total = sum(count for (facet, _), count in counts.items() if facet == 'ad_action')
+    else:
+        query = filter_listings(db.session.query(*FACET_COLUMNS), filters)
+        counts, labels, total = count_facets(query.yield_per(batch_size))
+    counts.update(_overflow_feature_counts(candidates.subquery()))
+
+    feature_names = dict(db.session.query(Feature.feature_id, Feature.name))
+    facets = {'city': [], 'price': [], 'ad_action': [], 'features': []}
+    for (facet, value), count in counts.items():
+        if facet == 'city':
+            facets['city'].append({'value': labels[facet, value], 'count': count})
+        elif facet == 'feature':
+            facets['features'].append({'value': feature_names.get(int(value), value), 'count': count})
+        else:
+            facets[facet].append({'value': value, 'count': count})
+
+    for facet in ('city', 'ad_action', 'features'):
+        facets[facet].sort(key=lambda entry: (-entry['count'], entry['value']))
+    facets['price'].sort(key=lambda entry: PRICE_BUCKETS.index(entry['value']))
+    return {'total_properties': total, 'facets': facets}
+
+
+def _apply_counts(connection, values, delta):
+    """Adds delta to the counts of the given (facet, value, label) entries."""
+    for facet, value, label in values:
+        updated = connection.execute(
+            update(listing_facet_counts)
+            .where(listing_facet_counts.c.facet == facet, listing_facet_counts.c.value == value)
+            .values(count=listing_facet_counts.c.count + delta)).rowcount
+        if not updated and delta > 0:
+            connection.execute(insert(listing_facet_counts).values(
+                facet=facet, value=value, label=label, count=delta))
+
+
+def _listing_facet_row(connection, property_type, property_id):
+    return connection.execute(
+        select(*FACET_COLUMNS)
+        .where(Listing.property_type == property_type, Listing.property_id == property_id)).one_or_none()
+
+
+def _count_listing(delta):
+    """
+    Builds the event handler counting (delta=1) or uncounting (delta=-1) the listing of
+    a property. Updates uncount the listing before the write and count it again after.
+    """
+
+    def handler(mapper, connection, target):
+        row = _listing_facet_row(connection, *property_key(target))
+        if row is not None:
+            _apply_counts(connection, facet_values(row), delta)
+
+    return handler
+
+
+def _count_link(property_type, delta):
+    """Builds the event handler counting a feature linked to or unlinked from a listing."""
+    id_column = PROPERTY_MODELS[property_type][1]
+
+    def handler(mapper, connection, target):
+        # Same features as the mask: the others are counted from the association tables
+        if not feature_bit(target.feature_id):
+            return
+        if _listing_facet_row(connection, property_type, getattr(target, id_column)) is not None:
+            feature_id = str(target.feature_id)
+            _apply_counts(connection, [('feature', feature_id, feature_id)], delta)
+
+    return handler
+
+
+# Keep the counts over all listings in sync, in the same transaction as the listings table.
+# These handlers run after the ones of listings.py, which is imported first.
+for _model, _ in PROPERTY_MODELS.values():
+    event.listen(_model, 'before_update', _count_listing(-1))
+    event.listen(_model, 'before_delete', _count_listing(-1))
+    event.listen(_model, 'after_insert', _count_listing(1))
+    event.listen(_model, 'after_update', _count_listing(1))
+
+for _property_type, _link_model in PROPERTY_FEATURE_MODELS.items():
+    event.listen(_link_model, 'after_insert', _count_link(_property_type, 1))
+    event.listen(_link_model, 'after_delete', _count_link(_property_type, -1))
+
+
+def _count_inserted(session, property_type, property_ids):
+    """Counts the listings of properties inserted in bulk, adding up each value once."""
+    connection = session.connection()
+    rows = connection.execute(select(*FACET_COLUMNS).where(Listing.property_type == property_type,
+                                                           Listing.property_id.in_(property_ids)))
+    counts, labels, _ = count_facets(rows)
+    for key, count in counts.items():
+        _apply_counts(connection, [(*key, labels[key])], count)
+
+
+listen_bulk_insert(_count_inserted)
+
+
+def rebuild_facet_counts(batch_size=1000):
+    """Recounts the facet values over all listings. Returns the number of listings counted."""
+    with db.engine.begin() as connection:
+        connection.execute(delete(listing_facet_counts))
+        rows = connection.execution_options(yield_per=batch_size).execute(select(*FACET_COLUMNS))
+        counts, labels, total = count_facets(rows)
+        if counts:
+            connection.execute(insert(listing_facet_counts), [
+                {'facet': facet, 'value': value, 'label': labels[facet, value], 'count': count}
+                for (facet, value), count in counts.items()])
+    return total
@@ -0,0 +1,79 @@
+from data_models import Feature, Listing, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS, db
+from sqlalchemy import and_, event, exists, false, func, literal, or_, select, text
+
+
+# Features get bit (feature_id - 1) of listings.feature_mask. SQLite integers are signed
+# 64-bit values, so only the first 63 features fit; the others are checked with EXISTS.
+MASK_BITS = 63
+
+
+def feature_bit(feature_id):
+    """Returns the bit of a feature in listings.feature_mask, or 0 if it does not fit."""
+    return 1 << (feature_id - 1) if feature_id <= MASK_BITS else 0
+
+
+def feature_mask_column(property_type, id_column):
+    """
+    Correlated subquery computing the feature mask of the properties of one type.
+    Each feature is linked at most once per property, so the sum of the bits is
+    the same as OR-ing them.
+    """
+    link_model = PROPERTY_FEATURE_MODELS[property_type]
+    return (select(func.coalesce(func.sum(literal(1).op('<<')(link_model.feature_id - 1)), 0))
+            .where(getattr(link_model, PROPERTY_MODELS[property_type][1]) == id_column,
+                   link_model.feature_id <= MASK_BITS)
+            .scalar_subquery())
+
+
+def has_all_features(feature_names):
+    """
+    Condition matching the listings linked to every one of the given features.
+    Features within the mask are checked with a single bitwise AND on the listing row.
+    """
+
+    names = {name.strip().lower() for name in feature_names if name.strip()}
+    feature_ids = [feature_id for (feature_id,) in
+                   db.session.query(Feature.feature_id).filter(Feature.name.in_(names))]
+    if len(feature_ids) < len(names):
+        return false()  # An unknown feature can't be matched by any listing
+
+    mask = sum(feature_bit(feature_id) for feature_id in feature_ids)
+    conditions = [Listing.feature_mask.op('&')(mask) == mask] if mask else []
+
+    # Features past the mask need a lookup in the association tables
+    for feature_id in (feature_id for feature_id in feature_ids if not feature_bit(feature_id)):
+        conditions.append(_has_feature(feature_id))
+    return and_(*conditions)
+
+
+def _has_feature(feature_id):
+    """EXISTS condition for a single feature, used for the features past the mask."""
+    conditions = []
+    for property_type, link_model in PROPERTY_FEATURE_MODELS.items():
+        link_column = getattr(link_model, PROPERTY_MODELS[property_type][1])
+        conditions.append(and_(Listing.property_type == property_type,
+                               exists().where(link_column == Listing.property_id,
+                                              link_model.feature_id == feature_id)))
+    return or_(*conditions)
+
+
+def _link_changed(property_type, operation):
+    """Builds the event handler setting or clearing a feature bit when a link is written."""
+    id_column = PROPERTY_MODELS[property_type][1]
+
+    def handler(mapper, connection, target):
+        bit = feature_bit(target.feature_id)
+        if not bit:
+            return
+        connection.execute(
+            text(f"UPDATE listings SET feature_mask = feature_mask {operation} "
+                 "WHERE property_type = :property_type AND property_id = :property_id"),
+            {'bit': bit, 'property_type': property_type, 'property_id': getattr(target, id_column)})
+
+    return handler
+
+
+# Keep the masks in sync when feature links are added to or removed from a property
+for _property_type, _link_model in PROPERTY_FEATURE_MODELS.items():
+    event.listen(_link_model, 'after_insert', _link_changed(_property_type, '| :bit'))
+    event.listen(_link_model, 'after_delete', _link_changed(_property_type, '& ~:bit'))
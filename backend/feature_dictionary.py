@@ -0,0 +1,113 @@
+from data_models import Feature
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+import threading
+
+
+features = Feature.__table__
+
+# INSERT constructs supporting ON CONFLICT DO NOTHING ... RETURNING, by dialect name
+UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+def normalize_feature_names(names):
+    """Trims and lowercases feature names, dropping the empty ones and the duplicates (in order)."""
+    return list(dict.fromkeys(name.strip().lower() for name in names if name.strip()))
+
+
+class FeatureDictionary:
+    """
+    Process-wide cache of the feature ids by name, so that saving a property doesn't
+    look up each of its features.
+
+    Names missing from the cache are read from the features table, and the ones not
+    found there are created in a single INSERT ... ON CONFLICT DO NOTHING in the
+    caller's transaction (one INSERT per name in a savepoint on databases without it).
+    A name created at the same time by another worker process hits the unique
+    constraint and is read back instead. The ids created by a session
+    are only cached once it commits, since a rollback may free them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def warm(self, session):
+        """Loads every feature into the cache, e.g. at startup."""
+        try:
+            rows = session.execute(select(features.c.name, features.c.feature_id)).all()
+        except SQLAlchemyError as e:  # The table may not exist yet, e.g. before the first migration
+            session.rollback()
+            print(f"Feature dictionary not warmed: {e.__class__.__name__}")
+            return
+        with self._lock:
+            self._ids.update(rows)
+
+    def resolve(self, session, names):
+        """
+        Returns the ids of feature names (normalized by the caller), in order, creating
+        the missing features in the session's transaction.
+        """
+        with self._lock:
+            ids = {name: self._ids[name] for name in names if name in self._ids}
+        missing = [name for name in names if name not in ids]
+
+        if missing:
+            found = dict(session.execute(
+                select(features.c.name, features.c.feature_id).where(features.c.name.in_(missing))).all())
+            with self._lock:
+                self._ids.update(found)
+            ids.update(found)
+
+            missing = [name for name in missing if name not in found]
+            if missing:
+                created = self._create(session, missing)
+                session.info.setdefault('created_feature_ids', []).append((self, created))
+                ids.update(created)
+
+                # Created by another process since the lookup above
+                raced = [name for name in missing if name not in created]
+                if raced:
+                    ids.update(session.execute(
+                        select(features.c.name, features.c.feature_id).where(features.c.name.in_(raced))).all())
+        return [ids[name] for name in names]
+
+    @staticmethod
+    def _create(session, names):
+        """Inserts the features of names, except the ones that exist. Returns the ids of the inserted ones by name."""
+        insert = UPSERT_INSERTS.get(session.get_bind().dialect.name)
+        if insert is not None:
+            return dict(session.execute(
+                insert(features).values([{'name': name} for name in names])
+                .on_conflict_do_nothing(index_elements=['name'])
+                .returning(features.c.name, features.c.feature_id)).all())
+
+        created = {}
+        for name in names:
+            try:
+                with session.begin_nested():
+                    created[name] = session.execute(features.insert().values(name=name)).inserted_primary_key[0]
+            except IntegrityError:
+                pass
+        return created
+
+    def _add(self, ids):
+        with self._lock:
+            self._ids.update(ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _cache_created_features(session):
+    for dictionary, ids in session.info.pop('created_feature_ids', []):
+        dictionary._add(ids)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_created_features(session, previous_transaction):
+    session.info.pop('created_feature_ids', None)
@@ -0,0 +1,118 @@
+from data_models import Listing, PROPERTY_MODELS
+import re
+from sqlalchemy import column, delete, func, insert, literal, literal_column, select, table
+from sqlalchemy import text as sql_text
+
+
+# Name of the SQLite FTS5 virtual table indexing the title and description of each listing.
+# Its rowid is the listing_id of the listing.
+FTS_TABLE = 'listings_fts'
+
+# Title matches weigh more than description matches in the BM25 ranking
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+listings_fts = table(FTS_TABLE, column('rowid'), column('ad_title'), column('ad_description'))
+
+# Relevance of the current match, lower is better (to be used with a text_match query)
+relevance = func.bm25(literal_column(FTS_TABLE), TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+
+
+def build_match_query(text):
+    """
+    Turns free text into an FTS5 query where every word has to match, as a prefix
+    ("sea view pent" finds "sea view penthouse"). Words are quoted, so the user input
+    can't inject FTS5 operators. Returns None if the text has no words.
+    """
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def text_match(query, text):
+    """Restricts a Listing query to the listings whose title or description match the text."""
+    match_query = build_match_query(text)
+    if match_query is None:
+        return query
+
+    if query.session.get_bind().dialect.name != 'sqlite':
+        # Without FTS5, every word has to appear in the title
+        return query.filter(*(Listing.ad_title.ilike(f'%{word}%') for word in re.findall(r'\w+', text)))
+
+    return (query.join(listings_fts, listings_fts.c.rowid == Listing.listing_id)
+            .filter(literal_column(FTS_TABLE).op('MATCH')(match_query)))
+
+
+def matching_texts(session, listing_id, texts, chunk_size=500):
+    """
+    Returns the texts, among several keyword searches, that match a single listing.
+    On SQLite each chunk of texts is checked against the listing in one query.
+    """
+    match_queries = {text: build_match_query(text) for text in set(texts)}
+    matched = {text for text, match_query in match_queries.items() if match_query is None}
+    texts = [text for text, match_query in match_queries.items() if match_query is not None]
+
+    if session.get_bind().dialect.name != 'sqlite':
+        listing_query = session.query(Listing.listing_id).filter(Listing.listing_id == listing_id)
+        return matched | {text for text in texts if text_match(listing_query, text).first() is not None}
+
+    for start in range(0, len(texts), chunk_size):
+        chunk = texts[start:start + chunk_size]
+        values = ', '.join(f'(:q{index})' for index in range(len(chunk)))
+        rows = session.execute(
+            sql_text(f"WITH queries(match_query) AS (VALUES {values}) "
+                     f"SELECT match_query FROM queries WHERE EXISTS ("
+                     f"SELECT 1 FROM {FTS_TABLE} WHERE rowid = :listing_id AND {FTS_TABLE} MATCH queries.match_query)"),
+            {'listing_id': listing_id, **{f'q{index}': match_queries[text] for index, text in enumerate(chunk)}})
+        matching_queries = {match_query for (match_query,) in rows}
+        matched.update(text for text in chunk if match_queries[text] in matching_queries)
+    return matched
+
+
+def index_listing(connection, listing_id, property_type, property_id):
+    """Indexes (or re-indexes) the title and description of a listing."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    model, id_column = PROPERTY_MODELS[property_type]
+    connection.execute(delete(listings_fts).where(listings_fts.c.rowid == listing_id))
+    connection.execute(insert(listings_fts).from_select(
+        ['rowid', 'ad_title', 'ad_description'],
+        select(literal(listing_id), model.ad_title, model.ad_description)
+        .where(getattr(model, id_column) == property_id)))
+
+
+def unindex_listing(connection, listing_id):
+    """Removes a listing from the full-text index."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    connection.execute(delete(listings_fts).where(listings_fts.c.rowid == listing_id))
+
+
+def _index_texts(connection, property_type, property_ids=None):
+    """Indexes the listings of a property type, or only the ones of the given properties."""
+    model, id_column = PROPERTY_MODELS[property_type]
+    query = (select(Listing.listing_id, model.ad_title, model.ad_description)
+             .join(model, getattr(model, id_column) == Listing.property_id)
+             .where(Listing.property_type == property_type))
+    if property_ids is not None:
+        query = query.where(Listing.property_id.in_(property_ids))
+    connection.execute(insert(listings_fts).from_select(['rowid', 'ad_title', 'ad_description'], query))
+
+
+def index_properties(connection, property_type, property_ids):
+    """Indexes the listings of new properties, inserted in bulk."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    _index_texts(connection, property_type, property_ids)
+
+
+def rebuild_text_index(connection):
+    """Rebuilds the full-text index from the listings and property tables."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    connection.execute(delete(listings_fts))
+    for property_type in PROPERTY_MODELS:
+        _index_texts(connection, property_type)
@@ -0,0 +1,220 @@
+from collections import Counter
+from data_models import Image, ImageBlob, ImageVariant, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS
+import datetime
+import os
+from sqlalchemy import and_, bindparam, delete, exists, func, or_, select, tuple_, update
+import time
+
+
+images = Image.__table__
+image_blobs = ImageBlob.__table__
+image_variants = ImageVariant.__table__
+
+TEMP_FILE_PREFIX = '.upload-'  # Uploads being written (see image_store.store_upload)
+TEMP_FILE_SUFFIX = '.tmp'  # Variants being written (see image_variants.render_variants)
+
+
+def orphaned_image_condition():
+    """
+    Condition matching the Image rows of deleted properties: deleting a property through
+    the ORM leaves its images without any property, other deletes leave them pointing
+    at a property that doesn't exist.
+    """
+    conditions = [and_(*(images.c[id_column].is_(None) for _, id_column in PROPERTY_MODELS.values()))]
+    for model, id_column in PROPERTY_MODELS.values():
+        conditions.append(and_(images.c[id_column].is_not(None),
+                               ~exists().where(getattr(model, id_column) == images.c[id_column])))
+    return or_(*conditions)
+
+
+def collect_garbage(session, upload_folder, batch_size=500, grace_period=3600, dry_run=False):
+    """
+    Removes the data no listing can reach anymore, in batches of batch_size rows, each
+    deleted in its own short transaction so that requests never wait long on the write
+    lock:
+
+    1. the Image rows of deleted properties (updating the reference counts of their
+       blobs), and the files uploaded before content-hash storage no image points at;
+    2. the feature links of deleted properties;
+    3. the blobs no image points at, with their variants and files;
+    4. the files of the upload folder without a blob, e.g. of rolled back uploads.
+
+    Blobs and files changed in the last grace_period seconds are kept: an upload not
+    committed yet may be using them. With dry_run nothing is deleted and the report
+    counts what would be. Returns the report: the number of rows and files removed,
+    and the bytes reclaimed.
+    """
+
+    report = {'dry_run': dry_run, 'images': 0, 'feature_links': 0, 'blobs': 0, 'files': 0, 'reclaimed_bytes': 0}
+    deadline = time.time() - grace_period
+    _collect_images(session, upload_folder, batch_size, dry_run, report)
+    _collect_feature_links(session, batch_size, dry_run, report)
+    _collect_blobs(session, batch_size, deadline, dry_run, report)
+    _collect_stray_files(session, upload_folder, batch_size, deadline, dry_run, report)
+    return report
+
+
+def _remove_file(path, dry_run, report):
+    try:
+        size = os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+    except FileNotFoundError:  # Removed in the meantime
+        return
+    report['files'] += 1
+    report['reclaimed_bytes'] += size
+
+
+def _collect_images(session, upload_folder, batch_size, dry_run, report):
+    root = os.path.realpath(upload_folder)
+    orphaned = orphaned_image_condition()
+    last_id, seen_paths = 0, set()
+    while True:
+        rows = session.execute(
+            select(images.c.image_id, images.c.blob_sha256, images.c.url)
+            .where(images.c.image_id > last_id, orphaned)
+            .order_by(images.c.image_id).limit(batch_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].image_id
+        report['images'] += len(rows)
+
+        if not dry_run:
+            session.execute(delete(images).where(images.c.image_id.in_([row.image_id for row in rows])))
+            # Deleting in bulk skips the mapper events that count the references
+            released = Counter(row.blob_sha256 for row in rows if row.blob_sha256 is not None)
+            if released:
+                session.execute(
+                    update(image_blobs).where(image_blobs.c.sha256 == bindparam('blob'))
+                    .values(ref_count=image_blobs.c.ref_count - bindparam('released')),
+                    [{'blob': sha256, 'released': count} for sha256, count in released.items()])
+            session.commit()
+
+        # Files uploaded before content-hash storage, unless another image still shows them
+        paths = {row.url for row in rows if row.blob_sha256 is None and row.url not in seen_paths
+                 and os.path.commonpath([root, os.path.realpath(row.url)]) == root}
+        seen_paths |= paths
+        if paths:
+            used = set(session.execute(select(images.c.url).where(images.c.url.in_(paths), ~orphaned)).scalars())
+            for path in paths - used:
+                _remove_file(path, dry_run, report)
+        session.rollback()  # Ends the read transaction between two batches
+
+
+def _collect_feature_links(session, batch_size, dry_run, report):
+    for property_type, link_model in PROPERTY_FEATURE_MODELS.items():
+        model, id_column = PROPERTY_MODELS[property_type]
+        links = link_model.__table__
+        orphaned = ~exists().where(getattr(model, id_column) == links.c[id_column])
+        if dry_run:
+            report['feature_links'] += session.execute(
+                select(func.count()).select_from(links).where(orphaned)).scalar()
+            continue
+
+        while True:
+            keys = [tuple(row) for row in session.execute(
+                select(links.c[id_column], links.c.feature_id).where(orphaned).limit(batch_size))]
+            if not keys:
+                break
+            session.execute(delete(links).where(tuple_(links.c[id_column], links.c.feature_id).in_(keys)))
+            session.commit()
+            report['feature_links'] += len(keys)
+    session.rollback()
+
+
+def _unchanged_since(path, deadline):
+    try:
+        return os.path.getmtime(path) < deadline
+    except FileNotFoundError:
+        return True
+
+
+def _blob_files(path):
+    """The file of a blob and the files of its variants, written next to it as <hash>.*"""
+    directory, name = os.path.split(path)
+    prefix = name.split('.', 1)[0] + '.'
+    try:
+        return [entry.path for entry in os.scandir(directory) if entry.name.startswith(prefix)]
+    except FileNotFoundError:
+        return []
+
+
+def _collect_blobs(session, batch_size, deadline, dry_run, report):
+    # Images of deleted properties don't count: in a dry run they are still there
+    referenced = exists().where(images.c.blob_sha256 == image_blobs.c.sha256, ~orphaned_image_condition())
+    created_before = datetime.datetime.fromtimestamp(deadline, datetime.timezone.utc).replace(tzinfo=None)
+    last_sha256 = ''
+    while True:
+        rows = session.execute(
+            select(image_blobs.c.sha256, image_blobs.c.path)
+            .where(image_blobs.c.sha256 > last_sha256, image_blobs.c.created_at < created_before, ~referenced)
+            .order_by(image_blobs.c.sha256).limit(batch_size)).all()
+        session.rollback()
+        if not rows:
+            break
+        last_sha256 = rows[-1].sha256
+
+        # A file reused by an upload since the grace period started may be referenced by its commit
+        candidates = {row.sha256: row.path for row in rows if _unchanged_since(row.path, deadline)}
+        if not candidates:
+            continue
+        if not dry_run:
+            # Checked again in the write transaction, which no upload can commit during
+            deleted = session.execute(
+                delete(image_blobs).where(image_blobs.c.sha256.in_(candidates), ~referenced)
+                .returning(image_blobs.c.sha256)).scalars().all()
+            session.execute(delete(image_variants).where(image_variants.c.blob_sha256.in_(deleted)))
+            session.commit()
+            candidates = {sha256: candidates[sha256] for sha256 in deleted}
+
+        report['blobs'] += len(candidates)
+        for path in candidates.values():
+            for file_path in _blob_files(path):
+                _remove_file(file_path, dry_run, report)
+
+
+def _collect_stray_files(session, upload_folder, batch_size, deadline, dry_run, report):
+    """Removes the files of the sharded directories (ab/cd/) without a blob, and the
+    temporary files left by interrupted writes, once the grace period is over."""
+
+    def old_files(directory):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < deadline:
+                yield entry
+
+    def shard_directories(directory):
+        try:
+            return sorted(entry.path for entry in os.scandir(directory)
+                          if entry.is_dir() and len(entry.name) == 2)
+        except FileNotFoundError:
+            return []
+
+    for entry in old_files(upload_folder):
+        if entry.name.startswith(TEMP_FILE_PREFIX):
+            _remove_file(entry.path, dry_run, report)
+
+    batch = []
+    for first_level in shard_directories(upload_folder):
+        for second_level in shard_directories(first_level):
+            for entry in old_files(second_level):
+                if entry.name.endswith(TEMP_FILE_SUFFIX):
+                    _remove_file(entry.path, dry_run, report)
+                else:
+                    batch.append((entry.name.split('.', 1)[0], entry.path))
+                if len(batch) >= batch_size:
+                    _remove_unknown_files(session, batch, dry_run, report)
+                    batch = []
+    _remove_unknown_files(session, batch, dry_run, report)
+
+
+def _remove_unknown_files(session, files, dry_run, report):
+    known = set(session.execute(select(image_blobs.c.sha256)
+                                .where(image_blobs.c.sha256.in_({sha256 for sha256, _ in files}))).scalars())
+    session.rollback()
+    for sha256, path in files:
+        if sha256 not in known:
+            _remove_file(path, dry_run, report)
@@ -0,0 +1,190 @@
+from data_models import Listing, PROPERTY_MODELS, property_key
+import math
+from sqlalchemy import and_, column, event, insert, literal, or_, select, table, text, tuple_
+
+
+# Name of the SQLite R*Tree virtual table holding one bounding box per property
+GEO_INDEX_TABLE = 'property_geo_index'
+
+# Each property type gets its own slot so that (type, id) maps to a unique R*Tree id
+PROPERTY_TYPE_CODES = {'residence': 1, 'commercial': 2, 'land': 3}
+
+KM_PER_DEGREE_LAT = 111.195  # Mean length of one degree of latitude
+EARTH_RADIUS_KM = 6371.0088
+
+geo_index = table(GEO_INDEX_TABLE,
+                  column('id'), column('min_lat'), column('max_lat'),
+                  column('min_lon'), column('max_lon'),
+                  column('property_type'), column('property_id'))
+
+
+def geo_key(property_type, property_id):
+    """Returns the R*Tree id used for a property of the given type."""
+    return property_id * 4 + PROPERTY_TYPE_CODES[property_type]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Returns the great-circle distance in kilometers between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_to_box(lat, lon, radius_km):
+    """Returns the (south, west, north, east) box enclosing a circle around a point."""
+    d_lat = radius_km / KM_PER_DEGREE_LAT
+    south, north = max(-90.0, lat - d_lat), min(90.0, lat + d_lat)
+
+    # Near the poles the circle covers every meridian
+    cos_lat = math.cos(math.radians(lat))
+    if north >= 90.0 or south <= -90.0 or cos_lat * 180.0 * KM_PER_DEGREE_LAT <= radius_km:
+        return south, -180.0, north, 180.0
+
+    d_lon = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    west, east = lon - d_lon, lon + d_lon
+    # Wrap around the antimeridian; a box with west > east crosses it
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return south, west, north, east
+
+
+def parse_geo_filters(lat, lon, radius_km, bbox, sort):
+    """
+    Validates the location parameters of a property search and returns a
+    (search_box, bbox) pair of (south, west, north, east) boxes: the box to look
+    up in the spatial index and the exact bbox requested, each None if absent.
+    The bbox parameter uses the GeoJSON order 'min_lon,min_lat,max_lon,max_lat'.
+    Raises ValueError on invalid input.
+    """
+
+    if (lat is None) != (lon is None):
+        raise ValueError("Both 'lat' and 'lon' are required for a location search.")
+    if lat is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("'lat' must be between -90 and 90 and 'lon' between -180 and 180.")
+    if radius_km is not None:
+        if lat is None:
+            raise ValueError("'radius_km' requires 'lat' and 'lon'.")
+        if radius_km <= 0:
+            raise ValueError("'radius_km' must be a positive number.")
+    if sort == 'distance' and lat is None:
+        raise ValueError("Sorting by distance requires 'lat' and 'lon'.")
+
+    box = None
+    if bbox:
+        try:
+            west, south, east, north = (float(value) for value in bbox.split(','))
+        except ValueError:
+            raise ValueError("'bbox' must be 'min_lon,min_lat,max_lon,max_lat'.")
+        if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+            raise ValueError("'bbox' is outside the valid coordinate range.")
+        box = (south, west, north, east)
+
+    # The circle around the point is usually much smaller than a map viewport,
+    # so it drives the index lookup when both are given
+    if radius_km is not None:
+        return radius_to_box(lat, lon, radius_km), box
+    return box, box
+
+
+def _box_condition(min_lat, max_lat, min_lon, max_lon, box):
+    """Builds the overlap condition of a (south, west, north, east) box."""
+    south, west, north, east = box
+    latitude = and_(max_lat >= south, min_lat <= north)
+    if west <= east:
+        return and_(latitude, max_lon >= west, min_lon <= east)
+    # The box crosses the antimeridian
+    return and_(latitude, or_(max_lon >= west, min_lon <= east))
+
+
+def squared_distance_km(latitude, longitude, lat, lon):
+    """
+    SQL expression of the squared distance in km between a column pair and a point.
+    Uses the equirectangular approximation, which only needs arithmetic (so it runs
+    on any database) and is accurate to well under 1% at city scale.
+    """
+    km_per_degree_lon = KM_PER_DEGREE_LAT * math.cos(math.radians(lat))
+    d_lat = (latitude - lat) * KM_PER_DEGREE_LAT
+    d_lon = (longitude - lon) * km_per_degree_lon
+    return d_lat * d_lat + d_lon * d_lon
+
+
+def filter_by_location(query, box, bbox=None, origin=None, radius_km=None):
+    """
+    Restricts a Listing query to the given (south, west, north, east) box using the
+    R*Tree index, then applies the exact bbox and radius conditions on the candidates.
+    """
+
+    if _uses_geo_index(query.session):
+        candidates = select(geo_index.c.property_type, geo_index.c.property_id).where(
+            _box_condition(geo_index.c.min_lat, geo_index.c.max_lat,
+                           geo_index.c.min_lon, geo_index.c.max_lon, box))
+        query = query.filter(tuple_(Listing.property_type, Listing.property_id).in_(candidates))
+    else:
+        query = query.filter(_box_condition(Listing.latitude, Listing.latitude,
+                                            Listing.longitude, Listing.longitude, box))
+
+    if bbox is not None:
+        query = query.filter(_box_condition(Listing.latitude, Listing.latitude,
+                                            Listing.longitude, Listing.longitude, bbox))
+    if radius_km is not None:
+        query = query.filter(
+            squared_distance_km(Listing.latitude, Listing.longitude, *origin) <= radius_km ** 2)
+    return query
+
+
+def _uses_geo_index(session):
+    """The R*Tree table only exists on SQLite databases."""
+    return session.get_bind().dialect.name == 'sqlite'
+
+
+def _sync_location(mapper, connection, target):
+    """Inserts or moves the R*Tree entry of a property after it is written."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    property_type, property_id = property_key(target)
+    if target.latitude is None or target.longitude is None:
+        _remove_location(mapper, connection, target)
+        return
+
+    connection.execute(
+        text(f"INSERT OR REPLACE INTO {GEO_INDEX_TABLE} "
+             "(id, min_lat, max_lat, min_lon, max_lon, property_type, property_id) "
+             "VALUES (:id, :lat, :lat, :lon, :lon, :property_type, :property_id)"),
+        {'id': geo_key(property_type, property_id), 'lat': float(target.latitude),
+         'lon': float(target.longitude), 'property_type': property_type, 'property_id': property_id})
+
+
+def _remove_location(mapper, connection, target):
+    """Removes the R*Tree entry of a deleted property."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    property_type, property_id = property_key(target)
+    connection.execute(text(f"DELETE FROM {GEO_INDEX_TABLE} WHERE id = :id"),
+                       {'id': geo_key(property_type, property_id)})
+
+
+def index_locations(connection, property_type, property_ids):
+    """Inserts the R*Tree entries of new located properties, inserted in bulk."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    model, id_column = PROPERTY_MODELS[property_type]
+    property_id = getattr(model, id_column)
+    connection.execute(insert(geo_index).from_select(
+        ['id', 'min_lat', 'max_lat', 'min_lon', 'max_lon', 'property_type', 'property_id'],
+        select(geo_key(property_type, property_id), model.latitude, model.latitude,
+               model.longitude, model.longitude, literal(property_type), property_id)
+        .where(property_id.in_(property_ids), model.latitude.is_not(None), model.longitude.is_not(None))))
+
+
+# Keep the spatial index in sync with every insert, update and delete of a property
+for _model, _ in PROPERTY_MODELS.values():
+    event.listen(_model, 'after_insert', _sync_location)
+    event.listen(_model, 'after_update', _sync_location)
+    event.listen(_model, 'after_delete', _remove_location)
@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from data_models import GeocodeStatusEnum, PROPERTY_MODELS, db
+from get_info import GeocodingError, geocode, normalize_address
+import random
+import time
+
+
+def property_address(property_obj):
+    """Full address of a property, as sent to the geocoder."""
+    return f"{property_obj.street_address}, {property_obj.city}, {property_obj.state}, {property_obj.zip_code}"
+
+
+def geocode_with_retries(address, timeout, retries, backoff):
+    """
+    Geocodes an address, retrying failed requests up to `retries` times. The delay
+    before each retry doubles from `backoff` seconds, plus a random jitter so that
+    workers failing together don't retry together. Returns (latitude, longitude),
+    None if the address is not found, and raises GeocodingError if every attempt failed.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return geocode(address, timeout=timeout)
+        except GeocodingError as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Geocoding attempt {attempt + 1} failed ({e}), retrying in about {delay:.1f} s")
+            time.sleep(delay + random.uniform(0, delay))
+
+
+class GeocodingPool:
+    """
+    Resolves the coordinates of saved properties in a pool of worker threads, so that
+    requests never wait on the geocoder. Each property is saved with the PENDING
+    geocode status; its worker then sets its coordinates and the RESOLVED status
+    (FAILED if the address can't be geocoded) through the ORM, which updates the
+    listings and indexes like any other property write.
+
+    With 0 workers the properties are geocoded in the calling thread.
+    """
+
+    def __init__(self, app, workers=4, timeout=5, retries=3, backoff=0.5):
+        self.app = app
+        self.workers, self.timeout, self.retries, self.backoff = workers, timeout, retries, backoff
+        self._executor = None
+
+    def submit(self, property_type, property_id, address, on_resolved=None):
+        """
+        Geocodes a property in the background, then calls on_resolved(property_type,
+        property_id) if given. Returns a future, or None if it was geocoded inline.
+        """
+        if not self.workers:
+            self._resolve(property_type, property_id, address, on_resolved)
+            return None
+        return self._get_executor().submit(self._resolve, property_type, property_id, address, on_resolved)
+
+    def geocode_many(self, addresses):
+        """
+        Geocodes addresses concurrently on the workers of the pool (in the calling thread
+        with 0 workers), each distinct normalized address once. Waits for all of them and
+        returns a dict of each address to its (latitude, longitude), or None if it failed.
+        """
+        distinct = {normalize_address(address): address for address in addresses}
+        if self.workers:
+            results = self._get_executor().map(self._geocode, distinct.values())
+        else:
+            results = map(self._geocode, distinct.values())
+        coordinates = dict(zip(distinct, results))
+        return {address: coordinates[normalize_address(address)] for address in addresses}
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='geocoder')
+        return self._executor
+
+    def _geocode(self, address):
+        """Geocodes an address with retries; returns None if it is not found or every attempt failed."""
+        try:
+            return geocode_with_retries(address, self.timeout, self.retries, self.backoff)
+        except GeocodingError as e:
+            print(f"Geocoding of '{address}' failed: {e}")
+            return None
+
+    def _resolve(self, property_type, property_id, address, on_resolved):
+        coordinates = self._geocode(address)
+
+        with self.app.app_context():
+            try:
+                model, _ = PROPERTY_MODELS[property_type]
+                property_obj = db.session.get(model, property_id)
+                # Skip properties deleted, or moved to another address, in the meantime
+                if property_obj is None or property_address(property_obj) != address:
+                    return
+                if coordinates is not None:
+                    property_obj.latitude, property_obj.longitude = coordinates
+                    property_obj.geocode_status = GeocodeStatusEnum.RESOLVED
+                else:
+                    property_obj.geocode_status = GeocodeStatusEnum.FAILED
+                db.session.commit()
+
+                if on_resolved is not None:
+                    on_resolved(property_type, property_id)
+            except Exception as e:
+                # A worker thread has no caller to report to
+                db.session.rollback()
+                print(f"Error while saving the coordinates of {property_type} {property_id}: {e}")
+
+    def resolve_pending(self, include_failed=False):
+        """Geocodes the properties left pending (e.g. by a restart), and the failed ones if asked.
+        Waits until they are all processed and returns their number."""
+        statuses = [GeocodeStatusEnum.PENDING] + ([GeocodeStatusEnum.FAILED] if include_failed else [])
+        properties = [(property_type, getattr(property_obj, id_column), property_address(property_obj))
+                      for property_type, (model, id_column) in PROPERTY_MODELS.items()
+                      for property_obj in model.query.filter(model.geocode_status.in_(statuses))]
+        futures = [self.submit(*entry) for entry in properties]
+        wait([future for future in futures if future is not None])
+        return len(properties)
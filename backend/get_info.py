@@ -1,20 +1,175 @@
+from collections import OrderedDict
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
 import requests
+from requests.adapters import HTTPAdapter
+import sqlite3
+import threading
+import time
 
 
 load_dotenv()
 API_KEY_LAT_LONG = os.getenv('API_KEY_LAT_LONG')
+# Can point to a local stub geocoder answering like Geoapify, for development and tests
+GEOCODER_URL = os.getenv('GEOCODER_URL', "https://api.geoapify.com/v1/geocode/search")
+GEOCODE_TIMEOUT = float(os.getenv('GEOCODE_TIMEOUT', 5))  # Seconds
+GEOCODE_POOL_SIZE = int(os.getenv('GEOCODE_POOL_SIZE', 10))  # Kept-alive connections to the geocoder
 
+# Geocoded addresses are cached in memory (GEOCODE_CACHE_SIZE entries) in front of an SQLite
+# table shared by the worker processes ('memory' keeps the in-memory cache only). Found
+# addresses are kept GEOCODE_CACHE_TTL seconds, addresses without results GEOCODE_NEGATIVE_TTL.
+GEOCODE_CACHE = os.getenv('GEOCODE_CACHE', "sqlite:///" + os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "../data", "geocode_cache.sqlite"))
+GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', 10000))
+GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 30 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.getenv('GEOCODE_NEGATIVE_TTL', 24 * 3600))
 
-def get_lat_long(address):
+MISS = object()  # Returned by GeocodeCache.get for addresses it doesn't hold
+
+
+def normalize_address(address):
+    """Normalizes an address for the cache: case-folded, single-spaced, with empty parts dropped."""
+    parts = (' '.join(part.split()) for part in address.casefold().split(','))
+    return ', '.join(part for part in parts if part)
+
+
+class GeocodeCache:
+    """
+    Coordinates of geocoded addresses, keyed by normalized address: an in-process LRU
+    in front of an SQLite table (when a path is given) shared by the worker processes.
+    Addresses without results are cached as None (negative caching), for a shorter time.
+    Counts the hits of each level and the misses.
+    """
+
+    def __init__(self, path=None, max_entries=10000, ttl=30 * 24 * 3600, negative_ttl=24 * 3600):
+        self.path = path
+        self.max_entries, self.ttl, self.negative_ttl = max_entries, ttl, negative_ttl
+        self._entries = OrderedDict()  # address -> (coordinates or None, expiry time)
+        self._lock = threading.Lock()
+        self.memory_hits = self.sqlite_hits = self.negative_hits = self.misses = 0
+        if path is not None:
+            with self._connect() as connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("CREATE TABLE IF NOT EXISTS geocode_cache (address TEXT PRIMARY KEY, "
+                                   "latitude REAL, longitude REAL, expires_at REAL NOT NULL)")
+                connection.execute("CREATE INDEX IF NOT EXISTS ix_geocode_cache_expires_at "
+                                   "ON geocode_cache (expires_at)")
+
+    @contextmanager
+    def _connect(self):
+        """Opens a connection to the SQLite cache, committed and closed on exit."""
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, address):
+        """Returns the cached coordinates of an address, None if it has no results, or MISS."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(address)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(address)  # Mark as most recently used
+                self.memory_hits += 1
+                self.negative_hits += entry[0] is None
+                return entry[0]
+
+        row = None
+        if self.path is not None:
+            try:
+                with self._connect() as connection:
+                    row = connection.execute("SELECT latitude, longitude, expires_at FROM geocode_cache "
+                                             "WHERE address = ? AND expires_at > ?", (address, now)).fetchone()
+            except sqlite3.Error as e:  # The cache is an optimization: geocode as if it missed
+                print(f"Geocoding cache error: {e}")
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return MISS
+            coordinates = (row[0], row[1]) if row[0] is not None else None
+            self._remember(address, coordinates, row[2])
+            self.sqlite_hits += 1
+            self.negative_hits += coordinates is None
+            return coordinates
+
+    def set(self, address, coordinates):
+        """Caches the coordinates of an address, or None if it has no results."""
+        expires_at = time.time() + (self.ttl if coordinates is not None else self.negative_ttl)
+        with self._lock:
+            self._remember(address, coordinates, expires_at)
+        if self.path is not None:
+            latitude, longitude = coordinates if coordinates is not None else (None, None)
+            try:
+                with self._connect() as connection:
+                    connection.execute("INSERT OR REPLACE INTO geocode_cache "
+                                       "(address, latitude, longitude, expires_at) VALUES (?, ?, ?, ?)",
+                                       (address, latitude, longitude, expires_at))
+                    connection.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                print(f"Geocoding cache error: {e}")
+
+    def _remember(self, address, coordinates, expires_at):
+        self._entries[address] = (coordinates, expires_at)
+        self._entries.move_to_end(address)
+        # Evict the least recently used entries
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        hits = self.memory_hits + self.sqlite_hits
+        lookups = hits + self.misses
+        stats = {
+            'hits': hits,
+            'memory_hits': self.memory_hits,
+            'sqlite_hits': self.sqlite_hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'entries': len(self._entries),
+        }
+        if self.path is not None:
+            with self._connect() as connection:
+                stats['stored_entries'] = connection.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+        return stats
+
+
+def create_geocode_cache(url=GEOCODE_CACHE):
+    """Creates the geocoding cache described by a URL: 'memory' or 'sqlite:///path/to/cache.sqlite'."""
+    if url == 'memory':
+        return GeocodeCache(None, GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, GEOCODE_NEGATIVE_TTL)
+    if url.startswith('sqlite:///'):
+        return GeocodeCache(url[len('sqlite:///'):], GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, GEOCODE_NEGATIVE_TTL)
+    raise ValueError(f"Unsupported geocoding cache: {url}")
+
+
+geocode_cache = create_geocode_cache()
+
+# Shared by all the geocoding calls, so that connections to the geocoder are kept alive and reused
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_maxsize=GEOCODE_POOL_SIZE))
+http_session.mount('http://', HTTPAdapter(pool_maxsize=GEOCODE_POOL_SIZE))
+
+
+class GeocodingError(Exception):
+    """The geocoder couldn't be reached or failed to answer; the same request may succeed later."""
+
+
+def geocode(address, timeout=GEOCODE_TIMEOUT):
     """
     Fetches latitude and longitude for a given address using the Geoapify
     Geocoding API. Returns a tuple containing (latitude, longitude) if the
-    address is found, otherwise None.
+    address is found, otherwise None. Raises GeocodingError on timeouts,
+    connection errors, rate limiting and server errors.
+    Answers are cached by normalized address; errors are not.
     """
 
-    url = "https://api.geoapify.com/v1/geocode/search"
+    key = normalize_address(address)
+    cached = geocode_cache.get(key)
+    if cached is not MISS:
+        return cached
 
     # Define the parameters for the API request
     params = {
@@ -23,7 +178,13 @@ def get_lat_long(address):
     }
 
     # Send a GET request to the Geoapify API
-    response = requests.get(url, params=params)
+    try:
+        response = http_session.get(GEOCODER_URL, params=params, timeout=timeout)
+    except requests.RequestException as e:
+        raise GeocodingError(str(e)) from e
+
+    if response.status_code == 429 or response.status_code >= 500:
+        raise GeocodingError(f"{response.status_code} - {response.text}")
 
     # Check if the request was successful
     if response.status_code == 200:
@@ -34,15 +195,26 @@ def get_lat_long(address):
             # Extract latitude and longitude from the first result
             latitude = data['features'][0]['properties']['lat']
             longitude = data['features'][0]['properties']['lon']
+            geocode_cache.set(key, (latitude, longitude))
             return latitude, longitude
         else:
             print("No results found for the given address.")
+            geocode_cache.set(key, None)
             return None
     else:
         print(f"Error: {response.status_code} - {response.text}")
         return None
 
 
+def get_lat_long(address):
+    """Same as geocode, returning None when the geocoder fails."""
+    try:
+        return geocode(address)
+    except GeocodingError as e:
+        print(f"Error: {e}")
+        return None
+
+
 def main():
     address = "Lietzenburger Straße 91, Emmendorf, Germany"
     coordinates = get_lat_long(address)
@@ -0,0 +1,215 @@
+from concurrent.futures import wait
+from data_models import Image, ImageBlob
+import hashlib
+import os
+import re
+from sqlalchemy import event, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, attributes
+import tempfile
+
+
+image_blobs = ImageBlob.__table__
+
+# Handlers called as handler({sha256: path}) with the blobs registered by a committed session
+_stored_blob_handlers = []
+
+CHUNK_SIZE = 64 * 1024  # Bytes read from an upload at a time
+IMAGE_URL_PREFIX = '/images/'  # Route serving the stored files by name (see stored_file_path)
+# Name of a stored file: <sha256>.<extension>, or <sha256>.<variant>.<extension> for a variant
+STORED_FILE_NAME = re.compile(r'([0-9a-f]{64})(\.[a-z]+)?\.[a-z0-9]+')
+# Extensions spelled differently for the same format, so that a file has a single path
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+# First bytes of the accepted image formats, and the extension their files are stored with
+IMAGE_SIGNATURES = ((b'\x89PNG\r\n\x1a\n', 'png'), (b'\xff\xd8\xff', 'jpg'), (b'GIF87a', 'gif'), (b'GIF89a', 'gif'))
+
+
+def file_extension(filename):
+    """Returns the lowercased extension of a file name, with its aliases replaced."""
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return EXTENSION_ALIASES.get(extension, extension)
+
+
+def sniff_image_type(stream):
+    """
+    Returns the extension of the format of an image stream (png, jpg or gif) from its
+    first bytes, whatever its file name says, or None if it is not one of them. The
+    stream is left at its current position.
+    """
+    position = stream.tell()
+    header = stream.read(8)
+    stream.seek(position)
+    return next((extension for signature, extension in IMAGE_SIGNATURES if header.startswith(signature)), None)
+
+
+def blob_path(upload_folder, sha256, extension):
+    """
+    Path of the file of a blob, sharded by the first two bytes of its hash
+    (e.g. uploads/ab/cd/abcd....jpg) so that no directory grows too large.
+    """
+    name = f"{sha256}.{extension}" if extension else sha256
+    return os.path.join(upload_folder, sha256[:2], sha256[2:4], name)
+
+
+def stored_file_path(upload_folder, name):
+    """
+    Path of a stored file (a blob or one of its variants, which are written next to it)
+    from its name, or None if the name is not one of a stored file. The name holds the
+    content hash, so no lookup is needed.
+    """
+    match = STORED_FILE_NAME.fullmatch(name)
+    if match is None:
+        return None
+    sha256 = match.group(1)
+    return os.path.join(upload_folder, sha256[:2], sha256[2:4], name)
+
+
+def public_image_url(path, upload_folder):
+    """
+    URL of an image path as returned by the API: stored files are served by name from
+    IMAGE_URL_PREFIX, other images (imported URLs, files uploaded before content-hash
+    storage) are returned as they are.
+    """
+    name = os.path.basename(path)
+    if stored_file_path(upload_folder, name) == path:
+        return IMAGE_URL_PREFIX + name
+    return path
+
+
+def store_upload(stream, upload_folder, extension):
+    """
+    Streams an uploaded file to disk while hashing it, then moves it to its content-hash
+    path. A file already stored under the same hash is kept and the new copy dropped, so
+    uploading the same image twice writes it once. Returns (sha256, path, size).
+
+    The file is written before the database transaction commits: a rolled back upload
+    leaves a file without a blob, removed by the garbage collector (see garbage_collector.py).
+    """
+
+    os.makedirs(upload_folder, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    temp_file = tempfile.NamedTemporaryFile(dir=upload_folder, prefix='.upload-', delete=False)
+    try:
+        with temp_file:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        path = blob_path(upload_folder, sha256, extension)
+        try:
+            # Already stored: keep it, marked as in use for the grace period of the garbage collector
+            os.utime(path)
+            os.remove(temp_file.name)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_file.name, path)  # Atomic: the path never holds a partial file
+    except BaseException:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+        raise
+    return sha256, path, size
+
+
+def store_uploads(uploads, upload_folder, executor=None):
+    """
+    Stores several (stream, extension) uploads with store_upload, concurrently on the
+    threads of an executor (one after the other without one): hashing and file writes
+    release the GIL. Returns their (sha256, path, size) in order; raises the error of the
+    first upload that failed once the others are done.
+    """
+    if executor is None:
+        return [store_upload(stream, upload_folder, extension) for stream, extension in uploads]
+    futures = [executor.submit(store_upload, stream, upload_folder, extension) for stream, extension in uploads]
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+def register_blobs(session, blobs):
+    """
+    Adds the blobs of stored files, given as (sha256, path, size), in one statement of
+    the session's transaction, except the ones that exist. Their reference count starts
+    at zero and follows the Image rows pointing at them. The handlers registered with
+    listen_stored_blobs are called once the session commits.
+    """
+    if not blobs:
+        return
+    session.execute(sqlite_insert(image_blobs)
+                    .values([{'sha256': sha256, 'path': path, 'size': size, 'ref_count': 0}
+                             for sha256, path, size in blobs])
+                    .on_conflict_do_nothing(index_elements=['sha256']))
+    session.info.setdefault('stored_blobs', {}).update((sha256, path) for sha256, path, _ in blobs)
+
+
+def listen_stored_blobs(handler):
+    """Registers a handler processing the files stored by committed uploads, e.g. to resize them."""
+    _stored_blob_handlers.append(handler)
+
+
+@event.listens_for(Session, 'after_commit')
+def _stored_blobs_committed(session):
+    blobs = session.info.pop('stored_blobs', None)
+    if blobs:
+        for handler in _stored_blob_handlers:
+            handler(blobs)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stored_blobs(session, previous_transaction):
+    session.info.pop('stored_blobs', None)
+
+
+def store_legacy_images(session, upload_folder):
+    """
+    Moves the images uploaded before content-hash storage (Image rows without a blob
+    whose url is a file of the upload folder) to their blobs, then deletes the old
+    files no Image points at anymore. Returns (images moved, files deleted).
+    """
+
+    root = os.path.realpath(upload_folder)
+    images = session.query(Image).filter(Image.blob_sha256.is_(None)).all()
+    moved, old_paths = 0, set()
+    for image in images:
+        if os.path.commonpath([root, os.path.realpath(image.url)]) != root or not os.path.isfile(image.url):
+            continue  # An external URL, or a file that is missing
+        with open(image.url, 'rb') as stream:
+            sha256, path, size = store_upload(stream, upload_folder, file_extension(image.url))
+        register_blobs(session, [(sha256, path, size)])
+        old_paths.add(image.url)
+        image.url, image.blob_sha256 = path, sha256
+        moved += 1
+    session.commit()
+
+    still_used = {url for (url,) in session.query(Image.url).filter(Image.url.in_(old_paths))}
+    deleted = 0
+    for path in old_paths - still_used:
+        os.remove(path)
+        deleted += 1
+    return moved, deleted
+
+
+def _add_reference(connection, sha256, delta):
+    if sha256 is not None:
+        connection.execute(update(image_blobs).where(image_blobs.c.sha256 == sha256)
+                           .values(ref_count=image_blobs.c.ref_count + delta))
+
+
+@event.listens_for(Image, 'after_insert')
+def _reference_blob(mapper, connection, target):
+    _add_reference(connection, target.blob_sha256, 1)
+
+
+@event.listens_for(Image, 'after_update')
+def _move_reference(mapper, connection, target):
+    history = attributes.get_history(target, 'blob_sha256')
+    if history.has_changes():
+        for sha256 in history.deleted:
+            _add_reference(connection, sha256, -1)
+        for sha256 in history.added:
+            _add_reference(connection, sha256, 1)
+
+
+@event.listens_for(Image, 'after_delete')
+def _release_blob(mapper, connection, target):
+    _add_reference(connection, target.blob_sha256, -1)
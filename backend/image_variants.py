@@ -0,0 +1,177 @@
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from data_models import ImageBlob, ImageVariant, db
+import functools
+from image_store import listen_stored_blobs
+import multiprocessing
+import os
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+import threading
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # Without Pillow, listings show the original uploads
+    PILImage = None
+
+
+# Maximum width of each variant in pixels, from the largest: each one is resized from the
+# previous one rather than from the original. Images are never enlarged.
+VARIANT_WIDTHS = {'full': 1600, 'card': 640, 'thumbnail': 320}
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}  # File extension: Pillow format
+VARIANT_QUALITY = 80
+THUMBNAIL_VARIANT = ('thumbnail', 'webp')  # (variant, format) shown on the listing cards
+
+
+def variant_path(path, variant, extension):
+    """Path of a variant, next to the file it is rendered from: <hash>.<variant>.<extension>."""
+    return f"{os.path.splitext(path)[0]}.{variant}.{extension}"
+
+
+def worker_context():
+    """
+    Multiprocessing context of the rendering workers. They are forked from a fork server
+    that only imported this module, not from the application: a fork of the server
+    process would inherit its threads' locks (held forever in the child if another
+    thread had taken them) and its database connections.
+    """
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['image_variants'])  # Imported once, by the fork server
+    return context
+
+
+def render_variants(path, widths=VARIANT_WIDTHS):
+    """
+    Renders the variants of an image file in every format, next to it, with the given
+    maximum widths ({variant: width}), and returns their ImageVariant column values
+    (without the blob). Runs in the worker processes of ImageVariantPool. Files are written under a temporary name then renamed, so that a
+    variant is never served half-written.
+    """
+
+    full_width = max(widths.values())
+    with PILImage.open(path) as source:
+        # JPEGs are decoded at the smallest scale (1/2 to 1/8) keeping both sides above the
+        # full width, which is much faster than decoding the full photo and resizing it
+        source.draft('RGB', (full_width, full_width))
+        image = ImageOps.exif_transpose(source)  # Phones store the orientation apart from the pixels
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no transparency: flatten onto white
+            image = image.convert('RGBA')
+            background = PILImage.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    variants = []
+    for variant, width in widths.items():
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                 PILImage.LANCZOS, reducing_gap=3.0)
+        for extension, image_format in VARIANT_FORMATS.items():
+            output = variant_path(path, variant, extension)
+            temp_path = f"{output}.{os.getpid()}.tmp"
+            image.save(temp_path, image_format, quality=VARIANT_QUALITY)
+            os.replace(temp_path, output)
+            variants.append({'variant': variant, 'format': extension, 'path': output,
+                             'width': image.width, 'height': image.height, 'size': os.path.getsize(output)})
+    return variants
+
+
+class ImageVariantPool:
+    """
+    Renders the thumbnail, card and full-width variants of uploaded images in a pool of
+    worker processes, off the request path: resizing is CPU-bound, so threads would
+    wait on each other for the GIL. The files stored by each committed upload are
+    submitted; the variants are recorded in the image_variants table once rendered,
+    and listings show the original image until then.
+
+    With 0 workers the variants are rendered in the calling thread. Without Pillow
+    nothing is rendered.
+    """
+
+    def __init__(self, app, workers=2):
+        self.app = app
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._rendering = set()  # Blobs submitted and not recorded yet
+        listen_stored_blobs(self.submit)
+
+    def submit(self, blobs):
+        """
+        Renders the variants of blobs, given as {sha256: path}, in the background. Returns
+        futures done once the variants of each blob submitted are recorded (none with 0
+        workers, or without Pillow).
+        """
+        if PILImage is None:
+            return []
+
+        with self._lock:
+            blobs = {sha256: path for sha256, path in blobs.items() if sha256 not in self._rendering}
+            self._rendering.update(blobs)
+
+        futures = []
+        for sha256, path in blobs.items():
+            if not self.workers:
+                self._record(sha256, path, self._render(path))
+                continue
+            recorded = Future()
+            # Only the path and widths are sent: the workers share no state with this process
+            future = self._get_executor().submit(render_variants, path, VARIANT_WIDTHS)
+            future.add_done_callback(functools.partial(self._rendered, sha256, path, recorded))
+            futures.append(recorded)
+        return futures
+
+    def render_missing(self):
+        """Renders the variants of the blobs missing some, e.g. stored before a restart or
+        before Pillow was installed. Waits until they are all recorded and returns their number."""
+        rendered = (db.session.query(ImageVariant.blob_sha256).group_by(ImageVariant.blob_sha256)
+                    .having(func.count() == len(VARIANT_WIDTHS) * len(VARIANT_FORMATS)))
+        blobs = dict(db.session.query(ImageBlob.sha256, ImageBlob.path).filter(ImageBlob.sha256.not_in(rendered)))
+        wait(self.submit(blobs))
+        return len(blobs)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context())
+        return self._executor
+
+    @staticmethod
+    def _render(path):
+        """Renders the variants of a file; returns None if it can't be read as an image."""
+        try:
+            return render_variants(path)
+        except Exception as e:
+            print(f"Rendering the variants of {path} failed: {e}")
+            return None
+
+    def _rendered(self, sha256, path, recorded, future):
+        try:
+            variants = future.result()
+        except Exception as e:  # Raised in the worker process, or the pool broke
+            print(f"Rendering the variants of {path} failed: {e}")
+            variants = None
+        try:
+            self._record(sha256, path, variants)
+        finally:
+            recorded.set_result(variants is not None)
+
+    def _record(self, sha256, path, variants):
+        try:
+            if variants is None:
+                return
+            with self.app.app_context():
+                try:
+                    # The blob may have been rendered before (e.g. by render_missing)
+                    existing = {(variant.variant, variant.format) for variant in
+                                ImageVariant.query.filter_by(blob_sha256=sha256)}
+                    db.session.add_all([ImageVariant(blob_sha256=sha256, **values) for values in variants
+                                        if (values['variant'], values['format']) not in existing])
+                    db.session.commit()
+                except SQLAlchemyError as e:
+                    # A worker thread has no caller to report to
+                    db.session.rollback()
+                    print(f"Error while saving the variants of {path}: {e}")
+        finally:
+            with self._lock:
+                self._rendering.discard(sha256)
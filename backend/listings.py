@@ -0,0 +1,202 @@
+from data_models import Listing, PROPERTY_MODELS, db, property_key
+from feature_bits import feature_mask_column, has_all_features
+from fulltext import index_listing, index_properties, rebuild_text_index, text_match, unindex_listing
+from geo_index import filter_by_location, index_locations
+import math
+from sqlalchemy import Integer, String, delete, event, insert, literal, or_, select, type_coerce, update
+
+
+listings = Listing.__table__
+
+# Handlers called as handler(session, property_type, property_ids) for properties inserted
+# in bulk, which skips the mapper events (see sync_inserted_properties)
+_bulk_insert_handlers = []
+
+
+def normalize_location(value):
+    """Normalizes a city or state name for lookups: trimmed, single-spaced and case-folded."""
+    return ' '.join(value.split()).casefold() if value else ''
+
+
+def log_scale(value):
+    """Natural log of a positive price or area, None otherwise."""
+    return math.log(value) if value and value > 0 else None
+
+
+def _property_columns(property_type):
+    """Selects the columns of a property table that are copied into the listings table."""
+    model, id_column = PROPERTY_MODELS[property_type]
+    return select(
+        getattr(model, id_column).label('id'),
+        model.owner_id,
+        # Read the raw value: older rows may store the action in a different case
+        type_coerce(model.ad_action, String).label('ad_action'),
+        model.ad_title,
+        model.city,
+        model.state,
+        model.price,
+        model.surface_area,
+        model.land_area,
+        model.latitude,
+        model.longitude,
+        model.ad_creation_date,
+        # Only residences have a number of rooms
+        getattr(model, 'rooms_count', literal(None, Integer)).label('rooms_count'),
+        feature_mask_column(property_type, getattr(model, id_column)).label('feature_mask'),
+    )
+
+
+def _listing_values(property_type, row):
+    """Builds the listings row of a property from its table row."""
+    return {
+        'property_type': property_type,
+        'property_id': row.id,
+        'owner_id': row.owner_id,
+        'ad_action': row.ad_action.upper(),  # 'Sale', 'sale' and 'SALE' all become the enum name
+        'ad_title': row.ad_title,
+        'city': row.city,
+        'state': row.state,
+        'city_normalized': normalize_location(row.city),
+        'state_normalized': normalize_location(row.state),
+        'price': row.price,
+        'surface_area': row.surface_area,
+        'land_area': row.land_area,
+        'latitude': row.latitude,
+        'longitude': row.longitude,
+        'ad_creation_date': row.ad_creation_date,
+        'feature_mask': row.feature_mask,
+        'rooms_count': row.rooms_count,
+        'log_price': log_scale(row.price),
+        'log_area': log_scale(row.land_area if property_type == 'land' else row.surface_area),
+    }
+
+
+def _sync_listing(mapper, connection, target):
+    """Inserts or refreshes the listings row of a property after it is written."""
+    property_type, property_id = property_key(target)
+    model, id_column = PROPERTY_MODELS[property_type]
+
+    # Read the row back so that SQL defaults and type conversions are applied
+    row = connection.execute(
+        _property_columns(property_type).where(getattr(model, id_column) == property_id)).one()
+    values = _listing_values(property_type, row)
+
+    listing_id = _find_listing_id(connection, property_type, property_id)
+    if listing_id is None:
+        listing_id = connection.execute(insert(listings).values(**values)).inserted_primary_key[0]
+    else:
+        connection.execute(update(listings).where(listings.c.listing_id == listing_id).values(**values))
+
+    index_listing(connection, listing_id, property_type, property_id)
+
+
+def _remove_listing(mapper, connection, target):
+    """Removes the listings row of a deleted property."""
+    listing_id = _find_listing_id(connection, *property_key(target))
+    if listing_id is not None:
+        unindex_listing(connection, listing_id)
+        connection.execute(delete(listings).where(listings.c.listing_id == listing_id))
+
+
+def _find_listing_id(connection, property_type, property_id):
+    """Returns the listing_id of a property, or None if it has no listing yet."""
+    return connection.execute(
+        select(listings.c.listing_id)
+        .where(listings.c.property_type == property_type, listings.c.property_id == property_id)
+    ).scalar()
+
+
+# Keep the listings table in sync with every insert, update and delete of a property
+for _model, _ in PROPERTY_MODELS.values():
+    event.listen(_model, 'after_insert', _sync_listing)
+    event.listen(_model, 'after_update', _sync_listing)
+    event.listen(_model, 'after_delete', _remove_listing)
+
+
+def listen_bulk_insert(handler):
+    """Registers a handler keeping a derived table or cache in sync with the properties inserted in bulk."""
+    _bulk_insert_handlers.append(handler)
+
+
+def sync_inserted_properties(session, property_type, property_ids):
+    """
+    Replaces the mapper events for properties inserted in bulk (with their feature
+    links): writes their listings rows, full-text and geo index entries in a few
+    set-based statements, then runs the handlers registered with listen_bulk_insert.
+    """
+
+    model, id_column = PROPERTY_MODELS[property_type]
+    connection = session.connection()
+    rows = connection.execute(_property_columns(property_type).where(getattr(model, id_column).in_(property_ids)))
+    connection.execute(insert(listings), [_listing_values(property_type, row) for row in rows])
+    index_properties(connection, property_type, property_ids)
+    index_locations(connection, property_type, property_ids)
+    for handler in _bulk_insert_handlers:
+        handler(session, property_type, property_ids)
+
+
+def rebuild_listings(batch_size=1000):
+    """
+    Rebuilds the listings table and its full-text index from the Residence, Commercial
+    and Land tables in a single transaction, streaming the source rows in batches.
+    Returns the number of listings written.
+    """
+
+    total = 0
+    with db.engine.begin() as connection:
+        connection.execute(delete(listings))
+        for property_type in PROPERTY_MODELS:
+            result = connection.execution_options(yield_per=batch_size).execute(
+                _property_columns(property_type))
+            for rows in result.partitions():
+                connection.execute(insert(listings), [_listing_values(property_type, row) for row in rows])
+                total += len(rows)
+        rebuild_text_index(connection)
+    return total
+
+
+def filter_listings(query, filters):
+    """Applies the search filters of the property endpoints to a Listing query."""
+
+    if filters['property_type']:
+        query = query.filter(Listing.property_type == filters['property_type'])
+    if filters['ad_action']:
+        query = query.filter(Listing.ad_action == filters['ad_action'].upper())
+    if filters['city']:
+        query = query.filter(Listing.city_normalized == normalize_location(filters['city']))
+    if filters['state']:
+        query = query.filter(Listing.state_normalized == normalize_location(filters['state']))
+    if filters['min_price'] is not None:
+        query = query.filter(Listing.price >= filters['min_price'])
+    if filters['max_price'] is not None:
+        query = query.filter(Listing.price <= filters['max_price'])
+
+    # Surface area filters only apply to residences and commercial properties
+    if filters['min_surface_area'] is not None:
+        query = query.filter(or_(Listing.property_type == 'land',
+                                 Listing.surface_area >= filters['min_surface_area']))
+    if filters['max_surface_area'] is not None:
+        query = query.filter(or_(Listing.property_type == 'land',
+                                 Listing.surface_area <= filters['max_surface_area']))
+    if filters['min_land_area'] is not None:
+        query = query.filter(Listing.land_area >= filters['min_land_area'])
+    if filters['max_land_area'] is not None:
+        query = query.filter(Listing.land_area <= filters['max_land_area'])
+
+    if filters['features']:
+        query = query.filter(has_all_features(filters['features']))
+
+    if filters['q']:
+        query = text_match(query, filters['q'])
+
+    if filters['search_box']:
+        query = filter_by_location(query, filters['search_box'], filters['bbox'],
+                                   filters['origin'], filters['radius_km'])
+    return query
+
+
+def explain_query_plan(query):
+    """Returns the detail lines of the SQLite query plan of a query."""
+    statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    rows = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}")
+    return [row[-1] for row in rows]
@@ -0,0 +1,50 @@
+"""added R*Tree spatial index over property coordinates
+
+Revision ID: 3b9e0f5c7a21
+Revises: df211f46a369
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e0f5c7a21'
+down_revision = 'df211f46a369'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The R*Tree virtual table is SQLite specific; other databases filter on the columns
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    # The id encodes (property_type, property_id) as property_id * 4 + type code
+    op.execute("""
+        CREATE VIRTUAL TABLE property_geo_index USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon,
+            +property_type TEXT, +property_id INTEGER
+        )
+    """)
+
+    # Backfill the index from the existing listings
+    for table, id_column, type_name, type_code in (('residences', 'residence_id', 'residence', 1),
+                                                   ('commercials', 'commercial_id', 'commercial', 2),
+                                                   ('land', 'land_id', 'land', 3)):
+        op.execute(f"""
+            INSERT INTO property_geo_index
+                (id, min_lat, max_lat, min_lon, max_lon, property_type, property_id)
+            SELECT {id_column} * 4 + {type_code}, latitude, latitude, longitude, longitude,
+                   '{type_name}', {id_column}
+            FROM {table}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TABLE IF EXISTS property_geo_index")
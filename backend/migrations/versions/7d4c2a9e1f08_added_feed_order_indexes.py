@@ -0,0 +1,38 @@
+"""added (ad_creation_date, id) indexes for the property feed
+
+Revision ID: 7d4c2a9e1f08
+Revises: 3b9e0f5c7a21
+Create Date: 2026-10-18 13:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4c2a9e1f08'
+down_revision = '3b9e0f5c7a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('residences', schema=None) as batch_op:
+        batch_op.create_index('ix_residences_ad_creation_date', ['ad_creation_date', 'residence_id'], unique=False)
+
+    with op.batch_alter_table('commercials', schema=None) as batch_op:
+        batch_op.create_index('ix_commercials_ad_creation_date', ['ad_creation_date', 'commercial_id'], unique=False)
+
+    with op.batch_alter_table('land', schema=None) as batch_op:
+        batch_op.create_index('ix_land_ad_creation_date', ['ad_creation_date', 'land_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('land', schema=None) as batch_op:
+        batch_op.drop_index('ix_land_ad_creation_date')
+
+    with op.batch_alter_table('commercials', schema=None) as batch_op:
+        batch_op.drop_index('ix_commercials_ad_creation_date')
+
+    with op.batch_alter_table('residences', schema=None) as batch_op:
+        batch_op.drop_index('ix_residences_ad_creation_date')
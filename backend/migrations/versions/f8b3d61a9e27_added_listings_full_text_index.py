@@ -0,0 +1,49 @@
+"""added FTS5 full-text index over listing titles and descriptions
+
+Revision ID: f8b3d61a9e27
+Revises: e2a7c90d4b16
+Create Date: 2026-10-18 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8b3d61a9e27'
+down_revision = 'e2a7c90d4b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is SQLite specific; other databases fall back to matching the titles
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    # The rowid of each entry is the listing_id of the listing
+    op.execute("""
+        CREATE VIRTUAL TABLE listings_fts USING fts5(
+            ad_title, ad_description,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+
+    # Backfill the index from the existing listings
+    for property_type, table, id_column in (('residence', 'residences', 'residence_id'),
+                                            ('commercial', 'commercials', 'commercial_id'),
+                                            ('land', 'land', 'land_id')):
+        op.execute(f"""
+            INSERT INTO listings_fts (rowid, ad_title, ad_description)
+            SELECT listings.listing_id, {table}.ad_title, {table}.ad_description
+            FROM listings JOIN {table} ON {table}.{id_column} = listings.property_id
+            WHERE listings.property_type = '{property_type}'
+        """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TABLE IF EXISTS listings_fts")
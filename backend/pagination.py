@@ -0,0 +1,37 @@
+import base64
+from data_models import Listing
+import datetime
+import json
+from sqlalchemy import desc, tuple_
+
+
+# Newest-first order of the property feed; ties are broken by type and id so that it is total
+FEED_ORDER = (desc(Listing.ad_creation_date), desc(Listing.property_type), desc(Listing.property_id))
+
+
+def encode_cursor(ad_creation_date, property_type, property_id):
+    """Builds the opaque token pointing right after the given listing in the feed."""
+    position = [ad_creation_date.isoformat(), property_type, property_id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decodes a cursor token into an (ad_creation_date, property_type, property_id)
+    tuple. Raises ValueError if the token was not produced by encode_cursor.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        date, property_type, property_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.date.fromisoformat(date), str(property_type), int(property_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+
+def seek_condition(position):
+    """
+    Condition selecting the listings that come after the cursor position in the feed
+    order. The row-value comparison maps onto a range of the feed order index.
+    """
+    return (tuple_(Listing.ad_creation_date, Listing.property_type, Listing.property_id)
+            < tuple_(*position))
@@ -0,0 +1,135 @@
+from data_models import Listing, db
+import datetime
+from listings import normalize_location
+import math
+from sqlalchemy import case, select
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Without NumPy the statistics are computed in plain Python
+    np = None
+
+
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BINS = 10
+
+# Area used for the price per square meter: the land area for land, the surface area otherwise
+PRICED_AREA = case((Listing.property_type == 'land', Listing.land_area), else_=Listing.surface_area)
+
+
+def _percentile(sorted_values, percent):
+    """Percentile with linear interpolation between the closest ranks (NumPy's default)."""
+    position = (len(sorted_values) - 1) * percent / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(values):
+    """Returns the count, min, max, mean, median and percentiles of a sequence of numbers."""
+    count = len(values)
+    if not count:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'median': None, 'percentiles': {}}
+
+    if np is not None:
+        points = np.percentile(values, PERCENTILES)
+        low, high, mean = values.min(), values.max(), values.mean()
+    else:
+        values = sorted(values)
+        points = [_percentile(values, percent) for percent in PERCENTILES]
+        low, high, mean = values[0], values[-1], sum(values) / count
+
+    percentiles = {str(percent): round(float(point), 2) for percent, point in zip(PERCENTILES, points)}
+    return {'count': count, 'min': round(float(low), 2), 'max': round(float(high), 2),
+            'mean': round(float(mean), 2), 'median': percentiles['50'], 'percentiles': percentiles}
+
+
+def histogram(values, bins=HISTOGRAM_BINS):
+    """Splits the range of the values in equal-width bins and counts the values of each one."""
+    if not len(values):
+        return {'bin_edges': [], 'counts': []}
+
+    if np is not None:
+        counts, edges = np.histogram(values, bins=bins)
+        return {'bin_edges': [round(float(edge), 2) for edge in edges], 'counts': counts.tolist()}
+
+    low, high = min(values), max(values)
+    if low == high:  # Same fallback range as NumPy
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return {'bin_edges': [round(low + width * index, 2) for index in range(bins + 1)], 'counts': counts}
+
+
+class PriceStatsSnapshot:
+    """
+    Prices and areas of all the listings, reloaded from the database every max_age
+    seconds. The statistics of each (property type, city, ad action) combination are
+    computed once per load and cached until the next one.
+    """
+
+    def __init__(self, max_age=600):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._stats = {}
+
+    def load(self):
+        """Reloads the prices and areas from the listings table and drops the cached statistics."""
+        rows = db.session.execute(select(Listing.property_type, Listing.city_normalized,
+                                         Listing.ad_action, Listing.price, PRICED_AREA)).all()
+        types, cities, actions, prices, areas = zip(*rows) if rows else ((), (), (), (), ())
+        if np is not None:
+            columns = (np.array(types, dtype=object), np.array(cities, dtype=object),
+                       np.array(actions, dtype=object), np.array(prices, dtype='float64'),
+                       np.array(areas, dtype='float64'))  # Missing areas become NaN
+        else:
+            columns = (types, cities, actions, prices, areas)
+
+        with self._lock:
+            self._columns = columns
+            self._stats = {}
+            self._loaded_at = time.monotonic()
+            self.refreshed_at = datetime.datetime.now(datetime.timezone.utc)
+
+    def get(self, property_type=None, city=None, ad_action=None):
+        """Returns the price statistics of the listings matching the given type, city and action."""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.load()
+
+        key = (property_type, normalize_location(city) or None, ad_action.upper() if ad_action else None)
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = self._compute(*key)
+            return self._stats[key]
+
+    def _compute(self, property_type, city, ad_action):
+        types, cities, actions, prices, areas = self._columns
+
+        if np is not None:
+            mask = np.ones(len(prices), dtype=bool)
+            for column, value in ((types, property_type), (cities, city), (actions, ad_action)):
+                if value:
+                    mask &= column == value
+            prices, areas = prices[mask], areas[mask]
+            priced = areas > 0  # NaN areas compare as False
+            price_per_m2 = prices[priced] / areas[priced]
+        else:
+            selected = [(price, area) for price, area, *values in zip(prices, areas, types, cities, actions)
+                        if all(not wanted or value == wanted
+                               for value, wanted in zip(values, (property_type, city, ad_action)))]
+            prices = [price for price, _ in selected]
+            price_per_m2 = [price / area for price, area in selected if area]
+
+        return {
+            'property_type': property_type,
+            'city': city,
+            'ad_action': ad_action,
+            'price': summarize(prices),
+            'price_per_m2': summarize(price_per_m2),
+            'histogram': histogram(prices),
+            'refreshed_at': self.refreshed_at.isoformat(),
+        }
@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from data_models import Image, ImageVariant, Listing, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS, property_key
+import json
+from listings import listen_bulk_insert, normalize_location
+import sqlite3
+import threading
+import time
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+
+ANY_CITY = '*'
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache. Every worker process has its own copy."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, tags)
+        self._keys_by_tag = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)  # Mark as most recently used
+            return entry[0]
+
+    def set(self, key, value, tags):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            # Evict the least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set().union(*(self._keys_by_tag.get(tag, ()) for tag in tags))
+            for key in keys:
+                self._discard(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+class SQLiteCacheBackend:
+    """
+    LRU cache stored in a local SQLite file, so that several worker processes share
+    the same entries and invalidations. Stands in for a networked cache server.
+    """
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_entries ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_last_used "
+                               "ON cache_entries (last_used)")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_tags ("
+                               "tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+
+    def set(self, key, value, tags):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO cache_entries (key, value, last_used) VALUES (?, ?, ?)",
+                               (key, json.dumps(value), time.time()))
+            connection.executemany("INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                                   [(tag, key) for tag in tags])
+            # Evict the least recently used entries
+            connection.execute("DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries "
+                               "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            connection.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)")
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        placeholders = ', '.join('?' * len(tags))
+        with self._connect() as connection:
+            keys = f"SELECT key FROM cache_tags WHERE tag IN ({placeholders})"
+            removed = connection.execute(f"DELETE FROM cache_entries WHERE key IN ({keys})", tags).rowcount
+            connection.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)")
+            return removed
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache_entries")
+            connection.execute("DELETE FROM cache_tags")
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+
+def create_backend(url, max_entries=1024):
+    """Creates the cache backend described by a URL: 'memory' or 'sqlite:///path/to/cache.sqlite'."""
+    if not url or url == 'memory':
+        return MemoryCacheBackend(max_entries)
+    if url.startswith('sqlite:///'):
+        return SQLiteCacheBackend(url[len('sqlite:///'):], max_entries)
+    raise ValueError(f"Unsupported property cache backend: {url}")
+
+
+class PropertyQueryCache:
+    """
+    Caches property search responses and counts hits, misses and invalidations.
+
+    Committed writes invalidate the entries of the process that made them (and of every
+    process sharing an SQLite backend). Responses are also served for at most ttl
+    seconds (None keeps them until invalidated), which bounds how long other worker
+    processes with their own memory backend serve a response older than a write.
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Bumped by every invalidation, so that a response computed while a write
+        # was being committed is not stored
+        self.generation = 0
+
+    def get(self, key):
+        entry = self.backend.get(key)  # [expiry time or None, response]
+        if not isinstance(entry, list):  # Missing, or stored without an expiry time by an older version
+            entry = None
+        elif entry[0] is not None and entry[0] <= time.time():
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, tags, generation):
+        """Stores a response computed when the cache was at the given generation."""
+        if generation == self.generation:
+            expires_at = time.time() + self.ttl if self.ttl is not None else None
+            self.backend.set(key, [expires_at, value], tags)
+
+    def invalidate(self, tags):
+        if tags:
+            self.generation += 1
+            self.invalidations += self.backend.invalidate(tags)
+
+    def clear(self):
+        self.generation += 1
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'expired_entries': self.expirations,
+            'invalidated_entries': self.invalidations,
+            'entries': len(self.backend),
+        }
+
+
+def cache_key(filters, **page_args):
+    """Builds the cache key of a property search from its normalized filters and page."""
+    normalized = {name: value for name, value in filters.items() if value not in (None, '', [])}
+    for name in ('city', 'state'):
+        if name in normalized:
+            normalized[name] = normalize_location(normalized[name])
+    if 'ad_action' in normalized:
+        normalized['ad_action'] = normalized['ad_action'].upper()
+    if 'features' in normalized:
+        normalized['features'] = sorted({name.strip().lower() for name in normalized['features']})
+    return json.dumps([normalized, page_args], sort_keys=True, default=str)
+
+
+def cache_tags(filters):
+    """
+    Lists the (property type, city) combinations a search depends on. A write to a
+    listing only invalidates the cached searches sharing its type and city, plus the
+    searches of its type that don't filter on a city.
+    """
+    property_types = [filters['property_type']] if filters['property_type'] else list(PROPERTY_MODELS)
+    city = normalize_location(filters['city']) if filters['city'] else ANY_CITY
+    return [f"{property_type}:{city}" for property_type in property_types]
+
+
+def _write_tags(property_type, cities):
+    """Tags to invalidate after a write to a listing of the given type and cities."""
+    return {f"{property_type}:{city}" for city in cities} | {f"{property_type}:{ANY_CITY}"}
+
+
+def _pending_tags(target):
+    """Returns the set collecting the tags to invalidate once the session commits."""
+    return object_session(target).info.setdefault('property_cache_tags', set())
+
+
+def _listing_city(connection, property_type, property_id):
+    return connection.execute(
+        select(Listing.city_normalized)
+        .where(Listing.property_type == property_type, Listing.property_id == property_id)).scalar()
+
+
+def _property_written(mapper, connection, target):
+    """Queues the invalidation of the searches showing a property, before and after the write."""
+    property_type, _ = property_key(target)
+    # The city history holds the previous city when it was changed
+    history = inspect(target).attrs.city.history
+    cities = [normalize_location(city) for city in
+              [*history.added, *history.unchanged, *history.deleted] if city]
+    _pending_tags(target).update(_write_tags(property_type, cities))
+
+
+def _related_row_written(property_type, id_column):
+    """Builds the handler queuing the invalidation for a written image or feature link."""
+
+    def handler(mapper, connection, target):
+        property_id = getattr(target, id_column)
+        if property_id is None:
+            return
+        city = _listing_city(connection, property_type, property_id)
+        _pending_tags(target).update(_write_tags(property_type, [city] if city else []))
+
+    return handler
+
+
+def _variant_written(mapper, connection, target):
+    """Queues the invalidation of the searches showing the images of a blob whose variant was written."""
+    tags = _pending_tags(target)
+    for property_type, (_, id_column) in PROPERTY_MODELS.items():
+        cities = connection.execute(
+            select(Listing.city_normalized).distinct()
+            .join(Image, getattr(Image, id_column) == Listing.property_id)
+            .where(Listing.property_type == property_type, Image.blob_sha256 == target.blob_sha256)).scalars().all()
+        if cities:
+            tags.update(_write_tags(property_type, cities))
+
+
+def _properties_inserted(session, property_type, property_ids):
+    """Queues the invalidation of the searches showing properties inserted in bulk."""
+    cities = session.execute(
+        select(Listing.city_normalized).distinct()
+        .where(Listing.property_type == property_type, Listing.property_id.in_(property_ids))).scalars()
+    session.info.setdefault('property_cache_tags', set()).update(_write_tags(property_type, cities))
+
+
+def register_invalidation(cache):
+    """Invalidates the cached searches touched by the property writes of each committed session."""
+
+    for property_model, _ in PROPERTY_MODELS.values():
+        for operation in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(property_model, operation, _property_written)
+
+    for property_type, (_, id_column) in PROPERTY_MODELS.items():
+        for related_model in (PROPERTY_FEATURE_MODELS[property_type], Image):
+            handler = _related_row_written(property_type, id_column)
+            for operation in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(related_model, operation, handler)
+    # The thumbnails of the cached cards change once the variants of their image are rendered
+    event.listen(ImageVariant, 'after_insert', _variant_written)
+    listen_bulk_insert(_properties_inserted)
+
+    # Invalidate only once the changes are visible to other requests
+    @event.listens_for(Session, 'after_commit')
+    def invalidate_committed(session):
+        cache.invalidate(session.info.pop('property_cache_tags', set()))
+
+    @event.listens_for(Session, 'after_soft_rollback')
+    def discard_rolled_back(session, previous_transaction):
+        session.info.pop('property_cache_tags', None)
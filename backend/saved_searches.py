@@ -0,0 +1,225 @@
+from bisect import bisect_right
+from data_models import (Feature, Listing, Notification, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS, SavedSearch, db)
+from fulltext import matching_texts
+from geo_index import squared_distance_km
+from itertools import product
+import json
+from listings import normalize_location
+import math
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+import threading
+
+
+def search_key(filters):
+    """
+    Returns the (property_type, ad_action, city, state) key of a saved search in the
+    inverted index, None standing for a filter the search doesn't set.
+    """
+    return (filters['property_type'] or None,
+            filters['ad_action'].upper() if filters['ad_action'] else None,
+            normalize_location(filters['city']) or None,
+            normalize_location(filters['state']) or None)
+
+
+def listing_keys(listing):
+    """Lists the 16 index keys a listing can be matched under: each field is either its value or unset."""
+    return product((listing.property_type, None), (listing.ad_action, None),
+                   (listing.city_normalized, None), (listing.state_normalized, None))
+
+
+def _in_box(latitude, longitude, box):
+    """Tells whether a point is inside a (south, west, north, east) box, which may cross the antimeridian."""
+    south, west, north, east = box
+    if not south <= latitude <= north:
+        return False
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
+
+
+def _in_range(value, low, high):
+    """Tells whether a value is within optional bounds. A missing value fails any bound, like NULL in SQL."""
+    if low is None and high is None:
+        return True
+    return value is not None and (low is None or value >= low) and (high is None or value <= high)
+
+
+def listing_matches(filters, listing, feature_names):
+    """
+    Checks the range, feature and location filters of a search, as loaded by the index
+    (with a set of normalized feature names), against a listing row, the same way
+    filter_listings does in SQL. The type, action, city and state are matched by the
+    index, and the keywords separately.
+    """
+
+    if not _in_range(listing.price, None, filters['max_price']):
+        return False
+    # Surface area filters only apply to residences and commercial properties
+    if listing.property_type != 'land' and not _in_range(
+            listing.surface_area, filters['min_surface_area'], filters['max_surface_area']):
+        return False
+    if not _in_range(listing.land_area, filters['min_land_area'], filters['max_land_area']):
+        return False
+
+    if filters['features'] and not filters['features'] <= feature_names:
+        return False
+
+    if filters['search_box']:
+        if listing.latitude is None or listing.longitude is None:
+            return False
+        for box in (filters['search_box'], filters['bbox']):
+            if box is not None and not _in_box(listing.latitude, listing.longitude, box):
+                return False
+        if filters['radius_km'] is not None and squared_distance_km(
+                listing.latitude, listing.longitude, *filters['origin']) > filters['radius_km'] ** 2:
+            return False
+    return True
+
+
+class _IndexedSearch:
+    """Saved search held in the index."""
+    __slots__ = ('saved_search_id', 'customer_id', 'name', 'filters')
+
+    def __init__(self, saved_search_id, customer_id, name, filters):
+        self.saved_search_id, self.customer_id = saved_search_id, customer_id
+        self.name, self.filters = name, filters
+
+
+class _Bucket:
+    """Saved searches sharing an index key, sorted by minimum price."""
+    __slots__ = ('min_prices', 'searches')
+
+    def __init__(self):
+        self.min_prices, self.searches = [], []
+
+    def add(self, search):
+        min_price = search.filters['min_price']
+        min_price = -math.inf if min_price is None else min_price
+        position = bisect_right(self.min_prices, min_price)
+        self.min_prices.insert(position, min_price)
+        self.searches.insert(position, search)
+
+    def remove(self, saved_search_id):
+        for position, search in enumerate(self.searches):
+            if search.saved_search_id == saved_search_id:
+                del self.min_prices[position], self.searches[position]
+                return
+
+    def candidates(self, price):
+        """Searches of the bucket whose minimum price is at most the given price."""
+        return self.searches[:bisect_right(self.min_prices, price)]
+
+
+class SavedSearchIndex:
+    """
+    Inverted index of the saved searches, finding the ones a new listing matches
+    without checking every search.
+
+    Searches are bucketed by their (type, action, city, state) filters, unset ones
+    included, so a listing only looks up its 16 possible keys. Each bucket is sorted
+    by minimum price, which skips the searches priced above the listing; the other
+    filters are then checked on the remaining candidates.
+
+    The index is loaded lazily and caught up with the saved_searches table before
+    each lookup: new searches are loaded incrementally, and a full reload happens
+    when searches were deleted by another worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._keys = {}  # saved_search_id -> index key
+        self._max_id = None
+
+    def _add(self, row):
+        filters = json.loads(row.filters)
+        for name in ('search_box', 'bbox', 'origin'):
+            if filters[name] is not None:
+                filters[name] = tuple(filters[name])
+        filters['features'] = frozenset(name.strip().lower() for name in filters['features'] if name.strip())
+        key = search_key(filters)
+        self._buckets.setdefault(key, _Bucket()).add(
+            _IndexedSearch(row.saved_search_id, row.customer_id, row.name, filters))
+        self._keys[row.saved_search_id] = key
+        self._max_id = max(self._max_id or 0, row.saved_search_id)
+
+    def _load(self, after_id=None):
+        """Loads the saved searches, or only the ones past an id."""
+        query = select(SavedSearch.saved_search_id, SavedSearch.customer_id, SavedSearch.name, SavedSearch.filters)
+        if after_id is not None:
+            query = query.where(SavedSearch.saved_search_id > after_id)
+        else:
+            self._buckets, self._keys, self._max_id = {}, {}, 0
+        for row in db.session.execute(query):
+            self._add(row)
+
+    def _catch_up(self):
+        max_id, count = db.session.execute(
+            select(func.coalesce(func.max(SavedSearch.saved_search_id), 0), func.count())).one()
+        if self._max_id is None or max_id < self._max_id:
+            self._load()
+            return
+        if max_id > self._max_id:
+            self._load(self._max_id)
+        if count != len(self._keys):  # Searches were deleted outside of this process
+            self._load()
+
+    def remove(self, saved_search_id):
+        """Removes a deleted saved search from the index."""
+        with self._lock:
+            key = self._keys.pop(saved_search_id, None)
+            if key is not None:
+                self._buckets[key].remove(saved_search_id)
+
+    def match(self, listing, feature_names):
+        """Returns the saved searches matching a listing row, given the names of its features."""
+        with self._lock:
+            self._catch_up()
+            candidates = [search for key in listing_keys(listing) if key in self._buckets
+                          for search in self._buckets[key].candidates(listing.price)]
+            matches = [search for search in candidates if listing_matches(search.filters, listing, feature_names)]
+
+        # Keywords are matched by the full-text index, only for the searches passing the other filters
+        texts = matching_texts(db.session, listing.listing_id,
+                               [search.filters['q'] for search in matches if search.filters['q']])
+        return [search for search in matches if not search.filters['q'] or search.filters['q'] in texts]
+
+    def notify(self, property_type, property_id):
+        """
+        Notifies the customers whose saved searches match a new property, with one
+        notification per customer, inserted in bulk. Returns the number of notifications.
+        """
+
+        listing = Listing.query.filter_by(property_type=property_type, property_id=property_id).first()
+        if listing is None:
+            return 0
+
+        try:
+            searches = self.match(listing, listing_feature_names(property_type, property_id))
+            names_by_customer = {}
+            for search in searches:
+                names_by_customer.setdefault(search.customer_id, []).append(search.name)
+            if names_by_customer:
+                db.session.execute(insert(Notification), [
+                    {'customer_id': customer_id, 'is_read': False,
+                     'message': f"New {property_type} matching your saved search "
+                                f"{', '.join(repr(name) for name in names)}: {listing.ad_title} "
+                                f"in {' '.join(listing.city.split())} for {listing.price}."}
+                    for customer_id, names in names_by_customer.items()])
+                db.session.commit()
+            return len(names_by_customer)
+        except SQLAlchemyError as e:
+            # The property is already saved: a failed notification must not fail its creation
+            db.session.rollback()
+            print(f"Error while notifying the saved searches of {property_type} {property_id}: {e}")
+            return 0
+
+
+def listing_feature_names(property_type, property_id):
+    """Returns the set of the feature names of a property."""
+    link_model = PROPERTY_FEATURE_MODELS[property_type]
+    link_column = getattr(link_model, PROPERTY_MODELS[property_type][1])
+    return {name for (name,) in db.session.query(Feature.name)
+            .join(link_model, link_model.feature_id == Feature.feature_id)
+            .filter(link_column == property_id)}
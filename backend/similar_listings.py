@@ -0,0 +1,229 @@
+from data_models import Listing, PROPERTY_MODELS, db, property_key
+from db_constraints import ActionEnum
+from geo_index import EARTH_RADIUS_KM
+from listings import listen_bulk_insert
+import math
+from sqlalchemy import column, delete, event, func, literal, select, table, text
+
+
+# Name of the SQLite R*Tree virtual table holding the similarity vector of each located
+# listing. Its id is the listing_id of the listing.
+VECTOR_INDEX_TABLE = 'listing_vector_index'
+
+# Differences counted as one unit of distance in each dimension of the vectors
+GEO_SCALE_KM = 5.0
+PRICE_SCALE = math.log(1.5)  # A price 50% higher or lower
+AREA_SCALE = math.log(1.5)
+ROOMS_SCALE = 1.0
+FEATURE_WEIGHT = 1.0  # Weight of the Jaccard distance between the feature sets (0 to 1)
+
+# Listings are only compared within the same type and ad action. Each (type, action)
+# pair gets its own range of the price dimension, far enough apart to never overlap.
+PARTITIONS = {key: index for index, key in
+              enumerate((property_type, action.name) for property_type in sorted(PROPERTY_MODELS)
+                        for action in ActionEnum)}
+PARTITION_SPAN = 1000.0
+MISSING = -PARTITION_SPAN / 2  # Coordinate of a missing price or area
+
+# Half-sides of the successive cubes searched around a vector, until one holds enough listings
+SEARCH_RADII = (0.125, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+SHORTLIST_SIZE = 50  # Closest listings by location, price, area and rooms, re-ranked with the features
+
+DIMENSIONS = ('x', 'y', 'z', 'price', 'area')
+
+listing_vector_index = table(VECTOR_INDEX_TABLE, column('id'), column('rooms_count'),
+                             *(column(f'{bound}_{name}') for name in DIMENSIONS for bound in ('min', 'max')))
+
+VECTOR_COLUMNS = (Listing.listing_id, Listing.property_type, Listing.ad_action, Listing.latitude,
+                  Listing.longitude, Listing.log_price, Listing.log_area, Listing.rooms_count)
+
+
+def listing_vector(listing):
+    """
+    Returns the similarity vector of a listing row, or None if it has no location.
+    The location is a point on a sphere the size of the Earth (so that the distance
+    between two vectors is the straight-line distance between the listings), then come
+    the log-scaled price and area. Each dimension is divided by its scale.
+    """
+    if listing.latitude is None or listing.longitude is None:
+        return None
+
+    phi, lam = math.radians(listing.latitude), math.radians(listing.longitude)
+    radius = EARTH_RADIUS_KM / GEO_SCALE_KM
+    offset = PARTITIONS[(listing.property_type, listing.ad_action)] * PARTITION_SPAN
+    return (radius * math.cos(phi) * math.cos(lam),
+            radius * math.cos(phi) * math.sin(lam),
+            radius * math.sin(phi),
+            offset + (listing.log_price / PRICE_SCALE if listing.log_price is not None else MISSING),
+            listing.log_area / AREA_SCALE if listing.log_area is not None else MISSING)
+
+
+def _feature_distance(mask, other_mask):
+    """Jaccard distance between two feature masks: 0 for the same features, 1 for none in common."""
+    union = (mask | other_mask).bit_count()
+    return 1 - (mask & other_mask).bit_count() / union if union else 0.0
+
+
+def _rooms_term(rooms_column, rooms_count):
+    """Squared scaled rooms difference; a missing number of rooms on the candidate costs one unit."""
+    if rooms_count is None:
+        return literal(0.0)
+    difference = (rooms_column - rooms_count) / ROOMS_SCALE
+    return func.coalesce(difference * difference, 1.0)
+
+
+# Vectors of the index within a cube around a vector, closest first, with their squared
+# distance to it (rooms included). Written as text since it runs several times per lookup
+# and building the expression with SQLAlchemy costs more than running it.
+_distance = ' + '.join(f"((min_{name} + max_{name}) / 2 - :{name}) * ((min_{name} + max_{name}) / 2 - :{name})"
+                       for name in DIMENSIONS)
+_rooms = (f"CASE WHEN :rooms_count IS NULL THEN 0.0 ELSE "
+          f"coalesce((rooms_count - :rooms_count) * (rooms_count - :rooms_count) / {ROOMS_SCALE ** 2}, 1.0) END")
+_cube = ' AND '.join(f"max_{name} >= :{name} - :radius AND min_{name} <= :{name} + :radius" for name in DIMENSIONS)
+VECTOR_SHORTLIST_QUERY = text(f"SELECT id, {_distance} + {_rooms} AS score FROM {VECTOR_INDEX_TABLE} "
+                              f"WHERE {_cube} AND id != :id ORDER BY score LIMIT {SHORTLIST_SIZE}")
+
+_INSERT_VECTOR = text(
+    f"INSERT OR REPLACE INTO {VECTOR_INDEX_TABLE} (id, rooms_count, "
+    + ', '.join(f"min_{name}, max_{name}" for name in DIMENSIONS)
+    + ") VALUES (:id, :rooms_count, " + ', '.join(f":{name}, :{name}" for name in DIMENSIONS) + ")")
+
+
+def find_similar(listing, limit=10):
+    """
+    Returns the (property_type, property_id) keys of the listings most similar to a
+    listing, closest first. Only listings of the same type and ad action are compared.
+
+    The vector index is searched with growing cubes around the vector of the listing,
+    until one holds enough listings closer than its half-side. This shortlist, ranked
+    by vector distance and rooms, is then re-ranked with the feature overlap.
+    """
+
+    vector = listing_vector(listing)
+    if vector is None or db.session.get_bind().dialect.name != 'sqlite':
+        shortlist = _same_city_shortlist(listing)
+    else:
+        shortlist = _vector_shortlist(listing, vector, limit)
+
+    ranked = sorted(shortlist, key=lambda row: row.score + FEATURE_WEIGHT * _feature_distance(
+        listing.feature_mask, row.feature_mask))
+    return [(row.property_type, row.property_id) for row in ranked[:limit]]
+
+
+def _vector_shortlist(listing, vector, limit):
+    """Closest listings in the vector index, with their property key, feature mask and score."""
+    params = _vector_params(listing, vector)
+    for radius in SEARCH_RADII:
+        candidates = db.session.execute(VECTOR_SHORTLIST_QUERY, {**params, 'radius': radius}).all()
+        # Listings outside the cube are farther than its half-side
+        if sum(1 for candidate in candidates if candidate.score <= radius * radius) >= limit:
+            break
+
+    scores = dict(candidates)
+    rows = (db.session.query(Listing.listing_id, Listing.property_type, Listing.property_id, Listing.feature_mask)
+            .filter(Listing.listing_id.in_(scores)))
+    return [_Candidate(row.property_type, row.property_id, row.feature_mask, scores[row.listing_id])
+            for row in rows]
+
+
+def _same_city_shortlist(listing):
+    """Without a location, the listings of the same city are compared on price, area and rooms."""
+    score = _rooms_term(Listing.rooms_count, listing.rooms_count)
+    for column_, value, scale in ((Listing.log_price, listing.log_price, PRICE_SCALE),
+                                  (Listing.log_area, listing.log_area, AREA_SCALE)):
+        if value is not None:
+            difference = (column_ - value) / scale
+            score = score + func.coalesce(difference * difference, 1.0)
+
+    return (db.session.query(Listing.property_type, Listing.property_id, Listing.feature_mask, score.label('score'))
+            .filter(Listing.city_normalized == listing.city_normalized,
+                    Listing.ad_action == listing.ad_action,
+                    Listing.property_type == listing.property_type,
+                    Listing.listing_id != listing.listing_id)
+            .order_by(score)
+            .limit(SHORTLIST_SIZE)
+            .all())
+
+
+class _Candidate:
+    """Shortlisted listing of the vector search."""
+    __slots__ = ('property_type', 'property_id', 'feature_mask', 'score')
+
+    def __init__(self, property_type, property_id, feature_mask, score):
+        self.property_type, self.property_id = property_type, property_id
+        self.feature_mask, self.score = feature_mask, score
+
+
+def _vector_params(listing, vector):
+    return {'id': listing.listing_id, 'rooms_count': listing.rooms_count, **dict(zip(DIMENSIONS, vector))}
+
+
+def index_vector(connection, listing):
+    """Inserts, moves or removes the vector of a listing row in the vector index."""
+    vector = listing_vector(listing)
+    if vector is None:
+        connection.execute(delete(listing_vector_index).where(listing_vector_index.c.id == listing.listing_id))
+    else:
+        connection.execute(_INSERT_VECTOR, _vector_params(listing, vector))
+
+
+def _sync_vector(mapper, connection, target):
+    """Indexes the vector of a property's listing after the property is written."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    property_type, property_id = property_key(target)
+    listing = connection.execute(
+        select(*VECTOR_COLUMNS)
+        .where(Listing.property_type == property_type, Listing.property_id == property_id)).one_or_none()
+    if listing is not None:
+        index_vector(connection, listing)
+
+
+def _remove_vector(mapper, connection, target):
+    """Removes the vector of a property's listing before the property (and its listing) is deleted."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    property_type, property_id = property_key(target)
+    listing_ids = select(Listing.listing_id).where(Listing.property_type == property_type,
+                                                   Listing.property_id == property_id)
+    connection.execute(delete(listing_vector_index).where(listing_vector_index.c.id.in_(listing_ids)))
+
+
+def _index_vectors(connection, listings):
+    """Indexes the vectors of listing rows in a single executemany."""
+    params = [_vector_params(listing, vector) for listing in listings
+              if (vector := listing_vector(listing)) is not None]
+    if params:
+        connection.execute(_INSERT_VECTOR, params)
+
+
+def _index_inserted(session, property_type, property_ids):
+    """Indexes the vectors of the listings of properties inserted in bulk."""
+    connection = session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+
+    _index_vectors(connection, connection.execute(
+        select(*VECTOR_COLUMNS).where(Listing.property_type == property_type, Listing.property_id.in_(property_ids))))
+
+
+# Keep the vector index in sync with the listings. The after_* handlers run after the
+# ones of listings.py, which is imported first, so the listing row is already written.
+for _model, _ in PROPERTY_MODELS.values():
+    event.listen(_model, 'after_insert', _sync_vector)
+    event.listen(_model, 'after_update', _sync_vector)
+    event.listen(_model, 'before_delete', _remove_vector)
+listen_bulk_insert(_index_inserted)
+
+
+def rebuild_vector_index(batch_size=1000):
+    """Rebuilds the vector index from the listings table."""
+    with db.engine.begin() as connection:
+        if connection.dialect.name != 'sqlite':
+            return
+        connection.execute(delete(listing_vector_index))
+        result = connection.execution_options(yield_per=batch_size).execute(select(*VECTOR_COLUMNS))
+        for listings in result.partitions():
+            _index_vectors(connection, listings)
@@ -0,0 +1,309 @@
+from data_models import Feature, Listing, PROPERTY_FEATURE_MODELS, PROPERTY_MODELS, db, property_key
+from feature_bits import feature_bit
+from geo_index import KM_PER_DEGREE_LAT
+from listings import listen_bulk_insert, normalize_location
+import math
+from sqlalchemy import event, select, tuple_
+from sqlalchemy.orm import Session, object_session
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # The snapshot engine is optional, searches then only use SQL
+    np = None
+
+
+# Type codes sorted like the type names, so that sorting on the codes gives the feed order
+TYPE_NAMES = sorted(PROPERTY_MODELS)
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+SNAPSHOT_COLUMNS = (Listing.property_type, Listing.property_id, Listing.ad_action, Listing.city_normalized,
+                    Listing.state_normalized, Listing.price, Listing.surface_area, Listing.land_area,
+                    Listing.latitude, Listing.longitude, Listing.ad_creation_date, Listing.feature_mask)
+
+# dtype of each array of the snapshot
+ARRAY_TYPES = {
+    'type': 'int8', 'id': 'int64', 'action': 'int32', 'city': 'int32', 'state': 'int32',
+    'price': 'float64', 'surface_area': 'float64', 'land_area': 'float64',
+    'latitude': 'float64', 'longitude': 'float64', 'date': 'int64', 'feature_mask': 'int64', 'alive': 'bool',
+}
+
+
+def _nullable(value):
+    """Missing numbers become NaN, which fails every comparison like NULL does in SQL."""
+    return math.nan if value is None else value
+
+
+class ListingSnapshot:
+    """
+    Column-per-field NumPy copy of the listings table, answering the numeric range
+    filters of the property search with vectorized boolean masks. Only the keys of
+    the requested page come out of it; the rows themselves are then read from SQL.
+
+    Committed property writes are applied to it incrementally (register_snapshot_updates),
+    and it is fully reloaded every max_age seconds to pick up the writes of other
+    worker processes.
+    """
+
+    def __init__(self, max_age=300):
+        if np is None:
+            raise RuntimeError("The snapshot search engine requires NumPy (pip install numpy).")
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+
+    @staticmethod
+    def _build(rows):
+        """Builds the arrays, dictionaries and positions of a set of listing rows, column by column."""
+        rows = rows.all()
+        (types, ids, actions, cities, states, prices, surface_areas, land_areas,
+         latitudes, longitudes, dates, feature_masks) = zip(*rows) if rows else ((),) * len(SNAPSHOT_COLUMNS)
+
+        codes = {'action': {}, 'city': {}, 'state': {}}
+
+        def encode(kind, values):
+            dictionary = codes[kind]
+            return [dictionary.setdefault(value, len(dictionary)) for value in values]
+
+        # NumPy turns the None of missing numbers into NaN for float arrays
+        values = {
+            'type': [TYPE_CODES[name] for name in types], 'id': ids,
+            'action': encode('action', actions), 'city': encode('city', cities), 'state': encode('state', states),
+            'price': prices, 'surface_area': surface_areas, 'land_area': land_areas,
+            'latitude': latitudes, 'longitude': longitudes,
+            'date': [date.toordinal() for date in dates], 'feature_mask': feature_masks,
+            'alive': [True] * len(rows),
+        }
+        return {
+            'codes': codes,
+            'positions': {key: position for position, key in enumerate(zip(types, ids))},
+            'arrays': {name: np.array(values[name], dtype=dtype) for name, dtype in ARRAY_TYPES.items()},
+            'size': len(rows),
+            'order': None,
+        }
+
+    @staticmethod
+    def _row_values(row, codes):
+        """Converts a listing row to the values of the snapshot arrays."""
+
+        def code(kind, value):
+            return codes[kind].setdefault(value, len(codes[kind]))
+
+        return {
+            'type': TYPE_CODES[row.property_type],
+            'id': row.property_id,
+            'action': code('action', row.ad_action),
+            'city': code('city', row.city_normalized),
+            'state': code('state', row.state_normalized),
+            'price': _nullable(row.price),
+            'surface_area': _nullable(row.surface_area),
+            'land_area': _nullable(row.land_area),
+            'latitude': _nullable(row.latitude),
+            'longitude': _nullable(row.longitude),
+            'date': row.ad_creation_date.toordinal(),
+            'feature_mask': row.feature_mask,
+            'alive': True,
+        }
+
+    def load(self):
+        """(Re)loads the whole snapshot from the listings table."""
+        with db.engine.connect() as connection:
+            state = self._build(connection.execute(select(*SNAPSHOT_COLUMNS)))
+        with self._lock:
+            self.codes, self.positions = state['codes'], state['positions']
+            self.arrays, self.size, self.order = state['arrays'], state['size'], state['order']
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.load()
+
+    def refresh(self, keys):
+        """Re-reads the listings of the given (property_type, property_id) keys from the database."""
+        if self._loaded_at is None or not keys:
+            return
+
+        with db.engine.connect() as connection:
+            rows = {(row.property_type, row.property_id): row for row in connection.execute(
+                select(*SNAPSHOT_COLUMNS)
+                .where(tuple_(Listing.property_type, Listing.property_id).in_(list(keys))))}
+
+        with self._lock:
+            for key in keys:
+                position = self.positions.get(key)
+                row = rows.get(key)
+                if row is None:
+                    if position is not None:
+                        self.arrays['alive'][position] = False
+                    continue
+                if position is None:
+                    position = self._append_position()
+                    self.positions[key] = position
+                for name, value in self._row_values(row, self.codes).items():
+                    self.arrays[name][position] = value
+            self.order = None  # Sort again on the next search
+
+    def _append_position(self):
+        """Returns a free position at the end of the arrays, doubling their capacity when full."""
+        if self.size == len(self.arrays['id']):
+            capacity = max(16, 2 * self.size)
+            for name, array in self.arrays.items():
+                grown = np.zeros(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = grown
+        self.size += 1
+        return self.size - 1
+
+    def _feed_order(self):
+        """Positions of all the rows in the feed order: newest first, then by type and id descending."""
+        if self.order is None:
+            arrays = {name: array[:self.size] for name, array in self.arrays.items()}
+            self.order = np.lexsort((-arrays['id'], -arrays['type'], -arrays['date']))
+        return self.order
+
+    def search(self, filters, page, per_page):
+        """
+        Returns the (property_type, property_id) keys of the requested page and the
+        total number of matches, or None if the filters need SQL (keyword search or
+        features past the feature mask).
+        """
+
+        if filters['q']:
+            return None
+        required_mask = 0
+        if filters['features']:
+            names = {name.strip().lower() for name in filters['features'] if name.strip()}
+            feature_ids = [feature_id for (feature_id,) in
+                           db.session.query(Feature.feature_id).filter(Feature.name.in_(names))]
+            if any(not feature_bit(feature_id) for feature_id in feature_ids):
+                return None
+            if len(feature_ids) < len(names):
+                return [], 0  # An unknown feature can't be matched by any listing
+            required_mask = sum(feature_bit(feature_id) for feature_id in feature_ids)
+
+        self._ensure_fresh()
+        with self._lock:
+            arrays = {name: array[:self.size] for name, array in self.arrays.items()}
+            mask = arrays['alive'].copy()
+
+            if filters['property_type']:
+                mask &= arrays['type'] == TYPE_CODES[filters['property_type']]
+            for kind, value in (('action', filters['ad_action'] and filters['ad_action'].upper()),
+                                ('city', filters['city'] and normalize_location(filters['city'])),
+                                ('state', filters['state'] and normalize_location(filters['state']))):
+                if value:
+                    mask &= arrays[kind] == self.codes[kind].get(value, -1)
+
+            if filters['min_price'] is not None:
+                mask &= arrays['price'] >= filters['min_price']
+            if filters['max_price'] is not None:
+                mask &= arrays['price'] <= filters['max_price']
+            # Surface area filters only apply to residences and commercial properties
+            is_land = arrays['type'] == TYPE_CODES['land']
+            if filters['min_surface_area'] is not None:
+                mask &= is_land | (arrays['surface_area'] >= filters['min_surface_area'])
+            if filters['max_surface_area'] is not None:
+                mask &= is_land | (arrays['surface_area'] <= filters['max_surface_area'])
+            if filters['min_land_area'] is not None:
+                mask &= arrays['land_area'] >= filters['min_land_area']
+            if filters['max_land_area'] is not None:
+                mask &= arrays['land_area'] <= filters['max_land_area']
+            if required_mask:
+                mask &= (arrays['feature_mask'] & required_mask) == required_mask
+
+            origin = filters['origin']
+            if filters['search_box']:
+                mask &= _in_box(arrays, filters['search_box'])
+                if filters['bbox'] is not None:
+                    mask &= _in_box(arrays, filters['bbox'])
+                if filters['radius_km'] is not None:
+                    mask &= _squared_distance_km(arrays, *origin) <= filters['radius_km'] ** 2
+
+            start = (page - 1) * per_page
+            if filters['sort'] == 'distance':
+                matches = np.flatnonzero(mask)
+                ranked = matches[np.argsort(_squared_distance_km(arrays, *origin)[matches], kind='stable')]
+            else:
+                order = self._feed_order()
+                ranked = order[mask[order]]
+            positions = ranked[start:start + per_page]
+            keys = [(TYPE_NAMES[arrays['type'][position]], int(arrays['id'][position])) for position in positions]
+            return keys, len(ranked)
+
+
+def _in_box(arrays, box):
+    """Boolean mask of the rows inside a (south, west, north, east) box, which may cross the antimeridian."""
+    south, west, north, east = box
+    latitude, longitude = arrays['latitude'], arrays['longitude']
+    inside = (latitude >= south) & (latitude <= north)
+    if west <= east:
+        return inside & (longitude >= west) & (longitude <= east)
+    return inside & ((longitude >= west) | (longitude <= east))
+
+
+def _squared_distance_km(arrays, lat, lon):
+    """Same equirectangular approximation as geo_index.squared_distance_km, over the arrays."""
+    d_lat = (arrays['latitude'] - lat) * KM_PER_DEGREE_LAT
+    d_lon = (arrays['longitude'] - lon) * KM_PER_DEGREE_LAT * math.cos(math.radians(lat))
+    return d_lat * d_lat + d_lon * d_lon
+
+
+def create_snapshot(engine_name, max_age=300):
+    """Creates the snapshot for the 'snapshot' search engine, or returns None to search with SQL."""
+    if engine_name != 'snapshot':
+        return None
+    if np is None:
+        print("NumPy is not installed, property searches use SQL.")
+        return None
+    return ListingSnapshot(max_age)
+
+
+def fetch_ranked_rows(columns, keys):
+    """Reads the given columns of the listings of a page, in the order of their keys."""
+    if not keys:
+        return []
+    rows = (db.session.query(*columns)
+            .filter(tuple_(Listing.property_type, Listing.property_id).in_(keys)))
+    rows_by_key = {(row.property_type, row.property_id): row for row in rows}
+    # A listing deleted by another worker since the snapshot was loaded is skipped
+    return [rows_by_key[key] for key in keys if key in rows_by_key]
+
+
+def _queue_property(mapper, connection, target):
+    object_session(target).info.setdefault('snapshot_keys', set()).add(property_key(target))
+
+
+def _queue_link(property_type):
+    id_column = PROPERTY_MODELS[property_type][1]
+
+    def handler(mapper, connection, target):
+        object_session(target).info.setdefault('snapshot_keys', set()).add(
+            (property_type, getattr(target, id_column)))
+
+    return handler
+
+
+def _queue_inserted(session, property_type, property_ids):
+    session.info.setdefault('snapshot_keys', set()).update(
+        (property_type, property_id) for property_id in property_ids)
+
+
+def register_snapshot_updates(snapshot):
+    """Applies the property and feature link writes of each committed session to the snapshot."""
+
+    for property_model, _ in PROPERTY_MODELS.values():
+        for operation in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(property_model, operation, _queue_property)
+    for property_type, link_model in PROPERTY_FEATURE_MODELS.items():
+        for operation in ('after_insert', 'after_delete'):
+            event.listen(link_model, operation, _queue_link(property_type))
+    listen_bulk_insert(_queue_inserted)
+
+    @event.listens_for(Session, 'after_commit')
+    def refresh_committed(session):
+        snapshot.refresh(session.info.pop('snapshot_keys', set()))
+
+    @event.listens_for(Session, 'after_soft_rollback')
+    def discard_rolled_back(session, previous_transaction):
+        session.info.pop('snapshot_keys', None)
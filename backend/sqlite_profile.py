@@ -0,0 +1,54 @@
+from sqlalchemy import event
+
+
+# Pragmas of each connection profile. 'wal' lets readers run alongside the writer and only
+# syncs the write-ahead log at checkpoints; 'default' restores SQLite's rollback journal
+# (the journal mode is stored in the database file, so it has to be set back explicitly).
+SQLITE_PROFILES = {
+    'wal': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+    'default': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+}
+
+
+def sqlite_pragmas(profile, mmap_size=0, cache_size=None, busy_timeout=None):
+    """
+    Returns the pragmas of a connection profile, plus the memory-mapped I/O size (bytes),
+    page cache size (KiB) and busy timeout (milliseconds) when they are set.
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile '{profile}'. Choose one of: {', '.join(SQLITE_PROFILES)}.")
+
+    pragmas = {}
+    # First, so that changing the journal mode waits for the other connections
+    if busy_timeout is not None:
+        pragmas['busy_timeout'] = busy_timeout
+    pragmas.update(SQLITE_PROFILES[profile])
+    if mmap_size:
+        pragmas['mmap_size'] = mmap_size
+    if cache_size:
+        pragmas['cache_size'] = -cache_size  # Negative values are in KiB rather than pages
+    return pragmas
+
+
+def set_pragmas(dbapi_connection, pragmas):
+    """
+    Runs pragmas on a DB-API SQLite connection. The journal mode is only changed when it
+    differs: leaving WAL mode needs the database to itself, so it can't be set each time a
+    connection opens while others are in use.
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        if name == 'journal_mode' and cursor.execute("PRAGMA journal_mode").fetchone()[0].upper() == value:
+            continue
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Sets the given pragmas on each new connection of an SQLite engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        set_pragmas(dbapi_connection, pragmas)
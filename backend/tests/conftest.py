@@ -0,0 +1,63 @@
+"""
+The tests run the application against a copy of the database of the data folder,
+upgraded to the latest migration, in a temporary folder also holding the uploads.
+Geocoding, uploads and image rendering happen in the request (no worker pools).
+"""
+
+import datetime
+import jwt
+import os
+import pytest
+import shutil
+import sys
+import tempfile
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix='list-my-space-tests-')
+shutil.copy(os.path.join(BACKEND_DIR, '..', 'data', 'list_my_space_db.sqlite'), DATA_DIR)
+
+# Read when the application is imported
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(DATA_DIR, 'list_my_space_db.sqlite')}",
+    'SECRET_KEY': 'test-secret-key',
+    'PROPERTY_CACHE': 'memory',
+    'GEOCODE_CACHE': 'memory',
+    'GEOCODE_WORKERS': '0',
+    'UPLOAD_WORKERS': '0',
+    'IMAGE_WORKERS': '0',
+})
+sys.path.insert(0, BACKEND_DIR)
+
+import app as application  # noqa: E402
+from flask_migrate import upgrade  # noqa: E402
+
+
+OWNER_ID = 1  # An owner of the database of the data folder
+
+
+@pytest.fixture(scope='session')
+def app():
+    application.app.config.update(TESTING=True, UPLOAD_FOLDER=os.path.join(DATA_DIR, 'uploads'))
+    with application.app.app_context():
+        upgrade(directory=os.path.join(BACKEND_DIR, 'migrations'))
+    yield application.app
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def token_headers(username, role):
+    """Authorization headers of a token signed for a user."""
+    token = jwt.encode({'username': username, 'role': role,
+                        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)},
+                       os.environ['SECRET_KEY'], algorithm='HS256')
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def admin_headers():
+    return token_headers('admin', 'ADMIN')
@@ -0,0 +1,61 @@
+import app as application
+from conftest import OWNER_ID
+import csv
+from data_models import ActionEnum, Land, LandCategoryEnum, LandTypeEnum, db
+import io
+import json
+import pytest
+
+
+@pytest.fixture(scope='module')
+def exported_lands(app):
+    """Five plots of land for sale in a city of their own. Returns their ids, newest first."""
+    with app.app_context():
+        lands = [Land(owner_id=OWNER_ID, ad_action=ActionEnum.SALE, ad_title=f'Plot {number}',
+                      ad_description='Building land', street_address=f'{number} Field Way', city='Exportstadt',
+                      state='Germany', zip_code='60311', price=50000 + number, latitude=50.0, longitude=8.0,
+                      land_area=500, land_type=LandTypeEnum.CONSTRUCTIONS,
+                      land_category=LandCategoryEnum.INTRAVILAN) for number in range(5)]
+        db.session.add_all(lands)
+        db.session.commit()
+        return [land.land_id for land in reversed(lands)]
+
+
+def export(client, headers, monkeypatch, query):
+    """Exports in batches of 2 rows. Returns the response and its chunks."""
+    monkeypatch.setattr(application, 'EXPORT_BATCH_SIZE', 2)
+    response = client.get(f'/api/properties/export?city=Exportstadt&{query}', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.is_streamed
+    chunks = [chunk.decode() for chunk in response.response]
+    return response, chunks
+
+
+def test_export_streams_ndjson(client, admin_headers, monkeypatch, exported_lands):
+    response, chunks = export(client, admin_headers, monkeypatch, 'format=ndjson')
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=properties.ndjson'
+    assert len(chunks) == 3  # One chunk per batch of rows
+    properties = [json.loads(line) for line in ''.join(chunks).splitlines()]
+    assert [entry['id'] for entry in properties] == exported_lands
+    assert properties[0]['title'] == 'Plot 4' and 'description' in properties[0]  # The 'full' fields
+
+
+def test_export_streams_csv(client, admin_headers, monkeypatch, exported_lands):
+    response, chunks = export(client, admin_headers, monkeypatch, 'format=csv&fields=id,price')
+
+    assert response.mimetype == 'text/csv'
+    assert len(chunks) == 3
+    rows = list(csv.reader(io.StringIO(''.join(chunks))))
+    assert rows[0] == ['id', 'price']
+    assert rows[1:] == [[str(land_id), str(50004 - number)] for number, land_id in enumerate(exported_lands)]
+
+
+def test_export_of_no_properties_is_a_csv_header(client, admin_headers, monkeypatch):
+    response, chunks = export(client, admin_headers, monkeypatch, 'format=csv&fields=id,price&max_price=0')
+    assert ''.join(chunks).splitlines() == ['id,price']
+
+
+def test_export_requires_a_token(client):
+    assert client.get('/api/properties/export').status_code == 401
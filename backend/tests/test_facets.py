@@ -0,0 +1,29 @@
+from data_models import Listing, Residence, db
+
+
+def fresh_facets(client):
+    """Facets of a filter matching every listing, counted in a pass over the listings."""
+    return client.get('/api/properties/facets?min_price=0').get_json()
+
+
+def test_migrated_counts_match_a_fresh_count(app, client):
+    response = client.get('/api/properties/facets').get_json()
+
+    with app.app_context():
+        assert response['total_properties'] == Listing.query.count() > 0
+    assert response == fresh_facets(client)
+
+
+def test_counts_follow_a_price_change(app, client):
+    with app.app_context():
+        residence = db.session.get(Residence, 1)
+        price = residence.price
+        residence.price = 750000
+        db.session.commit()
+        try:
+            response = client.get('/api/properties/facets').get_json()
+            assert response == fresh_facets(client)
+            assert {'value': '500000-1000000', 'count': 1} in response['facets']['price']
+        finally:
+            residence.price = price
+            db.session.commit()
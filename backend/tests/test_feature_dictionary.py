@@ -0,0 +1,33 @@
+from data_models import Feature, db
+import feature_dictionary
+from feature_dictionary import FeatureDictionary
+import pytest
+
+
+@pytest.mark.parametrize('upsert', [True, False], ids=['on-conflict', 'savepoints'])
+def test_resolve_creates_the_missing_features_once(app, monkeypatch, upsert):
+    if not upsert:
+        monkeypatch.setattr(feature_dictionary, 'UPSERT_INSERTS', {})
+    dictionary = FeatureDictionary()
+    names = [f'sauna {upsert}', 'balcony', f'wine cellar {upsert}']
+
+    with app.app_context():
+        ids = dictionary.resolve(db.session, names)
+        assert len(dictionary) == 1  # The created ids are cached once committed
+        db.session.commit()
+        assert len(dictionary) == 3
+
+        assert [db.session.get(Feature, feature_id).name for feature_id in ids] == names
+        # Another process has no cache: the features are found instead of created again
+        assert FeatureDictionary().resolve(db.session, names) == ids
+        assert Feature.query.filter(Feature.name.in_(names)).count() == 3
+
+
+def test_features_of_a_rolled_back_session_are_not_cached(app):
+    dictionary = FeatureDictionary()
+
+    with app.app_context():
+        dictionary.resolve(db.session, ['heated floor'])
+        db.session.rollback()
+        assert len(dictionary) == 0
+        assert Feature.query.filter_by(name='heated floor').count() == 0
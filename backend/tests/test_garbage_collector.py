@@ -0,0 +1,70 @@
+import app as application
+from conftest import OWNER_ID
+from data_models import Image, ImageBlob, Residence, db
+from garbage_collector import _blob_files, collect_garbage
+import io
+import os
+from PIL import Image as PILImage
+import time
+
+
+def png(color):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (64, 48), color).save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def add_and_delete_residence(client, headers):
+    """Adds a residence with an image of its own through the API, then deletes it.
+    Returns the hash of the image blob."""
+    data = {'property_type': 'residence', 'owner_id': str(OWNER_ID), 'ad_action': 'SALE',
+            'ad_title': 'Sold flat', 'ad_description': 'Sold', 'street_address': '5 Ash Road',
+            'city': 'Sweepstadt', 'state': 'Germany', 'zip_code': '10115', 'price': '150000',
+            'rooms_count': '2', 'surface_area': '50', 'land_area': '0',
+            'images': [(png((17, 99, 213)), 'flat.png')]}
+    response = client.post('/api/properties', data=data, headers=headers, content_type='multipart/form-data')
+    assert response.status_code == 201, response.get_json()
+
+    with application.app.app_context():
+        residence = Residence.query.filter_by(city='Sweepstadt').one()
+        residence_id, [sha256] = residence.residence_id, [image.blob_sha256 for image in residence.images]
+    response = client.delete('/api/delete_property', json={'property_type': 'residence', 'property_id': residence_id},
+                             headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return sha256
+
+
+def test_dry_run_keeps_the_garbage_it_reports(app, client, admin_headers, monkeypatch):
+    monkeypatch.setattr(application.geocoding_pool, 'submit', lambda *args, **kwargs: None)  # No network
+    sha256 = add_and_delete_residence(client, admin_headers)
+    upload_folder = app.config['UPLOAD_FOLDER']
+
+    with app.app_context():
+        blob = db.session.get(ImageBlob, sha256)
+        files = _blob_files(blob.path)
+        assert len(files) > 1  # The upload and its variants
+
+        # The blob is new: an upload not committed yet could be using it
+        report = collect_garbage(db.session, upload_folder, dry_run=True)
+        assert report['images'] >= 1 and report['blobs'] == 0
+
+        # Past the grace period
+        blob.created_at = blob.created_at.replace(year=blob.created_at.year - 1)
+        db.session.commit()
+        for path in files:
+            os.utime(path, (time.time() - 7200, time.time() - 7200))
+
+        dry_run = collect_garbage(db.session, upload_folder, batch_size=1, dry_run=True)
+        assert dry_run['blobs'] >= 1 and dry_run['files'] >= len(files)
+        assert dry_run['reclaimed_bytes'] >= sum(os.path.getsize(path) for path in files)
+        assert all(os.path.exists(path) for path in files)
+        assert db.session.get(ImageBlob, sha256) is not None
+        assert Image.query.filter_by(blob_sha256=sha256).count() == 1
+
+        removed = collect_garbage(db.session, upload_folder, batch_size=1)
+        assert removed == dict(dry_run, dry_run=False)
+        assert not any(os.path.exists(path) for path in files)
+        assert db.session.get(ImageBlob, sha256) is None
+        assert Image.query.filter_by(blob_sha256=sha256).count() == 0
+        assert collect_garbage(db.session, upload_folder, dry_run=True)['blobs'] == 0
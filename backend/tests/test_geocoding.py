@@ -0,0 +1,171 @@
+import app as application
+from conftest import OWNER_ID
+from data_models import GeocodeStatusEnum, Listing, Residence
+import geocoding
+import get_info
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import pytest
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+
+TIMEOUT = 'timeout'  # Answer sent after the client gave up
+NOT_FOUND = (200, {'features': []})
+
+
+def found(latitude, longitude):
+    return 200, {'features': [{'properties': {'lat': latitude, 'lon': longitude}}]}
+
+
+class StubGeocoder:
+    """
+    Local HTTP server answering like Geoapify. Each address gets its scripted answers in
+    turn, then keeps getting the last one; unknown addresses are not found.
+    """
+
+    def __init__(self):
+        self.answers = {}  # address -> [(status, body) or TIMEOUT]
+        self.requests = []  # Addresses asked, in order
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                address = parse_qs(urlparse(self.path).query)['text'][0]
+                stub.requests.append(address)
+                script = stub.answers.get(address, [NOT_FOUND])
+                answer = script.pop(0) if len(script) > 1 else script[0]
+                if answer == TIMEOUT:
+                    time.sleep(1)
+                    answer = NOT_FOUND
+                status, body = answer
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1/geocode/search'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def geocoder(app, monkeypatch):
+    """Points the geocoding at a stub, with an empty cache, short timeouts and no waiting between retries."""
+    stub = StubGeocoder()
+    monkeypatch.setattr(get_info, 'GEOCODER_URL', stub.url)
+    monkeypatch.setattr(get_info, 'geocode_cache', get_info.GeocodeCache())
+    monkeypatch.setattr(application.geocoding_pool, 'timeout', 0.2)
+    monkeypatch.setattr(application.geocoding_pool, 'retries', 3)
+    monkeypatch.setattr(application.geocoding_pool, 'backoff', 0.5)
+    stub.sleeps = []
+    # Only the pool's modules: the stub still has to sleep past the client timeout
+    monkeypatch.setattr(geocoding, 'time', SimpleNamespace(sleep=stub.sleeps.append))
+    monkeypatch.setattr(geocoding, 'random', SimpleNamespace(uniform=lambda low, high: 0))
+    yield stub
+    stub.close()
+
+
+def add_residence(client, headers, street, city):
+    """Adds a residence through the API. Returns its address, as sent to the geocoder."""
+    data = {'property_type': 'residence', 'owner_id': str(OWNER_ID), 'ad_action': 'SALE',
+            'ad_title': 'Garden flat', 'ad_description': 'Quiet street', 'street_address': street,
+            'city': city, 'state': 'Germany', 'zip_code': '10115', 'price': '250000', 'rooms_count': '2',
+            'surface_area': '60', 'land_area': '0',
+            'images': [(io.BytesIO(b'\x89PNG\r\n\x1a\n' + bytes(32)), 'flat.png')]}
+    response = client.post('/api/properties', data=data, headers=headers, content_type='multipart/form-data')
+    assert response.status_code == 201, response.get_json()
+    return f'{street}, {city}, Germany, 10115'
+
+
+def saved_residence(city):
+    with application.app.app_context():
+        residence = Residence.query.filter_by(city=city).one()
+        listing = Listing.query.filter_by(property_type='residence', property_id=residence.residence_id).one()
+        return residence.residence_id, residence.geocode_status, (listing.latitude, listing.longitude)
+
+
+def test_new_property_is_saved_pending_then_resolved(client, admin_headers, geocoder, monkeypatch):
+    geocoder.answers['1 Linden Road, Geotown, Germany, 10115'] = [found(52.5, 13.4)]
+    statuses_on_submit = []
+    submit = application.geocoding_pool.submit
+
+    def recording_submit(property_type, property_id, address, on_resolved=None):
+        statuses_on_submit.append(saved_residence('Geotown')[1])
+        return submit(property_type, property_id, address, on_resolved)
+
+    monkeypatch.setattr(application.geocoding_pool, 'submit', recording_submit)
+    add_residence(client, admin_headers, '1 Linden Road', 'Geotown')
+
+    assert statuses_on_submit == [GeocodeStatusEnum.PENDING]
+    _, status, coordinates = saved_residence('Geotown')
+    assert status == GeocodeStatusEnum.RESOLVED
+    assert coordinates == (52.5, 13.4)
+
+
+def test_address_not_found_fails(client, admin_headers, geocoder):
+    address = add_residence(client, admin_headers, '404 Nowhere Lane', 'Lostville')
+
+    _, status, coordinates = saved_residence('Lostville')
+    assert status == GeocodeStatusEnum.FAILED
+    assert coordinates == (None, None)
+    assert geocoder.requests == [address]  # Not found is an answer: it is not retried
+
+
+def test_timeouts_rate_limits_and_server_errors_are_retried(client, admin_headers, geocoder):
+    address = '7 Retry Street, Flakyburg, Germany, 10115'
+    geocoder.answers[address] = [TIMEOUT, (429, {}), (503, {}), found(48.1, 11.6)]
+    add_residence(client, admin_headers, '7 Retry Street', 'Flakyburg')
+
+    _, status, coordinates = saved_residence('Flakyburg')
+    assert status == GeocodeStatusEnum.RESOLVED
+    assert coordinates == (48.1, 11.6)
+    assert geocoder.requests == [address] * 4
+    assert geocoder.sleeps == [0.5, 1.0, 2.0]  # The backoff doubles
+
+
+def test_geocoder_failing_every_attempt_fails(client, admin_headers, geocoder):
+    address = '9 Outage Avenue, Downtown, Germany, 10115'
+    geocoder.answers[address] = [(500, {})]
+    add_residence(client, admin_headers, '9 Outage Avenue', 'Downtown')
+
+    assert saved_residence('Downtown')[1] == GeocodeStatusEnum.FAILED
+    assert geocoder.requests == [address] * 4  # The first attempt and 3 retries
+
+
+def test_address_change_is_geocoded_again(client, admin_headers, geocoder):
+    old_address = '3 Old Street, Movetown, Germany, 10115'
+    geocoder.answers[old_address] = [found(50.0, 8.0)]
+    add_residence(client, admin_headers, '3 Old Street', 'Movetown')
+    residence_id, _, coordinates = saved_residence('Movetown')
+    assert coordinates == (50.0, 8.0)
+
+    # Other fields don't touch the coordinates
+    url = f'/api/properties/residence/{residence_id}'
+    response = client.put(url, json={'owner_id': OWNER_ID, 'price': 260000}, headers=admin_headers)
+    assert response.status_code == 200
+    assert geocoder.requests == [old_address]
+
+    new_address = '5 New Street, Movetown, Germany, 10115'
+    geocoder.answers[new_address] = [found(50.1, 8.7)]
+    response = client.put(url, json={'owner_id': OWNER_ID, 'street_address': '5 New Street'},
+                          headers=admin_headers)
+    assert response.status_code == 200
+
+    _, status, coordinates = saved_residence('Movetown')
+    assert status == GeocodeStatusEnum.RESOLVED
+    assert coordinates == (50.1, 8.7)
+    assert geocoder.requests == [old_address, new_address]
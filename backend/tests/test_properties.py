@@ -0,0 +1,112 @@
+import app as application
+from conftest import OWNER_ID
+from contextlib import contextmanager
+from data_models import ActionEnum, Commercial, CommercialCategoryEnum, Image, Residence, db
+import io
+import pytest
+from sqlalchemy import event
+
+
+FEED_FIELDS = 'full,thumbnail,image_variants'  # Every field loaded from the image table
+
+
+@contextmanager
+def count_queries():
+    """Collects the SQL statements run on the database engine."""
+    statements = []
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_listings(city, count):
+    """Adds `count` residences and `count` commercials in a city, with one image each.
+    Returns the properties."""
+    properties = []
+    for number in range(count):
+        common = dict(owner_id=OWNER_ID, ad_action=ActionEnum.SALE, ad_title=f'Listing {number}',
+                      ad_description='Bright rooms near the station', street_address=f'{number} Main Street',
+                      city=city, state='Germany', zip_code='10115', price=100000 + number,
+                      latitude=50.11, longitude=8.68, surface_area=80, land_area=0)
+        properties += [Residence(rooms_count=3, **common),
+                       Commercial(commercial_category=CommercialCategoryEnum.OFFICE, **common)]
+    db.session.add_all(properties)
+    db.session.flush()
+    add_images(properties, 1)
+    return properties
+
+
+def add_images(properties, count):
+    for property_obj in properties:
+        property_obj.images.extend(Image(url=f'https://images.example.com/{id(property_obj)}-{number}.jpg')
+                                   for number in range(count))
+    db.session.commit()
+
+
+def test_migrations_fill_the_listings(app, client):
+    """The properties of the database of the data folder are listed right after the upgrade."""
+    response = client.get('/api/properties?city=frankfurt&property_type=residence&fields=id,city')
+    assert response.get_json()['total_properties'] == 5
+
+
+def test_migrations_fill_the_similarity_index(app, client):
+    """The migrated residences of Frankfurt are found similar to each other right after the upgrade."""
+    response = client.get('/api/properties/residence/1/similar?limit=50')
+    similar = {(entry['property_type'], entry['id']) for entry in response.get_json()['properties']}
+    assert {('residence', 2), ('residence', 3), ('residence', 4), ('residence', 5)} <= similar
+
+
+@pytest.mark.parametrize('property_type', ['residence', None], ids=['single-type', 'combined'])
+def test_feed_query_count_does_not_depend_on_images(app, client, property_type):
+    city = f"Querycount {property_type or 'all'}"
+    url = f'/api/properties?city={city}&fields={FEED_FIELDS}'
+    if property_type:
+        url += f'&property_type={property_type}'
+
+    with app.app_context():
+        properties = add_listings(city, 4)
+
+        with count_queries() as statements:
+            response = client.get(url)
+        one_image_queries = len(statements)
+        assert all(len(entry['images']) == 1 for entry in response.get_json()['properties'])
+
+        add_images(properties, 9)  # The commit drops the cached response
+        with count_queries() as statements:
+            response = client.get(url)
+        assert all(len(entry['images']) == 10 for entry in response.get_json()['properties'])
+
+    assert len(statements) == one_image_queries
+
+
+@pytest.mark.parametrize('limit', [0, -3, 1])
+def test_similar_properties_limit_is_at_least_one(app, client, limit):
+    with app.app_context():
+        residence = add_listings(f'Similartown {limit}', 4)[0]
+        url = f'/api/properties/residence/{residence.residence_id}/similar?limit={limit}'
+    assert len(client.get(url).get_json()['properties']) == 1
+
+
+def test_failed_image_write_of_an_update_is_an_error(app, client, admin_headers, monkeypatch):
+    def store_uploads(uploads, upload_folder, executor=None):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(application, 'store_uploads', store_uploads)
+    with app.app_context():
+        residence = add_listings('Fulldisk', 1)[0]
+        residence_id, price = residence.residence_id, residence.price
+
+    data = {'owner_id': str(OWNER_ID), 'price': '1',
+            'images': [(io.BytesIO(b'\x89PNG\r\n\x1a\n' + bytes(32)), 'flat.png')]}
+    response = client.put(f'/api/properties/residence/{residence_id}', data=data, headers=admin_headers,
+                          content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert 'No space left on device' in response.get_json()['error']
+    with app.app_context():
+        assert db.session.get(Residence, residence_id).price == price
@@ -0,0 +1,55 @@
+import app as application
+import os
+import pytest
+import query_cache
+from query_cache import MemoryCacheBackend, PropertyQueryCache, SQLiteCacheBackend
+import sqlite3
+from types import SimpleNamespace
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the cache by one moved forward by hand."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(query_cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_entries_expire_after_the_ttl(tmp_path, clock, backend):
+    backend = MemoryCacheBackend() if backend == 'memory' else SQLiteCacheBackend(str(tmp_path / 'cache.sqlite'))
+    cache = PropertyQueryCache(backend, ttl=60)
+    cache.set('key', {'properties': []}, ['residence:berlin'], cache.generation)
+
+    clock.now += 59
+    assert cache.get('key') == {'properties': []}
+    clock.now += 2
+    assert cache.get('key') is None
+    assert cache.stats()['expired_entries'] == 1
+
+
+def test_entries_without_ttl_are_kept_until_invalidated(clock):
+    cache = PropertyQueryCache(MemoryCacheBackend())
+    cache.set('key', {'properties': []}, ['residence:berlin'], cache.generation)
+
+    clock.now += 365 * 24 * 3600
+    assert cache.get('key') == {'properties': []}
+    cache.invalidate({'residence:berlin'})
+    assert cache.get('key') is None
+
+
+def test_write_of_another_process_is_served_after_the_ttl(app, client, clock, monkeypatch):
+    monkeypatch.setattr(application.property_cache, 'ttl', 60)
+    url = '/api/properties?city=Frankfurt&property_type=residence&fields=id,price'
+    prices = client.get(url).get_json()['properties']
+
+    # Another worker process commits a price change: this process isn't told
+    path = os.environ['DATABASE_URL'][len('sqlite:///'):]
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE listings SET price = price + 1 WHERE city_normalized = 'frankfurt'")
+    connection.close()
+    assert client.get(url).get_json()['properties'] == prices
+
+    clock.now += 61
+    assert [entry['price'] for entry in client.get(url).get_json()['properties']] == \
+           [entry['price'] + 1 for entry in prices]
@@ -0,0 +1,68 @@
+import app as application
+from conftest import OWNER_ID, token_headers
+from data_models import ActionEnum, Residence, ResidenceFeature, db
+
+
+# Customers of the database of the data folder
+BETTY = token_headers('BettyB2', 'CUSTOMER')
+BEN = token_headers('Benny', 'CUSTOMER')
+
+
+def save_search(client, headers, name, params):
+    response = client.post('/api/saved_searches', json={'name': name, 'params': params}, headers=headers)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+
+def add_residence(title, price, features=()):
+    """Adds a residence in Alertham and notifies the saved searches it matches, as the
+    geocoding of a new property does. Returns the number of notifications."""
+    with application.app.app_context():
+        residence = Residence(owner_id=OWNER_ID, ad_action=ActionEnum.SALE, ad_title=title,
+                              ad_description='Close to the park', street_address='3 Elm Street', city='Alertham',
+                              state='Germany', zip_code='60311', price=price, latitude=50.0, longitude=8.0,
+                              surface_area=70, land_area=0, rooms_count=3)
+        db.session.add(residence)
+        db.session.flush()
+        for feature_id in application.feature_dictionary.resolve(db.session, list(features)):
+            db.session.add(ResidenceFeature(residence_id=residence.residence_id, feature_id=feature_id))
+        db.session.commit()
+        return application.saved_search_index.notify('residence', residence.residence_id)
+
+
+def notifications(client, headers):
+    response = client.get('/api/notifications', headers=headers)
+    assert response.status_code == 200
+    return [notification['message'] for notification in response.get_json()['notifications']
+            if 'Alertham' in notification['message']]
+
+
+def test_matching_properties_notify_each_customer_once(app, client):
+    save_search(client, BETTY, 'Cheap with balcony',
+                {'city': 'alertham', 'max_price': 300000, 'features': ['balcony']})
+    save_search(client, BETTY, 'Any flat', {'city': 'Alertham', 'property_type': 'residence'})
+    lofts = save_search(client, BEN, 'Lofts', {'city': 'Alertham', 'q': 'loft'})
+
+    assert add_residence('Bright loft', 250000, ['balcony']) == 2
+    [message] = notifications(client, BETTY)  # One notification naming both searches
+    assert "'Cheap with balcony'" in message and "'Any flat'" in message
+    assert message.endswith(': Bright loft in Alertham for 250000.')
+    assert notifications(client, BEN) == [
+        "New residence matching your saved search 'Lofts': Bright loft in Alertham for 250000."]
+
+    # Too expensive and without a balcony: only the searches without those filters match
+    assert add_residence('Family house', 400000) == 1
+    assert len(notifications(client, BETTY)) == 2 and len(notifications(client, BEN)) == 1
+
+    # A deleted search no longer notifies
+    assert client.delete(f'/api/saved_searches/{lofts}', headers=BEN).status_code == 200
+    add_residence('Loft with a view', 280000)
+    assert len(notifications(client, BEN)) == 1
+
+
+def test_saved_search_parameters_are_validated(app, client, admin_headers):
+    response = client.post('/api/saved_searches', json={'name': 'Near me', 'params': {'radius_km': 5}},
+                           headers=BETTY)
+    assert response.status_code == 400
+    response = client.post('/api/saved_searches', json={'name': 'All', 'params': {}}, headers=admin_headers)
+    assert response.status_code == 403
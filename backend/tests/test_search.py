@@ -0,0 +1,115 @@
+import app as application
+from conftest import OWNER_ID
+from data_models import ActionEnum, Commercial, CommercialCategoryEnum, Residence, ResidenceFeature, db
+import datetime
+
+
+def add_residences(city, *locations, **fields):
+    """Adds a residence for sale per (latitude, longitude) pair in a city. Returns their ids."""
+    residences = []
+    for number, (latitude, longitude) in enumerate(locations):
+        values = dict(owner_id=OWNER_ID, ad_action=ActionEnum.SALE, ad_title=f'Residence {number}',
+                      ad_description='Quiet street', street_address=f'{number} Park Lane', city=city,
+                      state='Germany', zip_code='60311', price=200000 + number, latitude=latitude,
+                      longitude=longitude, surface_area=90, land_area=0, rooms_count=4)
+        values.update(fields)
+        residences.append(Residence(**values))
+    db.session.add_all(residences)
+    db.session.commit()
+    return [residence.residence_id for residence in residences]
+
+
+def search(client, query):
+    """Returns the ids of the residences found by a search."""
+    response = client.get(f'/api/properties?property_type=residence&{query}')
+    assert response.status_code == 200, response.get_json()
+    return [entry['id'] for entry in response.get_json()['properties']]
+
+
+def test_radius_and_bbox_search(app, client):
+    with app.app_context():
+        # About 1 km, 5 km and 20 km north of the origin
+        near, middle, far = add_residences('Radiusville', (50.009, 8.0), (50.045, 8.0), (50.18, 8.0))
+
+    origin = 'city=Radiusville&lat=50.0&lon=8.0'
+    assert sorted(search(client, f'{origin}&radius_km=2')) == [near]
+    assert sorted(search(client, f'{origin}&radius_km=10')) == [near, middle]
+    assert sorted(search(client, 'city=Radiusville&bbox=7.9,50.02,8.1,50.2')) == [middle, far]
+
+    response = client.get(f'/api/properties?property_type=residence&{origin}&sort=distance&fields=id')
+    properties = response.get_json()['properties']
+    assert [entry['id'] for entry in properties] == [near, middle, far]
+    distances = [entry['distance_km'] for entry in properties]
+    assert distances == sorted(distances) and 0.9 < distances[0] < 1.1
+
+
+def test_features_filter_requires_every_feature(app, client):
+    with app.app_context():
+        both, balcony_only, neither = add_residences('Featureham', (50.0, 8.0), (50.0, 8.0), (50.0, 8.0))
+        balcony, garden = application.feature_dictionary.resolve(db.session, ['balcony', 'garden'])
+        db.session.add_all([ResidenceFeature(residence_id=both, feature_id=balcony),
+                            ResidenceFeature(residence_id=both, feature_id=garden),
+                            ResidenceFeature(residence_id=balcony_only, feature_id=balcony)])
+        db.session.commit()
+
+    assert sorted(search(client, 'city=Featureham&features=balcony')) == [both, balcony_only]
+    assert search(client, 'city=Featureham&features=balcony&features=garden') == [both]
+    assert search(client, 'city=Featureham&features=balcony&features=no+such+feature') == []
+    assert len(search(client, 'city=Featureham')) == 3
+
+
+def test_keyword_search_ranks_title_matches_first(app, client):
+    with app.app_context():
+        # Created first, so the newest-first order alone would list it last
+        [in_title] = add_residences('Textdorf', (50.0, 8.0), ad_title='Penthouse with terrace')
+        [in_description] = add_residences('Textdorf', (50.0, 8.0), ad_title='Top floor flat',
+                                          ad_description='A penthouse feel under the roof')
+        add_residences('Textdorf', (50.0, 8.0), ad_title='Garden flat')
+
+    assert search(client, 'city=Textdorf&q=pent') == [in_title, in_description]  # Prefix of penthouse
+    assert search(client, 'city=Textdorf&q=Penthouse+terr') == [in_title]  # Every word has to match
+    assert search(client, 'city=Textdorf&q=penthouse+OR+garden') == []  # Operators are plain words
+    assert len(search(client, 'city=Textdorf&q=%21%3F')) == 3  # No words: no keyword filter
+
+
+def test_cursor_pages_cover_the_feed_once(app, client):
+    """Walking the next_cursor chain yields every listing once, in the order of the numbered pages."""
+    with app.app_context():
+        for days in range(3):  # Listings sharing a date are ordered by type and id
+            date = datetime.date(2020, 1, 1) + datetime.timedelta(days=days)
+            add_residences('Cursorburg', *[(50.0, 8.0)] * 5, ad_creation_date=date)
+            db.session.add_all(Commercial(owner_id=OWNER_ID, ad_action=ActionEnum.SALE, ad_title=f'Office {number}',
+                                          ad_description='Open space', street_address=f'{number} Mill Road',
+                                          city='Cursorburg', state='Germany', zip_code='60311', price=300000,
+                                          latitude=50.0, longitude=8.0, surface_area=120, land_area=0,
+                                          commercial_category=CommercialCategoryEnum.OFFICE,
+                                          ad_creation_date=date)
+                               for number in range(3))
+            db.session.commit()
+
+    keys, cursor, pages = [], '', 0
+    while cursor is not None:
+        response = client.get(f'/api/properties?city=Cursorburg&fields=id,property_type&cursor={cursor}'
+                              f'&with_total=true')
+        body = response.get_json()
+        assert body['total_properties'] == 24
+        keys += [(entry['property_type'], entry['id']) for entry in body['properties']]
+        cursor, pages = body['next_cursor'], pages + 1
+
+    assert pages == 3 and len(keys) == len(set(keys)) == 24
+    numbered = []
+    for page in (1, 2, 3):
+        body = client.get(f'/api/properties?city=Cursorburg&fields=id,property_type&page={page}').get_json()
+        numbered += [(entry['property_type'], entry['id']) for entry in body['properties']]
+    assert keys == numbered
+
+
+def test_invalid_cursor_is_rejected(app, client):
+    response = client.get('/api/properties?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+
+def test_location_search_needs_both_coordinates(app, client):
+    response = client.get('/api/properties?lat=50.0&radius_km=5')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()